@@ -98,6 +98,14 @@ const GamePage = () => {
   const [player1, setPlayer1] = useState({ ...userInfo, color: '', time: 300 });
   //Store the timer reference for smooth cleanup
   const timerRef = useRef(null);
+  //Clocks in seconds as of the last server payload: { white, black, turn, at } with at on performance.now()
+  const clockRef = useRef(null);
+  //Smallest (local time - server_time) seen: clock skew plus the fastest delivery
+  const skewRef = useRef(null);
+  //Number of half-moves applied to the local board, compared against the server's ply
+  const plyRef = useRef(0);
+  //Current game id, read by the reconnect handshake
+  const gameIdRef = useRef(null);
   //Store socket reference 
   const socketRef = useRef(null);
   const createSocket = () => {
@@ -106,6 +114,8 @@ const GamePage = () => {
     // Create socket with reconnection options
     const socket = io('http://127.0.0.1:5000', {
       query: { token },
+      // Evaluated on every (re)connect: lets the server send only the moves we missed
+      auth: (cb) => cb({ gameId: gameIdRef.current, ply: plyRef.current }),
       reconnection: true,
       reconnectionAttempts: 5,
       reconnectionDelay: 1000,
@@ -126,6 +136,11 @@ const GamePage = () => {
       toast.error(`Connection error: ${err.message || "Unknown error"}`);
     });
 
+    // Acknowledged at once: the server times the round trip to credit network lag back to our clock
+    socket.on('lag_ping', (data, ack) => {
+      if (ack) ack();
+    });
+
     socket.on('disconnect', (reason) => {
       console.log('Socket disconnected:', reason);
       toast.warning(`Disconnected: ${reason}. Attempting to reconnect...`);
@@ -175,39 +190,37 @@ const GamePage = () => {
     setActive(false);
     clearInterval(timerRef.current);
   };
-  //Ongoing functionality
+  //Ongoing functionality: run the side to move's clock down from the last server clock
   const startTimer = () => {
     if (timerRef.current) {
       clearInterval(timerRef.current);
     }
   
     timerRef.current = setInterval(() => {
-      if (turn === 'white') {
-        setPlayer1(p1 => {
-          if (p1.color === 'white') {
-            const newTime = p1.time - 1;
-            if (newTime <= 0) {
-              clearInterval(timerRef.current);
-              return { ...p1, time: 0 };
-            }
-            return { ...p1, time: newTime };
-          }
-          return p1;
-        });
-      } else if (turn === 'black') {
-        setPlayer2(p2 => {
-          if (p2.color === 'black') {
-            const newTime = p2.time - 1;
-            if (newTime <= 0) {
-              clearInterval(timerRef.current);
-              return { ...p2, time: 0 };
-            }
-            return { ...p2, time: newTime };
-          }
-          return p2;
-        });
-      }
-    }, 1000);
+      const clock = clockRef.current;
+      if (!clock) return;
+      const times = { white: clock.white, black: clock.black };
+      times[clock.turn] = Math.max(0, times[clock.turn] - (performance.now() - clock.at) / 1000);
+      setPlayer1(p1 => ({ ...p1, time: times[p1.color] ?? p1.time }));
+      setPlayer2(p2 => ({ ...p2, time: times[p2.color] ?? p2.time }));
+    }, 100);
+  };
+
+  //Take the clocks from a server payload, less the time it spent in flight beyond the fastest delivery seen
+  const syncClock = (data) => {
+    if (data.player1_time === undefined || data.player2_time === undefined) return;
+    let age = 0;
+    if (data.server_time !== undefined) {
+      const behind = Date.now() - data.server_time;
+      if (skewRef.current === null || behind < skewRef.current) skewRef.current = behind;
+      age = behind - skewRef.current;
+    }
+    clockRef.current = {
+      white: data.player1_time,
+      black: data.player2_time,
+      turn: data.turn,
+      at: performance.now() - age
+    };
   };
   
 
@@ -226,10 +239,11 @@ const GamePage = () => {
       if (move) {
         // Update local board state
         setFen(game.fen());
+        plyRef.current += 1;
 
         // Send move to server in UCI format (what the backend expects)
         if (socketRef.current) {
-          const uciMove = `${source}${target}`;
+          const uciMove = `${source}${target}${move.promotion || ''}`;
           socketRef.current.emit('make_move', {
             gameId,
             move: uciMove
@@ -256,6 +270,16 @@ const GamePage = () => {
     //Handle events triggered from server
     socket.on('error', error => {
       toast.error(error.message || "An error occurred");
+      if (error.event === 'make_move' && error.gameId && error.gameId === gameIdRef.current) {
+        // The server refused a move we already played on our board
+        if (error.ply !== undefined && error.ply !== null && plyRef.current === error.ply + 1 && game.undo()) {
+          plyRef.current = error.ply;
+          setFen(game.fen());
+          setTurn(game.turn() === 'w' ? 'white' : 'black');
+        } else {
+          socket.emit('request_board_state', { gameId: error.gameId });
+        }
+      }
     });
 
     socket.on('connect_error', err => {
@@ -272,9 +296,11 @@ const GamePage = () => {
       const time = gameTimeMapping[gameType] || 300;
       setWaitingForOpponent(false);
       setGameId(gameId);
+      gameIdRef.current = gameId;
 
       // Reset game state for new game
       const newGame = new Chess();
+      plyRef.current = 0;
       setGame(newGame);
       setFen(newGame.fen());
       setTurn('white');
@@ -289,6 +315,7 @@ const GamePage = () => {
       // Set my color as opposite of opponent
       const myColor = opponent.color.toLowerCase() === 'white' ? 'black' : 'white';
       setPlayer1(prev => ({ ...prev, color: myColor, time }));
+      clockRef.current = { white: time, black: time, turn: 'white', at: performance.now() };
 
       setActive(true);
       startTimer();
@@ -299,13 +326,21 @@ const GamePage = () => {
     socket.on('move_made', (moveData) => {
       try {
         console.log("Received move from server:", moveData);
-        const { move, fen: serverFen, turn: serverTurn } = moveData;
+        const { move, fen: serverFen, ply } = moveData;
 
         
         if (serverFen) {
           setFen(serverFen);
           setGame(new Chess(serverFen));
           setTurn(serverFen.split(' ')[1] === 'w' ? 'white' : 'black');
+          if (ply !== undefined) plyRef.current = ply;
+        } else if (ply !== undefined && ply <= plyRef.current) {
+          // Our own move coming back from the room broadcast, already on the board
+        } else if (ply !== undefined && ply > plyRef.current + 1) {
+          // Missed at least one move: ask for the ones after our last ply
+          if (socketRef.current && gameId) {
+            socketRef.current.emit('resync', { gameId, ply: plyRef.current });
+          }
         } else if (move) {
           // Otherwise, apply the move to our local board
           // Check if we need to convert UCI to algebraic or use directly
@@ -318,6 +353,7 @@ const GamePage = () => {
             : game.move(move);
 
           if (moveResult) {
+            plyRef.current += 1;
             setFen(game.fen());
             setTurn(game.turn() === 'w' ? 'white' : 'black');
           } else {
@@ -332,10 +368,7 @@ const GamePage = () => {
         }
 
         // Update timers if server sends time data
-        if (moveData.player1_time !== undefined && moveData.player2_time !== undefined) {
-          setPlayer1(prev => ({ ...prev, time: moveData.player1_time }));
-          setPlayer2(prev => ({ ...prev, time: moveData.player2_time }));
-        }
+        syncClock(moveData);
       } catch (err) {
         toast.error(`Error processing move: ${err.message}`);
         console.error("Move processing error:", err);
@@ -347,6 +380,51 @@ const GamePage = () => {
       }
     });
 
+    socket.on('board_state_update', (state) => {
+      const { fen: serverFen, ply } = state;
+      setFen(serverFen);
+      setGame(new Chess(serverFen));
+      setTurn(serverFen.split(' ')[1] === 'w' ? 'white' : 'black');
+      if (ply !== undefined) plyRef.current = ply;
+      syncClock(state);
+    });
+
+    socket.on('moves_since', (state) => {
+      const { from_ply, moves } = state;
+      if (from_ply !== plyRef.current) {
+        // Our board moved on since the request; fall back to the full position
+        socket.emit('request_board_state', { gameId: state.gameId });
+        return;
+      }
+      for (const move of moves) {
+        const moveResult = game.move({
+          from: move.substring(0, 2),
+          to: move.substring(2, 4),
+          promotion: move.length === 5 ? move.charAt(4) : undefined
+        });
+        if (!moveResult) {
+          socket.emit('request_board_state', { gameId: state.gameId });
+          return;
+        }
+        plyRef.current += 1;
+      }
+      setFen(game.fen());
+      setTurn(game.turn() === 'w' ? 'white' : 'black');
+      syncClock(state);
+    });
+
+    socket.on('opponent_disconnected', ({ player, grace }) => {
+      if (player !== player1.email) {
+        toast.warning(`Opponent disconnected. They have ${grace} seconds to return.`);
+      }
+    });
+
+    socket.on('opponent_reconnected', ({ player }) => {
+      if (player !== player1.email) {
+        toast.info("Opponent reconnected");
+      }
+    });
+
     socket.on('game_over', ({ winner, reason }) => {
       // Determine the winner message
       console.log('winner player1', winner, player1)
@@ -370,13 +448,18 @@ const GamePage = () => {
       socket.off('waiting_for_opponent');
       socket.off('game_found');
       socket.off('move_made');
+      socket.off('board_state_update');
+      socket.off('moves_since');
+      socket.off('opponent_disconnected');
+      socket.off('opponent_reconnected');
       socket.off('game_over');
       clearInterval(timerRef.current);
     };
   }, [gameType, player1.email, player1.color, player2.email, player2.color, game]);
 
   // Format time as minutes:seconds
-  const formatTime = (seconds) => {
+  const formatTime = (time) => {
+    const seconds = Math.floor(time);
     const mins = Math.floor(seconds / 60);
     const secs = seconds % 60;
     return `${mins}:${secs < 10 ? '0' : ''}${secs}`;
@@ -1,32 +1,93 @@
-from flask import Flask, request, jsonify, session
-from flask_socketio import SocketIO, emit, disconnect, join_room, leave_room
+# Picks the concurrency model; in gevent mode this patches the stdlib, so it goes first
+from concurrency import monkey_patch, blocking, run_blocking, ASYNC_MODE
+monkey_patch()
+from flask import Flask, request, jsonify, g, Response
+from flask_socketio import SocketIO, emit, disconnect, join_room
 import chess
 import threading
+import functools
 import sqlite3
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, decode_token
-from flask_bcrypt import Bcrypt
 from dotenv import load_dotenv
 import os
-import io
+import base64
 import time
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import buildDatabase
+from clock_scheduler import ClockScheduler
+from db import ConnectionPool
+from cluster import cluster_from_env
+from spectators import SpectatorFanout, snapshot
+from position_cache import PositionCache, STATUS_CHECKMATE, STATUS_STALEMATE, STATUS_INSUFFICIENT_MATERIAL
+from password_hasher import hasher_from_env, HasherBusy
+from game_journal import journal_from_env
+from flow_control import ALLOW, CUT_OFF, WARN, EventLimiter, OutgoingBacklog, parse_limits
+from lag_compensation import LagQuota, LagTracker, wall_ms
+from tournament import ARENA, CREATED, KINDS, SWISS, Tournament
+from bot import LEVELS as BOT_LEVELS, bot_email, bot_level, bot_pool_from_env, bot_users, move_budget
+from user_cache import IdentityIndex, TTLCache
+from move_codec import row_pgn, to_san
+import explorer
+from game_export import ExportFilters, FORMATS, export_chunks, gzip_chunks
+from ratings import stats_for_user, stats_dict, default_stats, RESULT_DRAW, RESULT_WHITE_WINS, RESULT_BLACK_WINS
+from game_writer import GameWriter, FinishedGame
 from flask_cors import CORS
 import uuid
 import random
-# Helper to establish a database connection
+import atexit
+import logs
+from metrics import Counter, Gauge, Histogram, render as render_metrics, timed, timed_lock
+from collections import OrderedDict
+# Helper to check out a database connection; conn.close() returns it to the pool
 def get_connection():
-    conn = sqlite3.connect('chess.db')
-    conn.row_factory = sqlite3.Row  # To access columns by name
+    conn = db_pool.acquire()
     cur = conn.cursor()
     return conn, cur
 
 # Load environment variables
 load_dotenv()
+logs.configure()
+log = logs.get_logger('app')
+# Shared pool of WAL-mode connections, reused across requests
+db_pool = ConnectionPool('chess.db', size=int(os.getenv('DB_POOL_SIZE', 8)))
+# Taken usernames/emails for availability checks, and profiles by email
+identity_index = IdentityIndex(db_pool, refresh_interval=float(os.getenv('USER_INDEX_REFRESH_SECONDS', 1)))
+identity_index.warm()
+# Each bot level plays as its own user so its games are stored and rated.
+# The password is not a bcrypt hash and log_in turns bot emails away.
+with db_pool.acquire() as conn:
+    for username, email in bot_users():
+        if not identity_index.email_taken(email):
+            conn.execute('INSERT OR IGNORE INTO user (username, email, password) VALUES (?, ?, ?)',
+                         (username, email, '!bot'))
+            identity_index.add(username, email)
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+                      ttl=float(os.getenv('USER_CACHE_TTL_SECONDS', 30)))
+# Finished games are batched into game_history off the socket threads; their
+# players' cached profiles carry stats that just changed
+game_writer = GameWriter(db_pool,
+                         batch_size=int(os.getenv('GAME_WRITER_BATCH_SIZE', 50)),
+                         flush_interval_ms=int(os.getenv('GAME_WRITER_FLUSH_MS', 500)),
+                         on_flush=lambda batch: user_cache.invalidate(*{email for game in batch
+                                                                         for email in (game.white, game.black)}))
+# bcrypt runs in worker processes, forked by start_services() before the server starts its threads
+password_hasher = hasher_from_env()
+# Computer opponent searches, also in worker processes
+bot_pool = bot_pool_from_env()
+GAME_TYPES = ['Blitz', 'Rapid', 'Bullet']
+# Shared player/game/queue state; in-process unless CLUSTER_STORE is set
+cluster = cluster_from_env(GAME_TYPES, os.getenv('JWT_SECRET_KEY'))
+store = cluster.store
 app = Flask(__name__)
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
 CORS(app, supports_credentials=True)
-socketio = SocketIO(app, cors_allowed_origins=["http://localhost:5173"], allow_upgrades=True)
-bcrypt = Bcrypt(app)
+# async_handlers=False: each connection's events run in order on its own reader
+# thread (greenlet in gevent mode) instead of a new thread per event, so a
+# client sending faster than it is served fills its own TCP window and waits,
+# rather than spawning threads that compete with every other player
+socketio = SocketIO(app, cors_allowed_origins=["http://localhost:5173"], allow_upgrades=True,
+                    async_mode=ASYNC_MODE, async_handlers=False, **cluster.socketio_options())
 jwt = JWTManager(app)
 
 # Helper function for standardized response
@@ -36,7 +97,21 @@ def make_response(message, data={}, code=200):
     } | data
     return jsonify(response), code
 
+# Too many logins/sign-ups already waiting on the password hasher
+def busy_response():
+    response, code = make_response('Server busy, try again shortly', code=503)
+    response.headers['Retry-After'] = '1'
+    return response, code
+
+# A hasher worker died or hung; the hasher has already replaced its pool
+def hasher_failed_response(e):
+    log.warning('password_hasher_failed', error=type(e).__name__)
+    response, code = make_response('Password check unavailable, try again shortly', code=503)
+    response.headers['Retry-After'] = '1'
+    return response, code
+
 @app.route('/auth/log-in', methods=['POST'])
+@blocking
 def log_in():
     data = request.get_json()
     email = data.get('email')
@@ -44,61 +119,90 @@ def log_in():
 
     if not email or not password:
         return make_response('Email or password not specified', code=400)
+    if bot_level(email) is not None:
+        return make_response('Invalid email or password', code=400)
     
     conn, cur = get_connection()
     try:
         cur.execute('SELECT * FROM user WHERE email = ?', (email,))
         user = cur.fetchone()
-        
-        if user and bcrypt.check_password_hash(user['password'], password):
-            token = create_access_token(identity=email)
-            return make_response('User logged in successfully', {'token': token})
-        else:
-            return make_response('Invalid email or password', code=400)
     except sqlite3.Error as e:
         return make_response('Database error: ' + str(e), code=500)
     finally:
+        # Not held while the password is checked
         conn.close()
+        
+    try:
+        ok, new_hash = password_hasher.verify(user['password'], password) if user else (False, None)
+    except HasherBusy:
+        return busy_response()
+    except (BrokenProcessPool, TimeoutError) as e:
+        return hasher_failed_response(e)
+    if not ok:
+        return make_response('Invalid email or password', code=400)
+    
+    if new_hash:
+        # Work factor changed since this password was stored
+        conn, cur = get_connection()
+        try:
+            cur.execute('UPDATE user SET password = ? WHERE email = ? AND password = ?', (new_hash, email, user['password']))
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning('password_rehash_failed', email=email, error=str(e))
+        finally:
+            conn.close()
+    token = create_access_token(identity=email)
+    return make_response('User logged in successfully', {'token': token})
 
 # Route to check username availability
 @app.route('/auth', methods=['GET'])
+@blocking
 def check_username_availability():
     username = request.args.get('username')
     
     if not username:
         return make_response('Username not specified', code=400)
     
-    conn, cur = get_connection()
     try:
-        cur.execute('SELECT username FROM user WHERE username = ?', (username,))
-        user = cur.fetchone()
-        
-        if user:
+        if identity_index.username_taken(username):
             return make_response('Username already exists', code=409)
         return make_response('Username is available')
     except sqlite3.Error as e:
         return make_response('Database error: ' + str(e), code=500)
-    finally:
-        conn.close()
 
 # Route for user sign-up
 @app.route('/auth/sign-up', methods=['POST'])
+@blocking
 def sign_up():
     data = request.get_json()
-    print(data)
     password = data.get('password')
     username = data.get('username')
     email=data.get('email')
     if not email or not password or not username:
         return make_response('All fields (email, password, username) are required', code=400)
+    try:
+        # Taken names are turned away before paying for a hash
+        if identity_index.username_taken(username):
+            return make_response('Username already exists', code=409)
+        if identity_index.email_taken(email):
+            return make_response('Email already registered', code=409)
+    except sqlite3.Error as e:
+        return make_response('Database error: ' + str(e), code=500)
+    
+    try:
+        # Hash password before storing, without holding a database connection
+        hashed_password = password_hasher.hash(password)
+    except HasherBusy:
+        return busy_response()
+    except (BrokenProcessPool, TimeoutError) as e:
+        return hasher_failed_response(e)
     
     conn, cur = get_connection()
     try:
-        # Hash password before storing
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-        
         cur.execute('INSERT INTO user (username, email, password) VALUES (?, ?, ?)', (username, email, hashed_password,))
         conn.commit()
+        identity_index.add(username, email)
+        user_cache.invalidate(email)
         token = create_access_token(identity=email)
         return make_response('Successfully signed up', {'token': token})
     except sqlite3.Error as e:
@@ -108,56 +212,368 @@ def sign_up():
 
 # Route to get user info (protected)
 @app.route('/get_user_info', methods=['GET'])
+@blocking
 @jwt_required()
 def get_user_info():
+    email = get_jwt_identity() # Extract user ID from JWT
     try:
-        email = get_jwt_identity() # Extract user ID from JWT
-        conn, cur = get_connection()
-        cur.execute('SELECT * FROM user_view WHERE email = ?', (email,))
-        user = cur.fetchone()
+        user = user_cache.get(email, load_user_info)
         if user:
-            return make_response('User info found', {'user': dict(user)})
+            return make_response('User info found', {'user': user})
         return make_response('User not found', code=404)
     except Exception as e:
         return make_response('Error fetching user info: ' + str(e), code=500)
+
+# user_view row plus per-time-control stats, or None; read through user_cache
+def load_user_info(email):
+    conn, cur = get_connection()
+    try:
+        cur.execute('SELECT * FROM user_view WHERE email = ?', (email,))
+        user = cur.fetchone()
+        if not user:
+            return None
+        user = dict(user)
+        stats = stats_for_user(cur, user['userid'])
+        user['stats'] = {game_type: stats.get(game_type) or default_stats() for game_type in GAME_TYPES}
+        return user
     finally:
         conn.close()
 
+# A player's rating in one time control, read through user_cache
+def player_rating(email, game_type):
+    user = run_blocking(user_cache.get, email, load_user_info)
+    return (user['stats'][game_type] if user else default_stats())['rating']
+
+# Games page size for /games
+GAMES_PAGE_SIZE = 20
+GAMES_MAX_PAGE_SIZE = 100
+
+# One page of a user's games, newest first. Each branch walks one of the
+# (userid_x, date_of_game, gameid) indexes, so only `limit` rows are touched.
+GAMES_PAGE_QUERY = """
+    SELECT gh.gameid AS gameid,
+           u1.username AS username_1,
+           u2.username AS username_2,
+           gh.userid_1 AS userid_1,
+           gh.userid_2 AS userid_2,
+           gh.time_control AS time_control,
+           gh.result AS result,
+           gh.date_of_game AS date_of_game{pgn_column}
+    FROM (
+        SELECT gameid, date_of_game FROM (
+            SELECT gameid, date_of_game FROM game_history
+            WHERE userid_1 = :userid {keyset}
+            ORDER BY date_of_game DESC, gameid DESC LIMIT :limit
+        )
+        UNION ALL
+        SELECT gameid, date_of_game FROM (
+            SELECT gameid, date_of_game FROM game_history
+            WHERE userid_2 = :userid AND userid_1 != :userid {keyset}
+            ORDER BY date_of_game DESC, gameid DESC LIMIT :limit
+        )
+        ORDER BY date_of_game DESC, gameid DESC LIMIT :limit
+    ) page
+    JOIN game_history gh ON gh.gameid = page.gameid
+    JOIN user u1 ON gh.userid_1 = u1.userid
+    JOIN user u2 ON gh.userid_2 = u2.userid
+    ORDER BY page.date_of_game DESC, page.gameid DESC
+"""
+GAMES_KEYSET = "AND (date_of_game, gameid) < (:cursor_date, :cursor_gameid)"
+GAMES_PGN_COLUMNS = ',\n           gh.pgn AS pgn, gh.moves AS moves, gh.termination AS termination'
+
+GAME_QUERY = '''
+    SELECT gh.gameid AS gameid,
+           u1.username AS username_1,
+           u2.username AS username_2,
+           gh.userid_1 AS userid_1,
+           gh.userid_2 AS userid_2,
+           gh.time_control AS time_control,
+           gh.result AS result,
+           gh.date_of_game AS date_of_game,
+           gh.pgn AS pgn, gh.moves AS moves, gh.termination AS termination
+    FROM game_history gh
+    JOIN user u1 ON gh.userid_1 = u1.userid
+    JOIN user u2 ON gh.userid_2 = u2.userid
+    WHERE gh.gameid = ?
+'''
+
+# Row with the packed moves swapped for PGN text; rows that still have their stored PGN keep it
+def game_with_pgn(row):
+    game = dict(row)
+    game['pgn'] = row_pgn(row)
+    del game['moves'], game['termination']
+    return game
+
+def encode_games_cursor(game):
+    raw = f"{game['date_of_game']}|{game['gameid']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_games_cursor(cursor):
+    date_of_game, gameid = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+    return date_of_game, int(gameid)
+
 # Route to get game history
 @app.route('/games', methods=['GET'])
+@blocking
 @jwt_required()
 def get_games():
     userid = request.args.get('userid')
     gameid = request.args.get('gameid')
+    cursor = request.args.get('cursor')
+    # summary=true leaves out the PGN text; fetch it per game from /games/<gameid>/pgn
+    summary = request.args.get('summary', 'false').lower() in ('1', 'true', 'yes')
     
+    try:
+        limit = min(max(int(request.args.get('limit', GAMES_PAGE_SIZE)), 1), GAMES_MAX_PAGE_SIZE)
+        params = {'userid': int(userid) if userid else None, 'limit': limit}
+        if cursor:
+            params['cursor_date'], params['cursor_gameid'] = decode_games_cursor(cursor)
+    except ValueError:
+        return make_response('Invalid limit, userid or cursor', code=400)
     
     conn, cur = get_connection()
     try:
         
         if gameid:
-            cur.execute('SELECT * FROM game_view WHERE gameid = ?', (gameid,))
-        elif userid:
-            cur.execute('SELECT * FROM game_view WHERE userid_1 = ? OR userid_2 = ?', (userid, userid))
-        else:
+            cur.execute(GAME_QUERY, (gameid,))
+            games = cur.fetchall()
+            if games:
+                return make_response('Games retrieved successfully', {'games': [game_with_pgn(game) for game in games]})
+            return make_response('No games found for this user or gameid', code=404)
+        elif not userid:
             return make_response('No query parameter provided', code=403)
         
-        games = cur.fetchall()
+        query = GAMES_PAGE_QUERY.format(pgn_column='' if summary else GAMES_PGN_COLUMNS,
+                                        keyset=GAMES_KEYSET if cursor else '')
+        cur.execute(query, params)
+        games = [dict(game) if summary else game_with_pgn(game) for game in cur.fetchall()]
         
-        if games:
-            return make_response('Games retrieved successfully', {'games': [dict(game) for game in games]})
+        if games or cursor:
+            next_cursor = encode_games_cursor(games[-1]) if len(games) == limit else None
+            return make_response('Games retrieved successfully', {'games': games, 'next_cursor': next_cursor})
         return make_response('No games found for this user or gameid', code=404)
     except sqlite3.Error as e:
         return make_response('Database error: ' + str(e), code=500)
     finally:
         conn.close()
 
+# Route to get the PGN of a single game; format=san gives the SAN move list instead
+@app.route('/games/<int:gameid>/pgn', methods=['GET'])
+@blocking
+@jwt_required()
+def get_game_pgn(gameid):
+    conn, cur = get_connection()
+    try:
+        cur.execute(GAME_QUERY, (gameid,))
+        game = cur.fetchone()
+        if not game:
+            return make_response('No game found with given gameid', code=404)
+        if request.args.get('format') == 'san':
+            if game['moves'] is None:
+                return make_response('Game is stored as PGN only', code=409)
+            return make_response('Moves retrieved successfully', {'gameid': gameid, 'san': to_san(game['moves'])})
+        return make_response('PGN retrieved successfully', {'gameid': gameid, 'pgn': game_with_pgn(game)['pgn']})
+    except sqlite3.Error as e:
+        return make_response('Database error: ' + str(e), code=500)
+    finally:
+        conn.close()
+
+# Route to export games as a stream: userid, time_control, since and until
+# (YYYY-MM-DD) filter; without userid it is every game on the site
+@app.route('/games/export', methods=['GET'])
+@jwt_required()
+def export_games():
+    fmt = request.args.get('format', 'pgn')
+    if fmt not in FORMATS:
+        return make_response('Invalid format', code=400)
+    try:
+        filters = ExportFilters(request.args.get('userid'), request.args.get('time_control'),
+                                request.args.get('since'), request.args.get('until'))
+    except ValueError:
+        return make_response('Invalid userid, since or until', code=400)
+    if filters.time_control and filters.time_control not in GAME_TYPES:
+        return make_response('Invalid time_control', code=400)
+
+    mimetype, extension = FORMATS[fmt]
+    chunks = export_chunks(db_pool, filters, fmt)
+    if request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes'):
+        chunks = gzip_chunks(chunks)
+        mimetype, extension = 'application/gzip', extension + '.gz'
+    # No Content-Length, so the body goes out chunked as it is generated
+    return Response(chunks, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filters.filename(extension)}'})
+
+# Route to get the moves played from a position (default: the starting position)
+# and how those games ended, from the opening_stats index
+@app.route('/explorer', methods=['GET'])
+@blocking
+@jwt_required()
+def get_explorer():
+    try:
+        board = chess.Board(request.args.get('fen') or chess.STARTING_FEN)
+    except ValueError:
+        return make_response('Invalid FEN', code=400)
+
+    conn, cur = get_connection()
+    try:
+        moves = explorer.lookup(cur, board)
+        return make_response('Explorer moves retrieved successfully', {
+            'fen': board.fen(),
+            'games': sum(move['games'] for move in moves),
+            'moves': moves,
+        })
+    except sqlite3.Error as e:
+        return make_response('Database error: ' + str(e), code=500)
+    finally:
+        conn.close()
+
+# Top of one time control's ladder, read straight off idx_player_stats_rating
+LEADERBOARD_QUERY = '''
+    SELECT ps.userid, u.username, ps.games, ps.wins, ps.draws, ps.losses, ps.rating
+    FROM player_stats ps
+    JOIN user u ON u.userid = ps.userid
+    WHERE ps.time_control = ?
+    ORDER BY ps.rating DESC, ps.userid
+    LIMIT ?
+'''
+
+# Route to get the highest rated players for a time control
+@app.route('/leaderboard', methods=['GET'])
+@blocking
+@jwt_required()
+def get_leaderboard():
+    time_control = request.args.get('time_control', 'Blitz')
+    if time_control not in GAME_TYPES:
+        return make_response('Invalid time_control', code=400)
+    try:
+        limit = min(max(int(request.args.get('limit', GAMES_PAGE_SIZE)), 1), GAMES_MAX_PAGE_SIZE)
+    except ValueError:
+        return make_response('Invalid limit', code=400)
+
+    conn, cur = get_connection()
+    try:
+        cur.execute(LEADERBOARD_QUERY, (time_control, limit))
+        players = [dict(userid=row['userid'], username=row['username'], **stats_dict(tuple(row)[2:]))
+                   for row in cur.fetchall()]
+        return make_response('Leaderboard retrieved successfully', {'time_control': time_control, 'players': players})
+    except sqlite3.Error as e:
+        return make_response('Database error: ' + str(e), code=500)
+    finally:
+        conn.close()
+
+# Route to list live games, most watched first
+@app.route('/games/live', methods=['GET'])
+@jwt_required()
+def get_live_games():
+    try:
+        limit = min(max(int(request.args.get('limit', GAMES_PAGE_SIZE)), 1), GAMES_MAX_PAGE_SIZE)
+    except ValueError:
+        return make_response('Invalid limit', code=400)
+    
+    spectators = spectator_fanout.counts()
+    with active_lock:
+        games = [game for game in active_games.values() if game.is_game_active]
+    games.sort(key=lambda game: spectators.get(game.gameId, 0), reverse=True)
+    live = [{
+        'gameId': game.gameId,
+        'white': game.player1,
+        'black': game.player2,
+        'game_type': game.gameType,
+        'ply': game.ply(),
+        'spectators': spectators.get(game.gameId, 0)
+    } for game in games[:limit]]
+    return make_response('Live games retrieved successfully', {'games': live})
+
+# Route to list the tournaments hosted by this worker, newest first
+@app.route('/tournaments', methods=['GET'])
+@jwt_required()
+def get_tournaments():
+    with tournaments_lock:
+        hosted = list(tournaments.values())
+    return make_response('Tournaments retrieved successfully',
+                         {'tournaments': [tournament.summary() for tournament in reversed(hosted)]})
+
+# Latency of every HTTP route, labelled by its URL rule
+HTTP_REQUEST_SECONDS = Histogram('gochess_http_request_seconds', 'HTTP request latency', ['route', 'method', 'status'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+    return response
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Route to inspect background workers
+@app.route('/status', methods=['GET'])
+def get_status():
+    return make_response('Server status', {
+        'game_writer': game_writer.stats(),
+        'identity_index': identity_index.stats(),
+        'user_cache': user_cache.stats(),
+        'password_hasher': password_hasher.stats(),
+        'position_cache': position_cache.stats(),
+        'bot_pool': bot_pool.stats(),
+        'game_journal': game_journal.stats() if game_journal else None,
+        'event_limiter': event_limiter.stats(),
+        'outgoing_backlog': outgoing_backlog.stats(),
+        'lag_tracker': lag_tracker.stats(),
+        'tournaments': {'hosted': len(tournaments), 'games': sum(len(t.games) for t in list(tournaments.values()))}
+    })
+
 
 #----------------------Socket Server----------------------
-#Dictionaries for storing user session information
-sid_mapper = {}
+SOCKET_HANDLER_SECONDS = Histogram('gochess_socket_handler_seconds', 'Socket.IO event handler latency', ['event'])
+MOVES = Counter('gochess_moves', 'Moves played on this worker')
+GAMES_FINISHED = Counter('gochess_games_finished', 'Games finished on this worker', ['reason'])
+BOT_MOVE_SECONDS = Histogram('gochess_bot_move_seconds', 'Time from a bot\'s turn starting to its move', ['level'])
+
+# Token buckets per connection and event; SOCKET_RATE_LIMITS=make_move=5/10,... overrides, =off disables.
+# A player cut off for flooding is refused at connect for SOCKET_FLOOD_PENALTY_SECONDS.
+event_limiter = EventLimiter(parse_limits(os.getenv('SOCKET_RATE_LIMITS')),
+                             penalty=float(os.getenv('SOCKET_FLOOD_PENALTY_SECONDS', 30)))
+# Skips droppable updates for connections this many packets behind, and cuts off those at the hard limit
+outgoing_backlog = OutgoingBacklog(socketio, soft_limit=int(os.getenv('SOCKET_BACKLOG_SOFT', 32)),
+                                   hard_limit=int(os.getenv('SOCKET_BACKLOG_HARD', 2000)))
+# Round trip per connection, from acknowledged lag_ping events every LAG_PING_SECONDS
+lag_tracker = LagTracker(socketio, interval=float(os.getenv('LAG_PING_SECONDS', 5)), backlog=outgoing_backlog)
+
+# socketio.on that also records the handler's latency, behind the event's rate limit if it has one.
+# refused, if given, is called with the event's arguments for every refusal short of a cut off.
+def socket_handler(event, refused=None):
+    def register(handler):
+        handler = timed(SOCKET_HANDLER_SECONDS.labels(event))(handler)
+        if event not in event_limiter.limits:
+            return socketio.on(event)(handler)
+
+        @functools.wraps(handler)
+        def limited(*args, **kwargs):
+            decision = event_limiter.check(request.sid, event)
+            if decision == ALLOW:
+                return handler(*args, **kwargs)
+            if decision == CUT_OFF:
+                event_limiter.penalize(get_email(request.sid))
+                outgoing_backlog.abort(request.sid, 'flood')
+                return
+            if refused is not None:
+                refused(*args, **kwargs)
+            if decision == WARN:
+                emit('rate_limited', {"event": event, "retry_after": event_limiter.retry_after(event)})
+        return socketio.on(event)(limited)
+    return register
+
+#Sockets connected to this worker; email -> sid lives in the shared store
 email_mapper = {}
-sid_lock = threading.Lock()
-email_lock = threading.Lock()
+email_lock = timed_lock('email')
 
 def get_email(sid):
     with email_lock:
@@ -166,38 +582,82 @@ def get_email(sid):
 def set_email(sid, email):
     with email_lock:
         email_mapper[sid] = email
-        
-waiting_players = {
-    'Rapid': [],
-    'Blitz': [],
-    'Bullet': []
-}
-waiting_lock = threading.Lock()
 
+def clear_email(sid):
+    with email_lock:
+        email_mapper.pop(sid, None)
+        
+# Games owned by this worker; the store maps each player to their current gameId
 active_games = {}  
-active_lock = threading.Lock()
+# Guards active_games only; each Game has its own lock for play
+active_lock = timed_lock('active_games')
+
+# Single scheduler thread for every game clock and delayed cleanup
+clock_scheduler = ClockScheduler()
+# Starting clocks; clocks are kept in integer milliseconds
+GAME_TIMES_MS = {'Blitz': 300000, 'Bullet': 180000, 'Rapid': 600000}
+# Lag credited back per move comes out of an allowance refilled by LAG_COMP_GAIN_MS a move, up to LAG_COMP_MAX_MS
+LAG_COMP_GAIN_MS = int(os.getenv('LAG_COMP_GAIN_MS', 100))
+LAG_COMP_MAX_MS = int(os.getenv('LAG_COMP_MAX_MS', 1000))
+GAME_REMOVAL_DELAY = 5  # seconds a finished game stays in active_games
+# Seconds a disconnected player's seat is held (clocks keep running); 0 ends the game at once
+RECONNECT_GRACE = float(os.getenv('RECONNECT_GRACE_SECONDS', 30))
+# Games in progress and hosted tournaments are journaled so a restart resumes them (None when GAME_JOURNAL_DIR='')
+game_journal = journal_from_env(cluster.worker_id, cluster.distributed)
+# Seconds the players of a restored game have to reconnect
+RESTORE_GRACE = float(os.getenv('RESTORE_GRACE_SECONDS', 60))
+
+# Coalesced move batches for spectators, sent off the players' path
+spectator_fanout = SpectatorFanout(socketio, interval_ms=int(os.getenv('SPECTATOR_FLUSH_MS', 250)),
+                                   backlog=outgoing_backlog)
+
+# Legality and game-end results for positions reached by any game
+position_cache = PositionCache(maxsize=int(os.getenv('POSITION_CACHE_SIZE', 100000)))
+
+# Gauges are read when /metrics is scraped, so they cost nothing on the hot path
+Gauge('gochess_games_active', 'Games owned by this worker', fn=lambda: len(active_games))
+Gauge('gochess_sockets_connected', 'Socket.IO connections on this worker', fn=lambda: len(email_mapper))
+Gauge('gochess_match_queue_depth', 'Players waiting for an opponent', ['game_type'],
+      fn=lambda: {(gt,): store.queue_depth(gt) for gt in GAME_TYPES})
+Gauge('gochess_spectators', 'Spectators watching games on this worker',
+      fn=lambda: sum(spectator_fanout.counts().values()))
+Gauge('gochess_game_writer_queue_depth', 'Finished games waiting to be written',
+      fn=lambda: game_writer.stats()['queue_depth'])
+Gauge('gochess_position_cache_hit_ratio', 'Position cache hit ratio',
+      fn=lambda: position_cache.stats()['hit_rate'])
+Gauge('gochess_identity_index_hit_ratio', 'Username/email checks answered without the database',
+      fn=lambda: identity_index.stats()['hit_rate'])
+Gauge('gochess_user_cache_hit_ratio', 'Profile lookups served from the user cache',
+      fn=lambda: user_cache.stats()['hit_rate'])
+Gauge('gochess_bot_searches_pending', 'Bot searches queued or running in the bot pool',
+      fn=lambda: bot_pool.stats()['pending'])
 
 def get_sid(user):
-    with sid_lock:
-        return sid_mapper.get(user)
+    return store.get_player(user)[0]
+
+def emit_to_player(player, event, data):
+    # A bot, or a player without a socket, has no sid; emitting to None would broadcast
+    sid = get_sid(player)
+    if sid:
+        socketio.emit(event, data, to=sid)
 
 def set_sid(user, sid):
-    with sid_lock:
-        sid_mapper[user] = sid
-
-def get_waiting_player(gameType):
-    if gameType not in ['Blitz', 'Rapid', 'Bullet']:
-        raise Exception("No such gameType")
-    with waiting_lock:
-        if waiting_players.get(gameType) and len(waiting_players.get(gameType)) > 0:
-            return waiting_players.get(gameType).pop(0)
-        return None
-
-def set_waiting_player(player, gameType):
-    with waiting_lock:
-        if player not in waiting_players.get(gameType):
-            waiting_players.get(gameType).append(player)
-    
+    store.set_player(user, sid, cluster.worker_id)
+
+def get_game(gameId):
+    with active_lock:
+        return active_games.get(gameId)
+
+def index_game(game):
+    # This worker owns the game; events for it from other workers are forwarded here.
+    # Bots aren't indexed: they play any number of games at once.
+    store.set_game(game.gameId, cluster.worker_id, tuple(p for p in (game.player1, game.player2) if p not in game.bots))
+
+def release_players(game):
+    # Drop index entries that still point at this game
+    for player in (game.player1, game.player2):
+        store.release_player(player, game.gameId)
+
 def generate_game_id():
     return str(uuid.uuid4())[:8]
 
@@ -208,122 +668,259 @@ class Game:
         self.player2 = player2  # Black player
         self.gameType = gameType
         
-        game_times = {'Blitz': 300, 'Bullet': 180, 'Rapid': 600}
-        self.player1_time = game_times[gameType]
-        self.player2_time = game_times[gameType]
+        # Remaining milliseconds as of last_move_time; the side to move is charged lazily
+        self.player1_time = GAME_TIMES_MS[gameType]
+        self.player2_time = GAME_TIMES_MS[gameType]
         
         self.is_game_active = False
-        self.timer_thread = None
         self.board = chess.Board()
+        # Cached facts about the current position, shared with other games
+        self.position = position_cache.lookup(self.board)
         self.last_move_time = None
-        self.timer_lock = threading.Lock()
+        self.timer_lock = timed_lock('game_timer')
+        # Serializes moves, resignations and state reads within this game only
+        self.lock = timed_lock('game', threading.RLock())
+        # Pending scheduler entry for the side to move's flag
+        self.flag_call = None
+        # Disconnected players -> scheduled forfeit at the end of their grace window
+        self.absent = {}
+        # Bot players -> strength level
+        self.bots = {player: bot_level(player) for player in (player1, player2) if bot_level(player)}
+        # Lag allowance, and the round trip last reported with a move, of each player
+        self.lag_quota = {player: LagQuota(LAG_COMP_GAIN_MS, LAG_COMP_MAX_MS) for player in (player1, player2)}
+        self.lag_ms = {player1: 0, player2: 0}
+        # tournamentId, for a tournament game
+        self.tournament = None
         
 
     def start_game(self):
-        self.is_game_active = True
-        self.last_move_time = time.time()  
-        self.timer_thread = threading.Thread(target=self.update_timer)
-        self.timer_thread.daemon = True
-        self.timer_thread.start()  
+        with self.timer_lock:
+            self.is_game_active = True
+            self.last_move_time = time.monotonic()
+            self.schedule_flag()
+        if game_journal:
+            game_journal.started(self.gameId, self.player1, self.player2, self.gameType, self.journal_clocks(),
+                                 self.tournament)
+
+    def resume(self):
+        # Must hold self.lock: restart the clocks of a game restored from the
+        # journal. The side to move continues from its clock as of the last
+        # move; the downtime isn't charged. Nobody is connected yet, so each
+        # player has RESTORE_GRACE to come back.
+        with self.timer_lock:
+            self.is_game_active = True
+            self.last_move_time = time.monotonic()
+            self.schedule_flag()
+            for player in (self.player1, self.player2):
+                if player not in self.bots:
+                    self.absent[player] = clock_scheduler.schedule(RESTORE_GRACE, self.forfeit_if_absent, player)
+        self.request_bot_move()
+
+    def remaining_times(self, now=None):
+        # Clocks of both players in ms with the side to move charged up to now
+        player1_time, player2_time = self.player1_time, self.player2_time
+        if self.is_game_active and self.last_move_time is not None:
+            elapsed = int(((now or time.monotonic()) - self.last_move_time) * 1000)
+            if self.board.turn == chess.WHITE:
+                player1_time = max(0, player1_time - elapsed)
+            else:
+                player2_time = max(0, player2_time - elapsed)
+        return player1_time, player2_time
+
+    def clock_state(self):
+        # Clocks for a payload, in seconds to the millisecond, as of server_time
+        # (wall-clock ms): clients run the side to move's clock down from there
+        # themselves instead of waiting for updates
+        player1_time, player2_time = self.remaining_times()
+        return {"player1_time": player1_time / 1000, "player2_time": player2_time / 1000, "server_time": wall_ms()}
+
+    def journal_clocks(self):
+        # The journal keeps clocks in seconds, as it always has
+        return self.player1_time / 1000, self.player2_time / 1000
 
-    def move_piece(self, player, move):
+    def flag_deadline(self):
+        # Must hold timer_lock: when the side to move flags, allowing for the lag
+        # credit its move could still get
+        player = self.player1 if self.board.turn == chess.WHITE else self.player2
+        remaining = self.player1_time if self.board.turn == chess.WHITE else self.player2_time
+        grace = self.lag_quota[player].grace(self.lag_ms[player])
+        return self.last_move_time + (remaining + grace) / 1000
+
+    def schedule_flag(self):
+        # Must hold timer_lock: replace the deadline at which the side to move flags
+        clock_scheduler.cancel(self.flag_call)
+        self.flag_call = clock_scheduler.schedule_at(self.flag_deadline(), self.check_flag)
+
+    def move_piece(self, player, move, lag_ms=0):
+        # lag_ms: the mover's round trip, credited back to their clock within their allowance
         try:
             move_obj = chess.Move.from_uci(move)
-            if move_obj not in self.board.legal_moves:
-                emit('error', {"message": "Illegal move"}, to=get_sid(player))
+            if not self.position.is_legal(self.board, move_obj):
+                self.reject_move(player, "Illegal move")
                 return False
                 
             # Update timers based on who made the move
             with self.timer_lock:
-                current_time = time.time()
-                elapsed = int(current_time - self.last_move_time) if self.last_move_time else 0
+                if not self.is_game_active:
+                    self.reject_move(player, "Game is over")
+                    return False
+
+                current_time = time.monotonic()
+                elapsed = int((current_time - self.last_move_time) * 1000) if self.last_move_time else 0
                 
-                # Apply time deduction to the player who just moved
-                if self.board.turn == chess.WHITE and player == self.player1:
-                    self.player1_time = max(0, self.player1_time - elapsed)
-                elif self.board.turn == chess.BLACK and player == self.player2:
-                    self.player2_time = max(0, self.player2_time - elapsed)
-                else:
+                to_move = self.player1 if self.board.turn == chess.WHITE else self.player2
+                if player != to_move:
                     # Wrong player tried to move
-                    emit('error', {"message": "Not your turn"}, to=get_sid(player))
+                    self.reject_move(player, "Not your turn")
                     return False
+                self.lag_ms[player] = lag_ms
+                charged = elapsed - self.lag_quota[player].credit(lag_ms, elapsed)
                 
-                self.last_move_time = current_time
-            
-            # Execute the move
-            self.board.push(move_obj)
-            current_fen = self.board.fen()
-            
-            # Check game ending conditions
-            if self.board.is_stalemate():
+                # Apply time deduction to the player who just moved
+                if player == self.player1:
+                    self.player1_time = max(0, self.player1_time - charged)
+                    flagged = self.player1_time == 0
+                else:
+                    self.player2_time = max(0, self.player2_time - charged)
+                    flagged = self.player2_time == 0
+                
+                if not flagged:
+                    self.last_move_time = current_time
+                    # Execute the move and hand the clock to the opponent
+                    self.board.push(move_obj)
+                    self.position = position_cache.lookup(self.board)
+                    self.schedule_flag()
+                    if game_journal:
+                        game_journal.moved(self.gameId, move_obj, self.journal_clocks())
+
+            if flagged:
+                # The flag fell before the scheduler got to it
+                self.game_over(self.get_opponent(player), 'timeout')
+                return False
+
+            # Check game ending conditions (shared across games reaching the same position)
+            status = self.position.status
+            if status == STATUS_STALEMATE:
                 self.game_over(None, 'Stalemate')
                 return True
-            elif self.board.is_checkmate():
+            elif status == STATUS_CHECKMATE:
                 winner = self.player2 if self.board.turn == chess.WHITE else self.player1
                 self.game_over(winner, 'Checkmate')
                 return True
-            elif self.board.is_insufficient_material():
+            elif status == STATUS_INSUFFICIENT_MATERIAL:
                 self.game_over(None, 'Insufficient Material')
                 return True
             
-            # Notify both players of the move
+            # Notify the game room with a delta; clients that see a ply gap ask for the full state
+            clocks = self.clock_state()
             response_data = {
                 "move": str(move_obj),
-                "fen": current_fen,
-                "player1_time": self.player1_time,
-                "player2_time": self.player2_time,
+                "ply": self.ply(),
+                **clocks,
                 "turn": "white" if self.board.turn == chess.WHITE else "black"
             }
             
-            emit('move_made', response_data, to=get_sid(self.player1))
-            emit('move_made', response_data, to=get_sid(self.player2))
+            socketio.emit('move_made', response_data, to=self.gameId)
+            MOVES.inc()
+            spectator_fanout.publish_move(self, response_data['ply'], response_data['move'], clocks,
+                                          response_data['turn'])
+            self.request_bot_move()
             return True
             
         except Exception as e:
-            print(f"Error processing move: {str(e)}")
-            emit('error', {"message": f"Error processing move: {str(e)}"}, to=get_sid(player))
+            log.exception('move_failed', gameId=self.gameId, player=player, move=move)
+            self.reject_move(player, f"Error processing move: {str(e)}")
             return False
 
+    def reject_move(self, player, message):
+        # The client has already played the move on its board; the ply tells it where to roll back to
+        emit_to_player(player, 'error', {"message": message, "event": "make_move", "gameId": self.gameId,
+                                         "ply": self.ply()})
+
+    def request_bot_move(self):
+        # Must hold self.lock: if a bot is to move, search in the bot pool and
+        # play the result from the future's callback, off the socket threads
+        bot = self.player1 if self.board.turn == chess.WHITE else self.player2
+        level = self.bots.get(bot)
+        if level is None:
+            return
+        ply = self.ply()
+        remaining = self.player1_time if self.board.turn == chess.WHITE else self.player2_time
+        requested = time.monotonic()
+        moves = [move.uci() for move in self.board.move_stack]
+        try:
+            future = bot_pool.submit(moves, move_budget(level, remaining / 1000), level)
+        except BrokenProcessPool:
+            # The pool replaces itself on the next submit
+            future = bot_pool.submit(moves, move_budget(level, remaining / 1000), level)
+        future.add_done_callback(lambda future: self.play_bot_move(bot, level, ply, requested, future))
+
+    def play_bot_move(self, bot, level, ply, requested, future):
+        # Runs on the pool's result thread
+        try:
+            move = future.result()['move']
+        except Exception:
+            log.exception('bot_search_failed', gameId=self.gameId, level=level)
+            move = None
+        with self.lock:
+            # The game may have ended, by resignation or the flag, while the bot thought
+            if not self.is_game_active or self.ply() != ply:
+                return
+            if move is None:
+                self.game_over(self.get_opponent(bot), 'Resign')
+                return
+            BOT_MOVE_SECONDS.labels(str(level)).observe(time.monotonic() - requested)
+            self.move_piece(bot, move)
+
+    def ply(self):
+        return len(self.board.move_stack)
+
     def get_opponent(self, player):
         return self.player2 if player == self.player1 else self.player1
 
-    def update_timer(self):
-        while self.is_game_active:
-            with self.timer_lock:
-                current_time = time.time()
-                if self.last_move_time:
-                    elapsed = int(current_time - self.last_move_time)
-                    
-                    # Deduct time from current player
-                    if self.board.turn == chess.WHITE:
-                        if self.player1_time > 0:
-                            self.player1_time = max(0, self.player1_time - 1)
-                            if self.player1_time == 0:
-                                self.game_over(self.player2, 'timeout')
-                                break
-                        else:
-                            self.game_over(self.player2, 'timeout')
-                            break
-                    else:
-                        if self.player2_time > 0:
-                            self.player2_time = max(0, self.player2_time - 1)
-                            if self.player2_time == 0:
-                                self.game_over(self.player1, 'timeout')
-                                break
-                        else:
-                            self.game_over(self.player1, 'timeout')
-                            break
-                    
-                    # Send time updates every 5 seconds
-                    if elapsed % 5 == 0:
-                        time_update = {
-                            "player1_time": self.player1_time,
-                            "player2_time": self.player2_time
-                        }
-                        emit('time_update', time_update, to=get_sid(self.player1))
-                        emit('time_update', time_update, to=get_sid(self.player2))
-            
-            time.sleep(1)
+    def moves_since(self, ply):
+        # Moves played after the client's last seen ply, or None if it can't resume from there
+        if not isinstance(ply, int) or not 0 <= ply <= self.ply():
+            return None
+        return [move.uci() for move in self.board.move_stack[ply:]]
+
+    def player_left(self, player):
+        # Hold the seat for the grace window instead of ending the game on a network blip
+        if RECONNECT_GRACE <= 0:
+            self.game_over(self.get_opponent(player), 'Disconnection')
+            return
+        with self.timer_lock:
+            if not self.is_game_active or player in self.absent:
+                return
+            self.absent[player] = clock_scheduler.schedule(RECONNECT_GRACE, self.forfeit_if_absent, player)
+        socketio.emit('opponent_disconnected', {'gameId': self.gameId, 'player': player, 'grace': RECONNECT_GRACE},
+                      to=self.gameId)
+
+    def player_returned(self, player):
+        with self.timer_lock:
+            call = self.absent.pop(player, None)
+            clock_scheduler.cancel(call)
+        if call is not None:
+            socketio.emit('opponent_reconnected', {'gameId': self.gameId, 'player': player}, to=self.gameId)
+
+    def forfeit_if_absent(self, player):
+        # Runs on the scheduler thread when a grace window ends
+        with self.timer_lock:
+            if self.absent.pop(player, None) is None:
+                return
+        self.game_over(self.get_opponent(player), 'Disconnection')
+
+    def check_flag(self):
+        # Runs on the scheduler thread when the side to move may have run out of time
+        with self.timer_lock:
+            if not self.is_game_active:
+                return
+            if time.monotonic() < self.flag_deadline():
+                # Woke up early; wait for the real deadline
+                self.schedule_flag()
+                return
+            winner = self.player2 if self.board.turn == chess.WHITE else self.player1
+        self.game_over(winner, 'timeout')
             
     def game_over(self, winner, reason):
         # Prevent race conditions with duplicate calls
@@ -331,11 +928,24 @@ class Game:
             if not self.is_game_active:
                 return  # Prevent duplicate game_over calls
             
-            # Mark game as inactive first to stop the timer thread
+            # Freeze the clocks and mark game as inactive
+            self.player1_time, self.player2_time = self.remaining_times()
             self.is_game_active = False
+            clock_scheduler.cancel(self.flag_call)
+            for call in self.absent.values():
+                clock_scheduler.cancel(call)
+            self.absent.clear()
+        
+        release_players(self)
+        # The tournament result is journaled before the game leaves the journal
+        if self.tournament:
+            tournament_game_over(self, winner)
+        if game_journal:
+            game_journal.ended(self.gameId)
         
         # Log game result
-        print(f"Game {self.gameId} ended: {winner} won due to {reason}")
+        log.info('game_over', gameId=self.gameId, winner=winner, reason=reason, plies=self.ply())
+        GAMES_FINISHED.labels(reason).inc()
         
         # Prepare game result data
         result_data = {
@@ -345,35 +955,37 @@ class Game:
             'game_type': self.gameType
         }
         
-        # Notify both players
-        player1_sid = get_sid(self.player1)
-        player2_sid = get_sid(self.player2)
+        # Notify the game room (may run on the scheduler thread, outside a request context)
+        socketio.emit('game_over', result_data, to=self.gameId)
+        spectator_fanout.publish_game_over(self, result_data)
         
-        if player1_sid:
-            emit('game_over', result_data, to=player1_sid)
-        if player2_sid:
-            emit('game_over', result_data, to=player2_sid)
-        
-        # Store game result in database
+        # Store game result in database (queued, written by the background writer)
         try:
-           pass
-        except Exception as e:
-            print(f"Error initiating game save: {str(e)}")
+            if winner is None:
+                result = RESULT_DRAW
+            elif winner == self.player1:
+                result = RESULT_WHITE_WINS
+            else:
+                result = RESULT_BLACK_WINS
+            game_writer.submit(FinishedGame(self.player1, self.player2, self.gameType,
+                                            result, reason, self.board.move_stack))
+        except Exception:
+            log.exception('game_save_submit_failed', gameId=self.gameId)
         
         # Schedule removal of game after a delay to ensure all cleanup is complete
-        def delayed_remove():
-            time.sleep(5)  # Give time for all communications to finish
-            with active_lock:
-                if self.gameId in active_games:
-                    active_games.pop(self.gameId, None)
-                    print(f"Game {self.gameId} removed from active games")
-        
-        cleanup_thread = threading.Thread(target=delayed_remove)
-        cleanup_thread.daemon = True
-        cleanup_thread.start()       
+        clock_scheduler.schedule(GAME_REMOVAL_DELAY, remove_game, self.gameId)
+
+def remove_game(gameId):
+    with active_lock:
+        if gameId in active_games:
+            active_games.pop(gameId, None)
+            log.debug('game_removed', gameId=gameId)
+    store.remove_game(gameId)
+    socketio.close_room(gameId, namespace='/')
+
 def create_game(player1, player2, gameType):
     if player1 is None or player2 is None:
-        print(f"Error: Attempted to create game with None player: {player1}, {player2}")
+        log.error('create_game_missing_player', player1=player1, player2=player2)
         return
         
     gameId = generate_game_id()
@@ -386,184 +998,586 @@ def create_game(player1, player2, gameType):
         white_player = player2
         black_player = player1
     
-    print(f"Creating {gameType} game {gameId} between {white_player} (White) and {black_player} (Black)")
+    log.info('game_created', gameId=gameId, game_type=gameType, white=white_player, black=black_player)
     
+    game = Game(gameId, white_player, black_player, gameType)
+    register_games([game])
+    launch_game(game)
+
+# Seconds between passes pairing queued players whose rating windows have widened
+MATCH_SWEEP_SECONDS = float(os.getenv('MATCH_SWEEP_SECONDS', 1))
+
+def sweep_match_queues():
+    try:
+        for gameType, player, opponent in store.sweep_queues():
+            log.debug('matched', email=player, opponent=opponent, game_type=gameType)
+            create_game(player, opponent, gameType)
+    except Exception:
+        log.exception('match_sweep_failed')
+    clock_scheduler.schedule(MATCH_SWEEP_SECONDS, socketio.start_background_task, sweep_match_queues)
+
+def register_games(games):
+    # One pass over active_games for a whole batch of new games
     with active_lock:
-        game = Game(gameId, white_player, black_player, gameType)
-        active_games[gameId] = game
-        
-    # Send game found events with correct opponent information
+        for game in games:
+            active_games[game.gameId] = game
+    for game in games:
+        index_game(game)
+
+def launch_game(game):
+    # Tell both players and start the clocks; returns False if the game had to be dropped
+    gameId = game.gameId
     try:
-        emit('game_found', {
+        # Both players share the game's room for all further broadcasts. On the
+        # server directly: tournament games start outside any request context.
+        for player in (game.player1, game.player2):
+            sid = get_sid(player)
+            if sid:
+                socketio.server.enter_room(sid, gameId, namespace='/')
+        
+        extra = {"tournament": game.tournament} if game.tournament else {}
+        emit_to_player(game.player1, 'game_found', {
             "gameId": gameId, 
-            "opponent": {"color": "black", "email": black_player}
-        }, to=get_sid(white_player))
+            "opponent": {"color": "black", "email": game.player2},
+            **extra
+        })
         
-        emit('game_found', {
+        emit_to_player(game.player2, 'game_found', {
             "gameId": gameId, 
-            "opponent": {"color": "white", "email": white_player}
-        }, to=get_sid(black_player))
+            "opponent": {"color": "white", "email": game.player1},
+            **extra
+        })
         
         # Start the game after sending notifications
-        with active_lock:
-            if gameId in active_games:
-                active_games[gameId].start_game()
+        with game.lock:
+            game.start_game()
+            game.request_bot_move()
+        return True
                 
-    except Exception as e:
-        print(f"Error setting up game: {str(e)}")
+    except Exception:
+        log.exception('game_setup_failed', gameId=gameId)
         # Clean up if there was an error
+        release_players(game)
         with active_lock:
-            if gameId in active_games:
-                del active_games[gameId]
+            active_games.pop(gameId, None)
+        return False
+
+#----------------------Tournaments----------------------
+# Tournaments hosted by this worker. Their ids sit in the store's game owner
+# map, so tournament events from any worker are routed here like game events.
+# The game journal carries them over a restart.
+tournaments = {}
+tournaments_lock = timed_lock('tournaments')
+# Defaults for create_tournament, and how long a finished tournament stays listed
+TOURNAMENT_START_DELAY = float(os.getenv('TOURNAMENT_START_DELAY_SECONDS', 60))
+TOURNAMENT_KEEP_SECONDS = float(os.getenv('TOURNAMENT_KEEP_SECONDS', 3600))
+MAX_SWISS_ROUNDS = 20
+MAX_ARENA_MINUTES = 360
+# Pause between the last game of a Swiss round and the next pairing
+SWISS_ROUND_BREAK = float(os.getenv('SWISS_ROUND_BREAK_SECONDS', 10))
+# Seconds between arena pairing passes
+ARENA_PAIRING_INTERVAL = float(os.getenv('ARENA_PAIRING_SECONDS', 5))
+
+TOURNAMENT_PAIRING_SECONDS = Histogram('gochess_tournament_pairing_seconds', 'Time to pair a Swiss round or arena pass',
+                                       ['kind'])
+TOURNAMENT_GAMES_STARTED = Counter('gochess_tournament_games_started', 'Tournament games started', ['kind'])
+
+def tournament_room(tournamentId):
+    return f'tournament:{tournamentId}'
+
+def get_tournament(tournamentId):
+    with tournaments_lock:
+        return tournaments.get(tournamentId)
 
+def free_to_play(player):
+    # Connected somewhere and not already in a game
+    return get_sid(player) is not None and store.player_game(player) is None
 
-@socketio.on('connect')
-def handle_connect():
+def schedule_pairing(tournament, delay):
+    # Pairing starts a burst of games, so it runs on a background task rather than the scheduler thread
+    clock_scheduler.schedule(delay, socketio.start_background_task, pair_tournament, tournament)
+
+def start_tournament(tournament):
+    if tournament.start():
+        if game_journal:
+            game_journal.tournament_started(tournament.tournamentId, tournament.starts_at)
+        log.info('tournament_started', tournamentId=tournament.tournamentId, players=len(tournament.players))
+        schedule_pairing(tournament, 0)
+
+def pair_tournament(tournament):
+    # A Swiss round or an arena pass
+    started = 0
+    try:
+        begin = time.perf_counter()
+        available = {player for player in tournament.waiting() if free_to_play(player)}
+        number = tournament.round
+        pairs = tournament.pair(available)
+        paired = time.perf_counter()
+        if game_journal and tournament.round != number:
+            # Before the round's games, which the journal ties to it
+            game_journal.tournament_paired(tournament.tournamentId, tournament.round, tournament.last_bye)
+        started = start_tournament_games(tournament, pairs)
+        TOURNAMENT_PAIRING_SECONDS.labels(tournament.kind).observe(paired - begin)
+        if pairs or tournament.kind == SWISS:
+            log.info('tournament_paired', tournamentId=tournament.tournamentId, round=tournament.round,
+                     games=started, pairing_ms=round((paired - begin) * 1000, 1),
+                     start_ms=round((time.perf_counter() - paired) * 1000, 1))
+        if tournament.kind == SWISS and pairs:
+            socketio.emit('tournament_round', tournament.summary(), to=tournament_room(tournament.tournamentId))
+    except Exception:
+        log.exception('tournament_pairing_failed', tournamentId=tournament.tournamentId)
+    if tournament.finish_if_done():
+        finish_tournament(tournament)
+    elif tournament.kind == ARENA:
+        schedule_pairing(tournament, ARENA_PAIRING_INTERVAL)
+    elif not started:
+        # Nobody could play this round (at most a bye); no game_over will move it on
+        schedule_pairing(tournament, SWISS_ROUND_BREAK)
+
+def start_tournament_games(tournament, pairs):
+    # Games for pairs from Tournament.pair(), registered in one batch. Returns how many started.
+    games = []
+    for white, black in pairs:
+        game = Game(generate_game_id(), white, black, tournament.game_type)
+        game.tournament = tournament.tournamentId
+        games.append(game)
+    # Known to the tournament before any of them can end
+    tournament.started([(game.gameId, game.player1, game.player2) for game in games])
+    register_games(games)
+    failed = [game.gameId for game in games if not launch_game(game)]
+    if failed:
+        tournament.cancelled(failed)
+        if game_journal:
+            game_journal.tournament_cancelled(tournament.tournamentId, failed)
+    TOURNAMENT_GAMES_STARTED.labels(tournament.kind).inc(len(games) - len(failed))
+    return len(games) - len(failed)
+
+def tournament_game_over(game, winner):
+    tournament = get_tournament(game.tournament)
+    if tournament is None:
+        return
+    if game_journal:
+        game_journal.tournament_recorded(tournament.tournamentId, game.gameId, winner)
+    if not tournament.record(game.gameId, winner):
+        return
+    # That was the last game in progress
+    if tournament.finish_if_done():
+        finish_tournament(tournament)
+    elif tournament.kind == SWISS:
+        schedule_pairing(tournament, SWISS_ROUND_BREAK)
+
+def finish_tournament(tournament):
+    summary = tournament.summary()
+    log.info('tournament_finished', tournamentId=tournament.tournamentId, players=summary['players'],
+             games=summary['games_played'])
+    socketio.emit('tournament_over', dict(summary, standings=tournament.standings(0, 10)),
+                  to=tournament_room(tournament.tournamentId))
+    clock_scheduler.schedule(TOURNAMENT_KEEP_SECONDS, remove_tournament, tournament.tournamentId)
+
+def remove_tournament(tournamentId):
+    with tournaments_lock:
+        tournaments.pop(tournamentId, None)
+    if game_journal:
+        game_journal.tournament_removed(tournamentId)
+    store.remove_game(tournamentId)
+    socketio.close_room(tournament_room(tournamentId), namespace='/')
+
+
+@socket_handler('connect')
+def handle_connect(auth=None):
     try:
         email = get_email_from_token()
+        if event_limiter.penalized(email):
+            log.info('connect_refused', email=email, reason='flood')
+            return False
         set_sid(email, request.sid)
         set_email(request.sid, email)
-        print(f"{email} connected")
+        lag_tracker.track(request.sid)
+        # Put a reconnecting player back into their game's room
+        gameId = store.player_game(email)
+        if gameId:
+            join_room(gameId)
+            # The client sends its last seen ply with the handshake, so it gets just
+            # the missing moves without a separate full-state request
+            ply = auth.get('ply') if isinstance(auth, dict) and auth.get('gameId') == gameId else None
+            route_game_event('resync', gameId, email, request.sid, {'gameId': gameId, 'ply': ply})
+        log.debug('connected', email=email, sid=request.sid)
     except:
         emit('error', {"message": "Authentication error"})
         return disconnect()
 
-@socketio.on('join_game')
+@socket_handler('join_game')
 def handle_join_game(data):
     try:
         email = get_email(request.sid)
         gameType = data.get('gameType')
         
-        if gameType not in ['Blitz', 'Rapid', 'Bullet']:
+        if gameType not in GAME_TYPES:
             raise Exception("Wrong game Type")
             
-        # First check if there's a waiting player
-        player = get_waiting_player(gameType)
+        # Pair with a waiting player, or join the queue (never matches the player with themselves).
+        # The queue is shared, so the opponent may be connected to another worker.
+        rating = player_rating(email, gameType) if store.rated else None
+        player = store.join_queue(gameType, email, rating)
         
-        # If there's no waiting player or it's the same player, put in waiting queue
         if player is None:
-            set_waiting_player(email, gameType)
             emit('waiting_for_opponent', to=request.sid)
-            print(f"{email} now waiting for {gameType} game")
-            return
-        
-        # Don't match player with themselves
-        if player == email:
-            set_waiting_player(email, gameType)
-            emit('waiting_for_opponent', to=request.sid)
-            print(f"{email} tried to match with self, put back in queue")
+            log.debug('queued', email=email, game_type=gameType)
             return
             
-        print(f"Matching {email} with {player} for {gameType} game")
+        log.debug('matched', email=email, opponent=player, game_type=gameType)
         create_game(email, player, gameType)
     except Exception as e:
         emit("error", {"message": str(e)}, to=request.sid)
-        print(f"Error in join_game: {str(e)}")
+        log.warning('join_game_failed', sid=request.sid, error=str(e))
+
+@socket_handler('play_bot')
+def handle_play_bot(data):
+    # A game against the computer at once, instead of waiting in a queue
+    try:
+        email = get_email(request.sid)
+        gameType = data.get('gameType')
+        level = data.get('level')
+        
+        if gameType not in GAME_TYPES:
+            raise Exception("Wrong game Type")
+        if level not in BOT_LEVELS:
+            raise Exception(f"Bot level must be one of {sorted(BOT_LEVELS)}")
+        if store.player_game(email):
+            raise Exception("Already in a game")
+            
+        store.leave_queue(email)
+        log.debug('bot_game', email=email, level=level, game_type=gameType)
+        create_game(email, bot_email(level), gameType)
+    except Exception as e:
+        emit("error", {"message": str(e)}, to=request.sid)
+        log.warning('play_bot_failed', sid=request.sid, error=str(e))
 
-@socketio.on('stop_waiting_for_opponent')
+@socket_handler('stop_waiting_for_opponent')
 def handle_stop_waiting(data):
     try:
         email = get_email(request.sid)
         gameType = data.get('gameType')
         
         if not gameType:
-            print(f"Warning: No gameType provided in stop_waiting_for_opponent")
-            # Try to remove from all queues
-            with waiting_lock:
-                for gt in waiting_players:
-                    if email in waiting_players[gt]:
-                        waiting_players[gt].remove(email)
-                        print(f"Removed {email} from {gt} queue")
-            return
+            log.warning('stop_waiting_without_game_type', email=email)
             
-        with waiting_lock:
-            if email in waiting_players[gameType]:
-                waiting_players[gameType].remove(email)
-                print(f"Removed {email} from {gameType} queue")
+        # Without a gameType the player is removed from all queues
+        for gt in store.leave_queue(email, gameType):
+            log.debug('dequeued', email=email, game_type=gt)
     except Exception as e:
-        print(f"Error in stop_waiting: {str(e)}")
+        log.warning('stop_waiting_failed', sid=request.sid, error=str(e))
         emit("error", {"message": str(e)}, to=request.sid)
 
-@socketio.on('make_move')
-def handle_make_move(data):
+# Game events run on the worker that owns the game. They take the player and
+# their sid explicitly, since a forwarded event has no socket request context.
+game_event_handlers = {}
+
+def game_event(name):
+    def register(handler):
+        game_event_handlers[name] = handler
+        return handler
+    return register
+
+def route_game_event(name, gameId, email, sid, data):
+    owner = store.game_owner(gameId) if gameId else None
+    if owner is None or owner == cluster.worker_id:
+        game_event_handlers[name](email, sid, data)
+    else:
+        cluster.bus.send(owner, {'kind': 'game', 'event': name, 'email': email, 'sid': sid, 'data': data})
+
+def handle_worker_message(message):
+    if message.get('kind') != 'game':
+        return
+    game_event_handlers[message['event']](message['email'], message['sid'], message['data'])
+
+@game_event('make_move')
+def make_move(email, sid, data):
     try:
-        email = get_email(request.sid)
         gameId = data.get('gameId')
         move_str = data.get('move')
         
-        with active_lock:
-            game = active_games.get(gameId)
-            if not game:
-                raise Exception("No game found with given game id")
-                
-            # Fixed: pass player email and move
-            game.move_piece(email, move_str)
+        game = get_game(gameId)
+        if not game:
+            raise Exception("No game found with given game id")
+            
+        # Only this game is locked; moves in other games run in parallel
+        with game.lock:
+            game.move_piece(email, move_str, data.get('lag_ms', 0))
             
     except Exception as e:
-        emit("error", {"message": str(e)}, to=request.sid)
+        socketio.emit("error", {"message": str(e), "event": "make_move", "gameId": data.get('gameId'), "ply": None},
+                      to=sid)
 
-@socketio.on('resign_game')
-def handle_resign(data):
+@game_event('move_refused')
+def move_refused(email, sid, data):
+    # make_move turned away by the rate limiter
+    message = "Too many moves; slow down"
+    game = get_game(data.get('gameId'))
+    if not game:
+        socketio.emit("error", {"message": message, "event": "make_move", "gameId": data.get('gameId'), "ply": None},
+                      to=sid)
+        return
+    with game.lock:
+        socketio.emit("error", {"message": message, "event": "make_move", "gameId": game.gameId, "ply": game.ply()},
+                      to=sid)
+
+@game_event('resign_game')
+def resign_game(email, sid, data):
     try:
-        email = get_email(request.sid)
         gameId = data.get('gameId')
         
-        with active_lock:
-            if gameId not in active_games:
-                raise Exception("No game found")
-                
-            game = active_games[gameId]  # Fixed: accessing dict with []
+        game = get_game(gameId)
+        if not game:
+            raise Exception("No game found")
+            
+        with game.lock:
             opponent = game.get_opponent(email)
             game.game_over(opponent, 'Resign')
     except Exception as e:
-        emit("error", {"message": str(e)}, to=request.sid)
+        socketio.emit("error", {"message": str(e)}, to=sid)
 
-@socketio.on('disconnect')
+@game_event('player_disconnected')
+def player_disconnected(email, sid, data):
+    game = get_game(data.get('gameId'))
+    if game:
+        with game.lock:
+            game.player_left(email)
+
+@game_event('resync')
+def resync(email, sid, data):
+    # Catch a client up from its last seen ply; also marks a returning player as back
+    try:
+        gameId = data.get('gameId')
+        
+        game = get_game(gameId)
+        if not game:
+            raise Exception("No game found with given game id")
+        
+        with game.lock:
+            game.player_returned(email)
+            ply = data.get('ply')
+            moves = game.moves_since(ply)
+            response = {
+                "gameId": gameId,
+                "ply": game.ply(),
+                **game.clock_state(),
+                "turn": "white" if game.board.turn == chess.WHITE else "black"
+            }
+            if moves is None:
+                response["fen"] = game.board.fen()
+            
+        if moves is None:
+            socketio.emit('board_state_update', response, to=sid)
+        else:
+            socketio.emit('moves_since', dict(response, from_ply=ply, moves=moves), to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('request_board_state')
+def request_board_state(email, sid, data):
+    try:
+        gameId = data.get('gameId')
+        
+        game = get_game(gameId)
+        if not game:
+            raise Exception("No game found with given game id")
+        
+        with game.lock:
+            # Send the current FEN, board state, and time information
+            response = {
+                "fen": game.board.fen(),
+                "ply": game.ply(),
+                **game.clock_state(),
+                "turn": "white" if game.board.turn == chess.WHITE else "black"
+            }
+            
+        socketio.emit('board_state_update', response, to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('spectate_game')
+def spectate_game(email, sid, data):
+    # Also used by a spectator that fell behind to skip to the current position
+    try:
+        gameId = data.get('gameId')
+        game = get_game(gameId)
+        if not game or not game.is_game_active:
+            raise Exception("No game found with given game id")
+        
+        spectator_fanout.subscribe(sid, gameId)
+        socketio.emit('spectator_state', snapshot(game), to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('stop_spectating')
+def stop_spectating(email, sid, data):
+    try:
+        spectator_fanout.unsubscribe(sid, data.get('gameId'))
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('join_tournament')
+def join_tournament(email, sid, data):
+    try:
+        tournamentId = data.get('tournamentId')
+        tournament = get_tournament(tournamentId)
+        if not tournament:
+            raise Exception("No tournament found with given id")
+        
+        # Seeded by the player's rating in the tournament's time control
+        rating = player_rating(email, tournament.game_type)
+        standing = tournament.join(email, rating)
+        if game_journal:
+            game_journal.tournament_joined(tournamentId, email, rating)
+        socketio.server.enter_room(sid, tournament_room(tournamentId), namespace='/')
+        socketio.emit('tournament_joined', dict(tournament.summary(), standing=dict(
+            standing, rank=tournament.rank_of(email))), to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('leave_tournament')
+def leave_tournament(email, sid, data):
+    try:
+        tournamentId = data.get('tournamentId')
+        tournament = get_tournament(tournamentId)
+        if not tournament or not tournament.withdraw(email):
+            raise Exception("Not in this tournament")
+        if game_journal:
+            game_journal.tournament_withdrew(tournamentId, email)
+        
+        socketio.server.leave_room(sid, tournament_room(tournamentId), namespace='/')
+        socketio.emit('tournament_left', {"tournamentId": tournamentId}, to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+@game_event('tournament_standings')
+def tournament_standings(email, sid, data):
+    try:
+        tournament = get_tournament(data.get('tournamentId'))
+        if not tournament:
+            raise Exception("No tournament found with given id")
+        offset = data.get('offset', 0)
+        limit = data.get('limit', GAMES_PAGE_SIZE)
+        if not isinstance(offset, int) or not isinstance(limit, int) or offset < 0:
+            raise Exception("Invalid offset or limit")
+        
+        standings = tournament.standings(offset, min(max(limit, 1), GAMES_MAX_PAGE_SIZE))
+        socketio.emit('tournament_standings', dict(tournament.summary(), offset=offset, standings=standings,
+                                                   rank=tournament.rank_of(email)), to=sid)
+    except Exception as e:
+        socketio.emit("error", {"message": str(e)}, to=sid)
+
+def refuse_move(data):
+    # The client already played the move on its board: tell it where the game really is
+    route_game_event('move_refused', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('make_move', refused=refuse_move)
+def handle_make_move(data):
+    # The round trip is measured by the worker holding the connection and travels with the move
+    data = dict(data, lag_ms=lag_tracker.rtt_ms(request.sid))
+    route_game_event('make_move', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('resign_game')
+def handle_resign(data):
+    route_game_event('resign_game', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('disconnect')
 def handle_disconnect():
     try:
         email = get_email(request.sid)
+        clear_email(request.sid)
+        event_limiter.forget(request.sid)
+        lag_tracker.forget(request.sid)
+        spectator_fanout.unsubscribe_all(request.sid)
+        if get_sid(email) != request.sid:
+            # The player already reconnected on a new socket; this one is stale
+            return
+        store.remove_player(email, request.sid)
         
         # Check if in waiting queue
-        for gameType in waiting_players:
-            with waiting_lock:
-                if email in waiting_players[gameType]:
-                    waiting_players[gameType].remove(email)
-                    return
+        if store.leave_queue(email):
+            return
                     
         # Check if in active game
-        with active_lock:
-            for gameId, game in list(active_games.items()):  # Fixed: iterate over items
-                if game.player1 == email or game.player2 == email:
-                    opponent = game.get_opponent(email)
-                    game.game_over(opponent, 'Disconnection')
-                    return 
+        gameId = store.player_game(email)
+        if gameId:
+            route_game_event('player_disconnected', gameId, email, request.sid, {'gameId': gameId})
             
     except Exception as e:
-        print(f"Error in disconnect: {str(e)}")
+        log.exception('disconnect_failed', sid=request.sid)
 
-@socketio.on('request_board_state')
+@socket_handler('request_board_state')
 def handle_request_board_state(data):
+    route_game_event('request_board_state', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('resync')
+def handle_resync(data):
+    route_game_event('resync', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('spectate_game')
+def handle_spectate_game(data):
+    route_game_event('spectate_game', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('stop_spectating')
+def handle_stop_spectating(data):
+    route_game_event('stop_spectating', data.get('gameId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('create_tournament')
+def handle_create_tournament(data):
+    # Hosted by this worker; it starts after starts_in seconds
     try:
         email = get_email(request.sid)
-        gameId = data.get('gameId')
+        kind = data.get('kind')
+        gameType = data.get('gameType')
+        rounds = data.get('rounds')
+        minutes = data.get('minutes')
+        starts_in = data.get('starts_in', TOURNAMENT_START_DELAY)
         
-        with active_lock:
-            game = active_games.get(gameId)
-            if not game:
-                raise Exception("No game found with given game id")
-            
-            # Send the current FEN, board state, and time information
-            response = {
-                "fen": game.board.fen(),
-                "player1_time": game.player1_time,
-                "player2_time": game.player2_time,
-                "turn": "white" if game.board.turn == chess.WHITE else "black"
-            }
+        if kind not in KINDS:
+            raise Exception(f"kind must be one of {list(KINDS)}")
+        if gameType not in GAME_TYPES:
+            raise Exception("Wrong game Type")
+        if kind == SWISS and not (isinstance(rounds, int) and 1 <= rounds <= MAX_SWISS_ROUNDS):
+            raise Exception(f"rounds must be between 1 and {MAX_SWISS_ROUNDS}")
+        if kind == ARENA and not (isinstance(minutes, (int, float)) and 1 <= minutes <= MAX_ARENA_MINUTES):
+            raise Exception(f"minutes must be between 1 and {MAX_ARENA_MINUTES}")
+        if not isinstance(starts_in, (int, float)) or not 0 <= starts_in <= 86400:
+            raise Exception("Invalid starts_in")
             
-            emit('board_state_update', response, to=get_sid(email))
+        tournament = Tournament('t' + generate_game_id(), str(data.get('name') or f'{gameType} {kind}')[:60],
+                                gameType, kind, rounds=rounds if kind == SWISS else None,
+                                duration=minutes * 60 if kind == ARENA else None, created_by=email)
+        tournament.scheduled_start = time.time() + starts_in
+        if game_journal:
+            game_journal.tournament_created(tournament)
+        with tournaments_lock:
+            tournaments[tournament.tournamentId] = tournament
+        store.set_game(tournament.tournamentId, cluster.worker_id, ())
+        clock_scheduler.schedule(starts_in, start_tournament, tournament)
+        log.info('tournament_created', tournamentId=tournament.tournamentId, kind=kind, game_type=gameType,
+                 created_by=email)
+        emit('tournament_created', tournament.summary())
     except Exception as e:
         emit("error", {"message": str(e)}, to=request.sid)
-        
+        log.warning('create_tournament_failed', sid=request.sid, error=str(e))
+
+@socket_handler('join_tournament')
+def handle_join_tournament(data):
+    route_game_event('join_tournament', data.get('tournamentId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('leave_tournament')
+def handle_leave_tournament(data):
+    route_game_event('leave_tournament', data.get('tournamentId'), get_email(request.sid), request.sid, data)
+
+@socket_handler('tournament_standings')
+def handle_tournament_standings(data):
+    route_game_event('tournament_standings', data.get('tournamentId'), get_email(request.sid), request.sid, data)
+
+# Recently decoded tokens, so reconnect storms skip the signature check
+token_cache = OrderedDict()
+token_cache_lock = timed_lock('token_cache')
+TOKEN_CACHE_SIZE = 10000
 
 # Token decoding function
 def get_email_from_token():
@@ -571,8 +1585,104 @@ def get_email_from_token():
     if not token:
         return 'anonymous@example.com'
     
+    with token_cache_lock:
+        cached = token_cache.get(token)
+        if cached and cached[1] > time.time():
+            token_cache.move_to_end(token)
+            return cached[0]
+    
     decoded = decode_token(token)
-    return decoded.get('sub', 'anonymous@example.com')
+    email = decoded.get('sub', 'anonymous@example.com')
+    with token_cache_lock:
+        token_cache[token] = (email, decoded.get('exp', float('inf')))
+        if len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+    return email
+
+def restore_games():
+    # Put back the games and tournaments the previous run left in the journal.
+    # Tournaments go first so that a restored game ending reaches its tournament.
+    saved_games, saved_tournaments = game_journal.open()
+    for tournament in saved_tournaments:
+        with tournaments_lock:
+            tournaments[tournament.tournamentId] = tournament
+        store.set_game(tournament.tournamentId, cluster.worker_id, ())
+    for saved in saved_games:
+        game = Game(saved.gameId, saved.white, saved.black, saved.game_type)
+        game.tournament = saved.tournament
+        for move in saved.moves:
+            # Legal when they were played; replaying skips the legality check
+            game.board.push(move)
+        game.position = position_cache.lookup(game.board)
+        game.player1_time, game.player2_time = (round(clock * 1000) for clock in saved.clocks)
+        with active_lock:
+            active_games[game.gameId] = game
+        index_game(game)
+        with game.lock:
+            game.resume()
+    for tournament in saved_tournaments:
+        resume_tournament(tournament)
+    stats = game_journal.stats()
+    log.info('games_restored', games=stats['restored_games'], tournaments=stats['restored_tournaments'],
+             journal_ms=round(stats['restore_ms'], 1))
+
+def resume_tournament(tournament):
+    # Pick a restored tournament up where its timers left off
+    with active_lock:
+        lost = [gameId for gameId in tournament.games if gameId not in active_games]
+    if lost:
+        # Started but never journaled: nobody played them
+        tournament.cancelled(lost)
+        game_journal.tournament_cancelled(tournament.tournamentId, lost)
+    if tournament.state == CREATED:
+        clock_scheduler.schedule(max(0.0, (tournament.scheduled_start or 0) - time.time()), start_tournament,
+                                 tournament)
+    elif tournament.finish_if_done():
+        finish_tournament(tournament)
+    elif tournament.kind == ARENA:
+        schedule_pairing(tournament, 0)
+    elif not tournament.games:
+        # Between Swiss rounds; otherwise the last game of the round moves it on
+        schedule_pairing(tournament, SWISS_ROUND_BREAK)
+
+services_started = False
+
+def start_services():
+    # Worker pools, background threads, the journal restore and the cluster bus.
+    # Only the process that serves sockets may call this: under the reloader
+    # app.py is also imported by the watching parent, which must not fork pools
+    # or play out a second copy of every journaled game.
+    global services_started
+    if services_started:
+        return
+    services_started = True
+    # Pools fork first, while the server has few threads
+    password_hasher.start()
+    atexit.register(password_hasher.stop)
+    bot_pool.start()
+    atexit.register(bot_pool.stop)
+    game_writer.start()
+    atexit.register(game_writer.stop)
+    clock_scheduler.start()
+    outgoing_backlog.start()
+    lag_tracker.start()
+    if store.rated:
+        clock_scheduler.schedule(MATCH_SWEEP_SECONDS, socketio.start_background_task, sweep_match_queues)
+    if game_journal:
+        restore_games()
+        atexit.register(game_journal.stop)
+    cluster.start(handle_worker_message)
+    atexit.register(cluster.stop)
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    if cluster.distributed:
+        # Started by cluster.py: one process per worker, no reloader
+        start_services()
+        socketio.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)),
+                     allow_unsafe_werkzeug=True)
+    else:
+        # debug=True serves from a reloader child (WERKZEUG_RUN_MAIN=true);
+        # the parent only watches files
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_services()
+        socketio.run(app, debug=True)
\ No newline at end of file
@@ -0,0 +1,196 @@
+# How many idle websocket connections each ASYNC_MODE holds while two players
+# keep a fixed p99 move round trip (make_move -> move_made).
+# The server runs in a subprocess; the clients are greenlets speaking raw
+# engine.io, so the load generator itself is not the bottleneck.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+# Run from the server directory: python -m benchmarks.async_mode_bench
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import gevent.event
+import websocket
+from dotenv import load_dotenv
+
+from benchmarks.cluster_harness import SERVER_DIR, make_token, wait_for_port
+
+ORIGIN = 'http://localhost:5173'
+# Knight shuffle that never ends the game
+MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+class Connection:
+    def __init__(self, port, token=None):
+        url = f'ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket'
+        if token:
+            url += f'&token={token}'
+        self.ws = websocket.create_connection(url, origin=ORIGIN, timeout=30)
+        self.ws.recv()  # engine.io open
+        self.ws.send('40')
+        self.handlers = {}
+        self.closed = False
+        while True:
+            packet = self.ws.recv()
+            if packet.startswith('40'):
+                break
+            if packet.startswith('44'):
+                # connect_error: the server turned the connection away
+                self.ws.close()
+                raise ConnectionRefusedError(packet[2:])
+        self.reader = gevent.spawn(self._read)
+
+    def _read(self):
+        while not self.closed:
+            try:
+                packet = self.ws.recv()
+            except Exception:
+                return
+            if packet == '2':
+                self.ws.send('3')
+            elif packet.startswith('42'):
+                # An ack id between the type and the payload asks for a 43 reply (lag_ping)
+                body = packet[2:]
+                ack = body[:len(body) - len(body.lstrip('0123456789'))]
+                event, *args = json.loads(body[len(ack):])
+                handler = self.handlers.get(event)
+                if handler:
+                    handler(*args)
+                if ack:
+                    self.ws.send(f'43{ack}[]')
+
+    def emit(self, event, data):
+        self.ws.send('42' + json.dumps([event, data]))
+
+    def close(self):
+        self.closed = True
+        try:
+            # Drop the socket without the close handshake; thousands of polite closes take minutes
+            self.ws.shutdown()
+        except Exception:
+            pass
+
+
+def start_server(mode, port, workdir):
+    env = dict(os.environ, ASYNC_MODE=mode, PYTHONPATH=SERVER_DIR)
+    code = (f"import app; app.start_services(); app.socketio.run(app.app, host='127.0.0.1', port={port}, "
+            f"allow_unsafe_werkzeug=True, log_output=False)")
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server
+
+
+def server_memory_mb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def open_idle(port, count, idle):
+    def open_one():
+        try:
+            idle.append(Connection(port))
+        except Exception:
+            pass
+    jobs = [gevent.spawn(open_one) for _ in range(count)]
+    gevent.joinall(jobs, timeout=120)
+
+
+def measure_moves(white, black, gameId, moves):
+    latencies = []
+    done = gevent.event.Event()
+    state = {}
+
+    def on_move(data):
+        if data.get('move') == state.get('expect'):
+            latencies.append((time.perf_counter() - state['sent']) * 1000)
+            done.set()
+    white.handlers['move_made'] = on_move
+    for i in range(moves):
+        player = white if i % 2 == 0 else black
+        done.clear()
+        state['expect'] = MOVES[i % len(MOVES)]
+        state['sent'] = time.perf_counter()
+        player.emit('make_move', {'gameId': gameId, 'move': state['expect']})
+        if not done.wait(5):
+            latencies.append(5000.0)
+    latencies.sort()
+    return latencies
+
+
+def run_mode(mode, args, secret, workdir, port):
+    server = start_server(mode, port, workdir)
+    idle = []
+    results = []
+    try:
+        for level in args.levels:
+            open_idle(port, level - len(idle), idle)
+            found = {}
+            white = Connection(port, make_token(secret, f'white-{level}@example.com'))
+            black = Connection(port, make_token(secret, f'black-{level}@example.com'))
+            white.handlers['game_found'] = lambda data: found.update(data)
+            gameType = 'Rapid'
+            white.emit('join_game', {'gameType': gameType})
+            gevent.sleep(0.2)
+            black.emit('join_game', {'gameType': gameType})
+            deadline = time.monotonic() + 10
+            while 'gameId' not in found and time.monotonic() < deadline:
+                gevent.sleep(0.01)
+            if 'gameId' not in found:
+                print(f"  {mode}: no game at {len(idle)} connections")
+                break
+            if found['opponent']['color'] == 'white':
+                white, black = black, white
+            latencies = measure_moves(white, black, found['gameId'], args.moves)
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            results.append((len(idle), p50, p99))
+            print(f"  {mode}: {len(idle):5d} idle connections  move p50 {p50:7.2f} ms  p99 {p99:7.2f} ms  "
+                  f"server RSS {server_memory_mb(server.pid):6.0f} MB")
+            white.close()
+            black.close()
+            if p99 > args.p99_ms or len(idle) < level:
+                break
+    finally:
+        for conn in idle:
+            conn.close()
+        server.terminate()
+        server.wait()
+    held = max((n for n, _, p99 in results if p99 <= args.p99_ms), default=0)
+    return held
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=[100, 250, 500, 1000, 2000])
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--p99-ms', type=float, default=50.0)
+    parser.add_argument('--modes', nargs='+', default=['threading', 'gevent'])
+    parser.add_argument('--port', type=int, default=5700)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    workdir = tempfile.mkdtemp(prefix='gochess-async-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    held = {}
+    for i, mode in enumerate(args.modes):
+        held[mode] = run_mode(mode, args, secret, workdir, args.port + i)
+    for mode, count in held.items():
+        print(f"{mode}: held {count} idle connections at move p99 <= {args.p99_ms:g} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Computer opponent: search speed (nodes/s and depth reached) per level on a
+# few positions, in process; then bot-move latency end to end, with players
+# in concurrent bot games answering every bot move over the socket server,
+# and how long their own make_move handler took meanwhile.
+# Run from the server directory: python -m benchmarks.bot_bench [--games 4]
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import chess
+
+import bot
+
+POSITIONS = {
+    'opening': [],
+    'italian': ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6', 'd2d3', 'f8c5', 'c2c3', 'd7d6', 'e1g1', 'e8g8'],
+    'qgd': ['d2d4', 'd7d5', 'c2c4', 'e7e6', 'b1c3', 'g8f6', 'c4d5', 'e6d5', 'c1g5', 'f8e7', 'e2e3', 'e8g8',
+            'f1d3', 'b8d7', 'd1c2', 'f8e8', 'g1e2', 'd7f8'],
+}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def search_speed(levels, budget):
+    print(f"{'level':>5} {'position':>11} {'depth':>6} {'nodes':>8} {'seconds':>8} {'nodes/s':>9} {'move':>6}")
+    for level in levels:
+        for name, moves in POSITIONS.items():
+            result = bot.think(moves, budget, level, seed=1)
+            nps = result['nodes'] / result['seconds'] if result['seconds'] else 0
+            print(f"{level:>5} {name:>11} {result['depth']:>6} {result['nodes']:>8} {result['seconds']:>8.2f} "
+                  f"{nps:>9.0f} {result['move']:>6}")
+
+
+def play_games(app_module, games, level, moves_per_game):
+    from flask_jwt_extended import create_access_token
+    bot_latencies = []
+    handler_latencies = []
+    results_lock = threading.Lock()
+
+    def play(index):
+        email = f'human{index}@example.com'
+        with app_module.app.app_context():
+            token = create_access_token(identity=email)
+        client = app_module.socketio.test_client(app_module.app, query_string=f'token={token}')
+        client.emit('play_bot', {'gameType': 'Blitz', 'level': level})
+        found = [m for m in client.get_received() if m['name'] == 'game_found'][0]['args'][0]
+        game = app_module.active_games[found['gameId']]
+        white = game.player1 == email
+        rng = random.Random(index)
+        board = chess.Board()
+        waiting_since = time.perf_counter()
+        local_bot, local_handler = [], []
+        over = False
+        while len(local_handler) < moves_per_game and not over and not board.is_game_over():
+            if (board.turn == chess.WHITE) != white:
+                # Wait for the bot's reply
+                while True:
+                    received = client.get_received()
+                    moves = [m['args'][0]['move'] for m in received if m['name'] == 'move_made']
+                    over = any(m['name'] == 'game_over' for m in received)
+                    if moves or over:
+                        break
+                    time.sleep(0.005)
+                for move in moves:
+                    board.push_uci(move)
+                local_bot.append(time.perf_counter() - waiting_since)
+                continue
+            move = rng.choice(list(board.legal_moves))
+            started = time.perf_counter()
+            client.emit('make_move', {'gameId': found['gameId'], 'move': move.uci()})
+            local_handler.append(time.perf_counter() - started)
+            waiting_since = time.perf_counter()
+            # Our own move_made echo
+            received = client.get_received()
+            board.push(move)
+            echoed = [m['args'][0]['move'] for m in received if m['name'] == 'move_made']
+            for extra in echoed[1:]:
+                board.push_uci(extra)
+                local_bot.append(time.perf_counter() - waiting_since)
+        client.emit('resign_game', {'gameId': found['gameId']})
+        client.disconnect()
+        with results_lock:
+            bot_latencies.extend(local_bot)
+            handler_latencies.extend(local_handler)
+
+    threads = [threading.Thread(target=play, args=(i,)) for i in range(games)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return bot_latencies, handler_latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--levels', type=int, nargs='+', default=sorted(bot.LEVELS))
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds per search in the speed table')
+    parser.add_argument('--games', type=int, default=4, help='concurrent bot games in the latency run')
+    parser.add_argument('--game-levels', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--moves', type=int, default=10, help='moves each player makes per game')
+    args = parser.parse_args()
+
+    print(f"search speed, {args.budget:.1f}s budget per move, {os.cpu_count()} CPUs")
+    search_speed(args.levels, args.budget)
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-bot-'))
+    import app as app_module
+    app_module.start_services()
+    print(f"\n{args.games} concurrent Blitz games against the bot, {app_module.bot_pool.workers} pool workers")
+    print(f"{'level':>5} {'bot moves':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'make_move p99 ms':>17}")
+    for level in args.game_levels:
+        bot_latencies, handler_latencies, _ = play_games(app_module, args.games, level, args.moves)
+        print(f"{level:>5} {len(bot_latencies):>9} {percentile(bot_latencies, .5) * 1000:>8.0f} "
+              f"{percentile(bot_latencies, .99) * 1000:>8.0f} {max(bot_latencies, default=0) * 1000:>8.0f} "
+              f"{percentile(handler_latencies, .99) * 1000:>17.1f}")
+    print(app_module.bot_pool.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Bytes sent and emit CPU per move: the old two per-player emits carrying a
+# full FEN versus one room broadcast of a delta.
+# Run from the server directory: python -m benchmarks.broadcast_bench
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import chess
+
+# Knight shuffle that never ends the game
+MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def packet_size(event, payload):
+    # Socket.IO event packet as sent on the wire: 42["event",{...}]
+    return len('42' + json.dumps([event, payload], separators=(',', ':')))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--moves', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-broadcast-'))
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    socketio = app_module.socketio
+
+    clients = []
+    for player in ('white@example.com', 'black@example.com'):
+        with app_module.app.app_context():
+            token = create_access_token(identity=player)
+        clients.append(socketio.test_client(app_module.app, query_string=f'token={token}'))
+    sids = [app_module.get_sid('white@example.com'), app_module.get_sid('black@example.com')]
+    room = 'bench-room'
+    for sid in sids:
+        socketio.server.enter_room(sid, room, namespace='/')
+
+    board = chess.Board()
+    results = {}
+    for mode in ('per-player+fen', 'room+delta'):
+        sent_bytes = 0
+        cpu_start = time.process_time()
+        for i in range(args.moves):
+            move = chess.Move.from_uci(MOVES[i % len(MOVES)])
+            board.push(move)
+            if mode == 'per-player+fen':
+                payload = {"move": str(move), "fen": board.fen(), "player1_time": 600, "player2_time": 600,
+                           "turn": "white" if board.turn == chess.WHITE else "black"}
+                for sid in sids:
+                    socketio.emit('move_made', payload, to=sid)
+                sent_bytes += 2 * packet_size('move_made', payload)
+            else:
+                payload = {"move": str(move), "ply": len(board.move_stack), "player1_time": 600,
+                           "player2_time": 600, "turn": "white" if board.turn == chess.WHITE else "black"}
+                socketio.emit('move_made', payload, to=room)
+                sent_bytes += len(sids) * packet_size('move_made', payload)
+            if i % 100 == 0:
+                for client in clients:
+                    client.get_received()
+        cpu = time.process_time() - cpu_start
+        results[mode] = (sent_bytes / args.moves, cpu / args.moves * 1e6)
+
+    print(f"{'mode':>16} {'bytes/move':>11} {'emit cpu us/move':>17}")
+    for mode, (sent, cpu) in results.items():
+        print(f"{mode:>16} {sent:>11.1f} {cpu:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Compares the old thread-per-game clock with the shared ClockScheduler.
+# Run from the server directory: python -m benchmarks.clock_scheduler_bench
+import argparse
+import random
+import resource
+import threading
+import time
+
+from clock_scheduler import ClockScheduler
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+# Mirrors the old Game.update_timer loop: one thread per game, waking every second
+def run_thread_per_game(games, duration):
+    stop = threading.Event()
+    clocks = [600] * games
+    lock = threading.Lock()
+
+    def update_timer(index):
+        while not stop.is_set():
+            with lock:
+                clocks[index] = max(0, clocks[index] - 1)
+            stop.wait(1)
+
+    threading.stack_size(256 * 1024)
+    threads = [threading.Thread(target=update_timer, args=(i,), daemon=True) for i in range(games)]
+    for t in threads:
+        t.start()
+    threads_running = threading.active_count()
+    cpu_start = cpu_seconds()
+    time.sleep(duration)
+    cpu_used = cpu_seconds() - cpu_start
+    stop.set()
+    for t in threads:
+        t.join()
+    threading.stack_size(0)
+    return cpu_used, threads_running
+
+
+# Every game keeps one flag deadline in the shared heap; a move replaces it
+def run_scheduler(games, duration, moves_per_sec):
+    scheduler = ClockScheduler()
+    scheduler.start()
+    flags = [0]
+    calls = [None] * games
+
+    def on_flag(index):
+        flags[0] += 1
+
+    start = time.monotonic()
+    for i in range(games):
+        calls[i] = scheduler.schedule_at(start + random.uniform(60, 600), on_flag, i)
+    threads_running = threading.active_count()
+
+    cpu_start = cpu_seconds()
+    deadline = time.monotonic() + duration
+    # Simulate moves: each one cancels the old deadline and schedules a new one
+    interval = 1.0 / moves_per_sec if moves_per_sec else None
+    while time.monotonic() < deadline:
+        if interval is None:
+            time.sleep(deadline - time.monotonic())
+            break
+        index = random.randrange(games)
+        scheduler.cancel(calls[index])
+        calls[index] = scheduler.schedule(random.uniform(60, 600), on_flag, index)
+        time.sleep(interval)
+    cpu_used = cpu_seconds() - cpu_start
+    scheduler.stop()
+    return cpu_used, threads_running
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--moves-per-sec', type=float, default=0,
+                        help='simulated moves per second in scheduler mode (0 = idle clocks)')
+    args = parser.parse_args()
+
+    print(f"{'games':>8} {'mode':>16} {'threads':>8} {'cpu %':>8}")
+    for games in args.games:
+        cpu, threads = run_thread_per_game(games, args.duration)
+        print(f"{games:>8} {'thread-per-game':>16} {threads:>8} {100 * cpu / args.duration:>8.2f}")
+        cpu, threads = run_scheduler(games, args.duration, args.moves_per_sec)
+        print(f"{games:>8} {'scheduler':>16} {threads:>8} {100 * cpu / args.duration:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Starts several workers sharing a SQLite store (as cluster.py does) and drives
+# players connected to different workers through a game: cross-worker pairing,
+# moves routed to the owning worker, resignation, and queue cancellation.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+# Run from the server directory: python -m benchmarks.cluster_harness
+import argparse
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import socketio
+from dotenv import load_dotenv
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_token(secret, email):
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = secret
+    JWTManager(app)
+    with app.app_context():
+        return create_access_token(identity=email)
+
+
+class Player:
+    def __init__(self, email, port, secret):
+        self.email = email
+        self.events = queue.Queue()
+        self.client = socketio.Client()
+        for event in ('waiting_for_opponent', 'game_found', 'move_made', 'game_over',
+                      'board_state_update', 'error'):
+            self.client.on(event, self._recorder(event))
+        # Long-polling: the websocket client sends an Origin the CORS settings reject
+        self.client.connect(f'http://127.0.0.1:{port}?token={make_token(secret, email)}',
+                            transports=['polling'])
+
+    def _recorder(self, event):
+        return lambda data=None: self.events.put((event, data, time.perf_counter()))
+
+    def expect(self, event, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AssertionError(f"{self.email}: no {event} within {timeout}s")
+            name, data, at = self.events.get(timeout=remaining)
+            if name == 'error':
+                raise AssertionError(f"{self.email}: error {data}")
+            if name == event:
+                return data, at
+
+
+def wait_for_port(port, timeout=15):
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--games', type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    workdir = tempfile.mkdtemp(prefix='gochess-cluster-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+    store = f'sqlite:///{os.path.join(workdir, "cluster.db")}'
+    cluster = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, 'cluster.py'),
+                                '--workers', str(args.workers), '--port', str(args.port), '--store', store],
+                               cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    try:
+        for i in range(args.workers):
+            wait_for_port(args.port + i)
+
+        move_latencies = []
+        for n in range(args.games):
+            # Opponents always sit on different workers
+            a = Player(f'a{n}@example.com', args.port + n % args.workers, secret)
+            b = Player(f'b{n}@example.com', args.port + (n + 1) % args.workers, secret)
+            a.client.emit('join_game', {'gameType': 'Blitz'})
+            a.expect('waiting_for_opponent')
+            b.client.emit('join_game', {'gameType': 'Blitz'})
+            found_a, _ = a.expect('game_found')
+            found_b, _ = b.expect('game_found')
+            assert found_a['gameId'] == found_b['gameId']
+            gameId = found_a['gameId']
+            white, black = (a, b) if found_a['opponent']['color'] == 'black' else (b, a)
+
+            for player, move in ((white, 'e2e4'), (black, 'e7e5'), (white, 'g1f3')):
+                sent = time.perf_counter()
+                player.client.emit('make_move', {'gameId': gameId, 'move': move})
+                for p in (white, black):
+                    data, at = p.expect('move_made')
+                    assert data['move'] == move, data
+                    move_latencies.append((at - sent) * 1000)
+
+            black.client.emit('request_board_state', {'gameId': gameId})
+            state, _ = black.expect('board_state_update')
+            assert state['ply'] == 3, state
+
+            black.client.emit('resign_game', {'gameId': gameId})
+            for p in (white, black):
+                result, _ = p.expect('game_over')
+                assert result['reason'] == 'Resign' and result['winner'] == white.email, result
+            a.client.disconnect()
+            b.client.disconnect()
+
+        # A player queued on one worker and cancelled is not matched from another
+        c = Player('c@example.com', args.port, secret)
+        d = Player('d@example.com', args.port + (1 % args.workers), secret)
+        c.client.emit('join_game', {'gameType': 'Rapid'})
+        c.expect('waiting_for_opponent')
+        c.client.emit('stop_waiting_for_opponent', {'gameType': 'Rapid'})
+        time.sleep(0.2)
+        d.client.emit('join_game', {'gameType': 'Rapid'})
+        d.expect('waiting_for_opponent')
+        c.client.disconnect()
+        d.client.disconnect()
+
+        move_latencies.sort()
+        print(f"{args.games} cross-worker games on {args.workers} workers: ok")
+        print(f"move_made latency ms: p50 {move_latencies[len(move_latencies) // 2]:.2f} "
+              f"max {move_latencies[-1]:.2f}")
+    finally:
+        # The group, so the workers' forked pool processes go with them
+        os.killpg(cluster.pid, signal.SIGTERM)
+        cluster.wait()
+
+
+if __name__ == '__main__':
+    main()
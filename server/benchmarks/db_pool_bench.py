@@ -0,0 +1,122 @@
+# Requests/sec on the read endpoints (/auth, /get_user_info) with a fresh
+# connection per request versus the pooled WAL connections.
+# Run from the server directory: python -m benchmarks.db_pool_bench
+import argparse
+import os
+import runpy
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The connection helper the server used before the pool
+def legacy_get_connection():
+    conn = sqlite3.connect('chess.db')
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    return conn, cur
+
+
+def seed_database(users):
+    runpy.run_module('buildDatabase')
+    conn = sqlite3.connect('chess.db')
+    conn.executemany('INSERT INTO user (username, email, password) VALUES (?, ?, ?)',
+                     [(f'user{i}', f'user{i}@example.com', 'x') for i in range(users)])
+    conn.commit()
+    conn.close()
+
+
+# Background writer that keeps committing so readers see lock contention
+def start_writer(stop, writes_per_sec):
+    def write():
+        conn = sqlite3.connect('chess.db', timeout=10)
+        while not stop.is_set():
+            conn.execute("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn) "
+                         "VALUES (1, 2, 'Blitz', 0, '1. e4 e5')")
+            conn.commit()
+            stop.wait(1.0 / writes_per_sec)
+        conn.close()
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+def run(app_module, tokens, users, concurrency, duration, writes_per_sec):
+    flask_app = app_module.app
+    counts = {'ok': 0, 'error': 0}
+    count_lock = threading.Lock()
+    stop = threading.Event()
+    writer = start_writer(stop, writes_per_sec) if writes_per_sec else None
+
+    def client_loop(worker):
+        client = flask_app.test_client()
+        ok = error = 0
+        i = worker
+        while not stop.is_set():
+            if i % 2:
+                response = client.get(f'/auth?username=user{i % users}')
+                good = response.status_code == 409
+            else:
+                token = tokens[i % len(tokens)]
+                response = client.get('/get_user_info', headers={'Authorization': f'Bearer {token}'})
+                good = response.status_code == 200
+            if good:
+                ok += 1
+            else:
+                error += 1
+            i += concurrency
+        with count_lock:
+            counts['ok'] += ok
+            counts['error'] += error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for worker in range(concurrency):
+            pool.submit(client_loop, worker)
+        time.sleep(duration)
+        stop.set()
+    if writer:
+        writer.join()
+    return counts['ok'] / duration, counts['error']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--writes-per-sec', type=float, default=50)
+    args = parser.parse_args()
+
+    server_dir = os.getcwd()
+    legacy_dir = tempfile.mkdtemp(prefix='gochess-legacy-')
+    pooled_dir = tempfile.mkdtemp(prefix='gochess-pooled-')
+
+    os.chdir(legacy_dir)
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    seed_database(args.users)
+    with app_module.app.app_context():
+        tokens = [create_access_token(identity=f'user{i}@example.com') for i in range(min(args.users, 100))]
+
+    pooled_get_connection = app_module.get_connection
+    print(f"{'concurrency':>12} {'mode':>8} {'req/s':>10} {'errors':>8}")
+    for concurrency in args.concurrency:
+        os.chdir(legacy_dir)
+        app_module.get_connection = legacy_get_connection
+        rps, errors = run(app_module, tokens, args.users, concurrency, args.duration, args.writes_per_sec)
+        print(f"{concurrency:>12} {'legacy':>8} {rps:>10.1f} {errors:>8}")
+
+        os.chdir(pooled_dir)
+        if not os.path.exists('chess.db'):
+            seed_database(args.users)
+        app_module.get_connection = pooled_get_connection
+        rps, errors = run(app_module, tokens, args.users, concurrency, args.duration, args.writes_per_sec)
+        print(f"{concurrency:>12} {'pooled':>8} {rps:>10.1f} {errors:>8}")
+    os.chdir(server_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Opening explorer: bulk build throughput with 1..N worker processes, the
+# extra work a game writer flush does per batch, and /explorer lookup latency
+# for positions taken from the indexed games.
+# Run from the server directory: python -m benchmarks.explorer_bench [--games 100000]
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from urllib.parse import quote
+
+import chess
+
+from benchmarks.export_bench import seed_database
+from benchmarks.position_cache_bench import synthetic_games
+import explorer
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-explorer-'))
+    seed_database(args.games, 1000, args.seed)
+    print(f"{args.games} games, first {explorer.OPENING_PLIES} plies indexed, {os.cpu_count()} CPUs")
+
+    print(f"{'workers':>8} {'seconds':>8} {'games/s':>9}")
+    for workers in args.workers:
+        started = time.perf_counter()
+        games = explorer.build('chess.db', workers)
+        elapsed = time.perf_counter() - started
+        print(f"{workers:>8} {elapsed:>8.1f} {games / elapsed:>9.0f}")
+    conn = sqlite3.connect('chess.db')
+    rows, = conn.execute('SELECT count(*) FROM opening_stats').fetchone()
+    print(f"opening_stats: {rows} rows, {os.path.getsize('chess.db') / 2 ** 20:.0f} MiB database")
+
+    # What each game writer flush of 50 games now also does
+    batch = [(moves, random.randrange(3)) for moves in synthetic_games(50, 80, args.seed + 1)]
+    started = time.perf_counter()
+    explorer.record_games(conn.cursor(), batch)
+    conn.rollback()
+    print(f"live update: {(time.perf_counter() - started) * 1000:.1f} ms per 50-game batch")
+    conn.close()
+
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    with app_module.app.app_context():
+        token = create_access_token(identity='user0@example.com')
+    client = app_module.app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # Positions along the seeded games: mostly well-trodden early ones
+    rng = random.Random(args.seed)
+    fens = []
+    for moves in synthetic_games(200, 80, args.seed):
+        board = chess.Board()
+        for move in moves[:rng.randrange(explorer.OPENING_PLIES)]:
+            board.push(move)
+        fens.append(board.fen())
+    latencies = []
+    found = 0
+    for i in range(args.lookups):
+        started = time.perf_counter()
+        response = client.get(f'/explorer?fen={quote(fens[i % len(fens)])}', headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found += bool(response.json['moves'])
+    print(f"lookup over HTTP: p50 {percentile(latencies, .5):.2f} ms, p99 {percentile(latencies, .99):.2f} ms, "
+          f"{found}/{args.lookups} positions with moves")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Streams /games/export over a database of synthetic games (a million by
+# default) and checks that the server's memory stays flat: RSS is sampled
+# while the body is consumed and the run fails if it grows by more than
+# --max-growth-mb. Also reports export throughput.
+# Run from the server directory: python -m benchmarks.export_bench [--games 1000000]
+import argparse
+import os
+import random
+import runpy
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.position_cache_bench import synthetic_games
+from move_codec import encode_moves
+
+GAME_TYPES = ['Blitz', 'Rapid', 'Bullet']
+
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def seed_database(games, users, seed):
+    runpy.run_module('buildDatabase')
+    rng = random.Random(seed)
+    blobs = [encode_moves(moves) for moves in synthetic_games(200, 80, seed)]
+    conn = sqlite3.connect('chess.db')
+    conn.executemany('INSERT INTO user (username, email, password) VALUES (?, ?, ?)',
+                     [(f'user{i}', f'user{i}@example.com', 'x') for i in range(users)])
+    # Spread evenly over 2025
+    start = datetime(2025, 1, 1)
+    step = timedelta(days=365) / games
+    batch = []
+    for n in range(games):
+        white, black = rng.sample(range(1, users + 1), 2)
+        batch.append((white, black, rng.choice(GAME_TYPES), rng.randrange(3), rng.choice(blobs), 'Checkmate',
+                      (start + n * step).strftime('%Y-%m-%d %H:%M:%S')))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn, moves, "
+                             "termination, date_of_game) VALUES (?, ?, ?, ?, '', ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn, moves, "
+                         "termination, date_of_game) VALUES (?, ?, ?, ?, '', ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def stream(client, token, query, marker):
+    # marker counts games in the uncompressed body; None for gzip
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get(f'/games/export?{query}', headers=headers, buffered=False)
+    assert response.status_code == 200, response.status_code
+    start = time.perf_counter()
+    baseline = peak = rss_mb()
+    size = chunks = games = 0
+    for chunk in response.response:
+        if chunks == 0 and marker is None:
+            assert chunk[:2] == b'\x1f\x8b', 'not a gzip stream'
+        size += len(chunk)
+        chunks += 1
+        if marker:
+            games += chunk.count(marker)
+        if chunks % 50 == 0:
+            peak = max(peak, rss_mb())
+    response.close()
+    peak = max(peak, rss_mb())
+    return time.perf_counter() - start, size, chunks, games, baseline, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--pgn-games', type=int, default=20000, help='size of the PGN run (SAN is slow)')
+    parser.add_argument('--max-growth-mb', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-export-'))
+    started = time.perf_counter()
+    seed_database(args.games, args.users, args.seed)
+    print(f"seeded {args.games} games in {time.perf_counter() - started:.1f}s, "
+          f"{os.path.getsize('chess.db') / 2 ** 20:.0f} MiB")
+
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    with app_module.app.app_context():
+        token = create_access_token(identity='user0@example.com')
+    client = app_module.app.test_client()
+
+    pgn_days = max(1, args.pgn_games * 365 // args.games)
+    runs = [
+        ('site ndjson', 'format=ndjson', b'\n'),
+        ('site ndjson gzip', 'format=ndjson&gzip=true', None),
+        ('user pgn', 'format=pgn&userid=1', b'[Event '),
+        (f'site pgn, {pgn_days} days', f"format=pgn&until={(datetime(2025, 1, 1) + timedelta(days=pgn_days - 1)):%Y-%m-%d}",
+         b'[Event '),
+    ]
+    failed = False
+    print(f"{'export':>22} {'games':>8} {'games/s':>9} {'MiB':>8} {'chunks':>7} {'rss start':>10} {'rss peak':>9}")
+    for name, query, marker in runs:
+        elapsed, size, chunks, games, baseline, peak = stream(client, token, query, marker)
+        games = games if marker else args.games
+        print(f"{name:>22} {games:8d} {games / elapsed:9.0f} {size / 2 ** 20:8.1f} {chunks:7d} "
+              f"{baseline:10.1f} {peak:9.1f}")
+        if peak - baseline > args.max_growth_mb:
+            print(f"  RSS grew {peak - baseline:.1f} MiB during the export (limit {args.max_growth_mb})")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# Honest players' make_move -> move_made round trips while flooders are
+# connected: clients in their own games firing request_board_state at
+# --flood-rate, and one that does the same but never reads its socket. Runs the
+# server without flooders, with flooders and rate limiting off, and with the
+# default limits, and reports move latency, server RSS and the flow control
+# counters from /status.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+# Run from the server directory: python -m benchmarks.flood_bench [--games 10 --flooders 4]
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import gevent.event
+import requests
+from dotenv import load_dotenv
+
+from benchmarks.async_mode_bench import MOVES, Connection, server_memory_mb
+from benchmarks.cluster_harness import SERVER_DIR, make_token, wait_for_port
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def start_server(port, workdir, rate_limits):
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR, SOCKET_RATE_LIMITS=rate_limits, GAME_JOURNAL_DIR='')
+    code = (f"import app; app.start_services(); app.socketio.run(app.app, host='127.0.0.1', port={port}, "
+            f"allow_unsafe_werkzeug=True, log_output=False)")
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    wait_for_port(port)
+    return server
+
+
+def start_game(port, secret, name):
+    # Two connections paired in a Rapid game: (white, black, gameId)
+    found = {}
+    first = Connection(port, make_token(secret, f'{name}-a@example.com'))
+    second = Connection(port, make_token(secret, f'{name}-b@example.com'))
+    first.handlers['game_found'] = lambda data: found.update(data)
+    first.emit('join_game', {'gameType': 'Rapid'})
+    gevent.sleep(0.05)
+    second.emit('join_game', {'gameType': 'Rapid'})
+    deadline = time.monotonic() + 10
+    while 'gameId' not in found and time.monotonic() < deadline:
+        gevent.sleep(0.01)
+    if 'gameId' not in found:
+        raise RuntimeError(f"{name}: no game")
+    if found['opponent']['color'] == 'white':
+        return second, first, found['gameId']
+    return first, second, found['gameId']
+
+
+def play(white, black, gameId, moves, think):
+    # make_move -> move_made round trips in ms, with think time between moves
+    latencies = []
+    arrived = gevent.event.Event()
+    state = {}
+
+    def on_move(data):
+        if data.get('move') == state.get('expect'):
+            latencies.append((time.perf_counter() - state['sent']) * 1000)
+            arrived.set()
+    white.handlers['move_made'] = on_move
+    for i in range(moves):
+        gevent.sleep(think)
+        arrived.clear()
+        state['expect'] = MOVES[i % len(MOVES)]
+        state['sent'] = time.perf_counter()
+        (white if i % 2 == 0 else black).emit('make_move', {'gameId': gameId, 'move': state['expect']})
+        if not arrived.wait(5):
+            latencies.append(5000.0)
+    return latencies
+
+
+def flood(conn, gameId, stop, sent, reconnect, rate):
+    # rate messages a second in batches of 50, reconnecting straight away when
+    # the server cuts it off. Capped so the load generator, which shares the
+    # machine, leaves the server some CPU.
+    message = {'gameId': gameId}
+    next_batch = time.monotonic()
+    while not stop.is_set():
+        try:
+            for _ in range(50):
+                conn.emit('request_board_state', message)
+            if not conn.ws.connected:
+                raise ConnectionError('closed by the server')
+        except Exception:
+            sent[1] += 1
+            try:
+                conn = reconnect()
+            except Exception:
+                gevent.sleep(0.1)
+            continue
+        sent[0] += 50
+        next_batch += 50 / rate
+        gevent.sleep(max(0.0, next_batch - time.monotonic()))
+
+
+def run(name, args, secret, workdir, port, flooders, rate_limits):
+    server = start_server(port, workdir, rate_limits)
+    stop = gevent.event.Event()
+    sent = [0, 0]  # messages, reconnects
+    try:
+        games = [start_game(port, secret, f'{name}-honest{i}') for i in range(args.games)]
+        jobs = []
+        for i in range(flooders):
+            white, _, gameId = start_game(port, secret, f'{name}-flood{i}')
+            token = make_token(secret, f'{name}-flood{i}-a@example.com')
+
+            def reconnect(token=token, reading=i != 0):
+                conn = Connection(port, token)
+                if not reading:
+                    conn.closed = True
+                    conn.reader.kill()
+                return conn
+            if i == 0:
+                # Stops reading: its replies pile up in the server's queue for it
+                white.closed = True
+                white.reader.kill()
+            jobs.append(gevent.spawn(flood, white, gameId, stop, sent, reconnect, args.flood_rate))
+        gevent.sleep(1)
+        started = time.perf_counter()
+        rounds = [gevent.spawn(play, white, black, gameId, args.moves, args.think) for white, black, gameId in games]
+        gevent.joinall(rounds)
+        elapsed = time.perf_counter() - started
+        latencies = [latency for job in rounds for latency in job.value]
+        status = requests.get(f'http://127.0.0.1:{port}/status', timeout=30).json()
+        rss = server_memory_mb(server.pid)
+    finally:
+        stop.set()
+        # The group, so the server's forked pool workers go with it
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+    limiter, backlog = status['event_limiter'], status['outgoing_backlog']
+    print(f"{name:>16} {percentile(latencies, .5):>8.1f} {percentile(latencies, .99):>8.1f} "
+          f"{max(latencies):>8.0f} {sent[0] / elapsed:>10.0f} {sum(limiter['throttled'].values()):>10} "
+          f"{sent[1]:>10} {rss:>7.0f}  {backlog['aborted']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=10, help='honest games measured concurrently')
+    parser.add_argument('--moves', type=int, default=100, help='moves per honest game')
+    parser.add_argument('--think', type=float, default=0.1, help='seconds between moves in a game')
+    parser.add_argument('--flooders', type=int, default=4)
+    parser.add_argument('--flood-rate', type=float, default=2000, help='messages per second per flooder')
+    parser.add_argument('--port', type=int, default=5750)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    workdir = tempfile.mkdtemp(prefix='gochess-flood-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    print(f"{args.games} honest games x {args.moves} moves, {args.flooders} flooders, {os.cpu_count()} CPUs")
+    print(f"{'run':>16} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'flood/s':>10} {'throttled':>10} "
+          f"{'reconnects':>10} {'RSS MB':>7}  aborted")
+    runs = [('no flooders', 0, ''), ('flood, no limits', args.flooders, 'off'), ('flood, limits', args.flooders, '')]
+    for i, (name, flooders, rate_limits) in enumerate(runs):
+        run(name, args, secret, workdir, args.port + i, flooders, rate_limits)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Clock charged per move against the time a player actually thought, for a
+# player on a slow line (--delay seconds each way, so a round trip of twice
+# that) against one on loopback. Runs the server with lag compensation off
+# (LAG_COMP_MAX_MS=0) and with the defaults; pings every half second so the
+# round trip estimate settles before play.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+# Run from the server directory: python -m benchmarks.lag_bench [--delay 0.1 --think 0.3]
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+import gevent
+import gevent.event
+import requests
+from dotenv import load_dotenv
+
+from benchmarks.async_mode_bench import MOVES, Connection
+from benchmarks.cluster_harness import SERVER_DIR, make_token, wait_for_port
+
+
+class SlowConnection(Connection):
+    # Every packet in either direction is held back by delay seconds
+    def __init__(self, port, token, delay):
+        self.delay = delay
+        super().__init__(port, token)
+
+    def _read(self):
+        while not self.closed:
+            try:
+                packet = self.ws.recv()
+            except Exception:
+                return
+            gevent.spawn_later(self.delay, self._receive, packet)
+
+    def _receive(self, packet):
+        if packet == '2':
+            self._send('3')
+        elif packet.startswith('42'):
+            body = packet[2:]
+            ack = body[:len(body) - len(body.lstrip('0123456789'))]
+            event, *args = json.loads(body[len(ack):])
+            handler = self.handlers.get(event)
+            if handler:
+                handler(*args)
+            if ack:
+                self._send(f'43{ack}[]')
+
+    def _send(self, packet):
+        gevent.spawn_later(self.delay, self.ws.send, packet)
+
+    def emit(self, event, data):
+        self._send('42' + json.dumps([event, data]))
+
+
+def start_server(port, workdir, lag_max_ms):
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR, GAME_JOURNAL_DIR='', LAG_PING_SECONDS='0.5')
+    if lag_max_ms is not None:
+        env['LAG_COMP_MAX_MS'] = str(lag_max_ms)
+    code = (f"import app; app.start_services(); app.socketio.run(app.app, host='127.0.0.1', port={port}, "
+            f"allow_unsafe_werkzeug=True, log_output=False)")
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, start_new_session=True)
+    wait_for_port(port)
+    return server
+
+
+def play(port, secret, name, delay, think, moves):
+    # Clock charged minus think time per move, in ms, for the slow and the local player; the server's median rtt
+    slow = SlowConnection(port, make_token(secret, f'{name}-slow@example.com'), delay)
+    local = Connection(port, make_token(secret, f'{name}-local@example.com'))
+    found = gevent.event.AsyncResult()
+    slow.handlers['game_found'] = found.set
+    slow.emit('join_game', {'gameType': 'Rapid'})
+    gevent.sleep(delay + 0.1)
+    local.emit('join_game', {'gameType': 'Rapid'})
+    game = found.get(timeout=10)
+    # Let a few pings through
+    gevent.sleep(2)
+    slow_color = 'black' if game['opponent']['color'] == 'white' else 'white'
+    players = {slow_color: slow, ('white' if slow_color == 'black' else 'black'): local}
+    overcharge = {'slow': [], 'local': []}
+    clocks = {'white': 600.0, 'black': 600.0}
+    done = gevent.event.Event()
+
+    def on_move(connection, color, data):
+        # Each side replies think seconds after it sees the opponent's move
+        ply = data['ply']
+        mover = 'white' if ply % 2 else 'black'
+        if connection is local:
+            # The local player sees every move first; it keeps the books
+            spent = clocks[mover] - data['player1_time' if mover == 'white' else 'player2_time']
+            clocks['white'], clocks['black'] = data['player1_time'], data['player2_time']
+            if ply > 1:  # White's first move was also charged the settling time
+                overcharge['slow' if mover == slow_color else 'local'].append((spent - think) * 1000)
+        if ply >= moves:
+            done.set()
+        elif data['turn'] == color:
+            gevent.spawn_later(think, connection.emit, 'make_move', {'gameId': game['gameId'], 'move': MOVES[ply % 4]})
+
+    for color, connection in players.items():
+        connection.handlers['move_made'] = lambda data, c=connection, color=color: on_move(c, color, data)
+    gevent.spawn_later(think, players['white'].emit, 'make_move', {'gameId': game['gameId'], 'move': MOVES[0]})
+    done.wait(moves * (think + 4 * delay + 1))
+    # While both are still connected
+    rtt = requests.get(f'http://127.0.0.1:{port}/status', timeout=10).json()['lag_tracker']['median_rtt_ms']
+    slow.close()
+    local.close()
+    return overcharge, rtt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delay', type=float, default=0.1, help='one-way delay of the slow player, seconds')
+    parser.add_argument('--think', type=float, default=0.3, help='seconds each player thinks per move')
+    parser.add_argument('--moves', type=int, default=40, help='plies played')
+    parser.add_argument('--port', type=int, default=5770)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    workdir = tempfile.mkdtemp(prefix='gochess-lag-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    print(f"{args.moves} plies, {args.think * 1000:.0f} ms thinking per move, slow player "
+          f"{2 * args.delay * 1000:.0f} ms round trip")
+    print(f"{'lag compensation':>17} {'player':>7} {'moves':>6} {'overcharge ms mean':>19} {'max':>6} "
+          f"{'total ms':>9} {'median rtt ms':>14}")
+    for i, (name, lag_max_ms) in enumerate((('off', 0), ('on', None))):
+        port = args.port + i
+        server = start_server(port, workdir, lag_max_ms)
+        try:
+            overcharge, rtt = play(port, secret, name, args.delay, args.think, args.moves)
+        finally:
+            # The group, so the server's forked pool workers go with it
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+        for player, values in overcharge.items():
+            print(f"{name:>17} {player:>7} {len(values):>6} {sum(values) / max(1, len(values)):>19.0f} "
+                  f"{max(values, default=0):>6.0f} {sum(values):>9.0f} {rtt if rtt is not None else '-':>14}")
+
+
+if __name__ == '__main__':
+    main()
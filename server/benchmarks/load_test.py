@@ -0,0 +1,312 @@
+# Simulated players against a local server: each one logs in, joins a random
+# time control, plays random legal moves with some think time, sometimes
+# resigns, and disconnects when the game ends. Reports matchmaking latency,
+# make_move -> move_made round trips and the server's CPU, threads and RSS,
+# and writes everything as JSON so runs can be compared between commits.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+#
+# Run from the server directory:
+#   python -m benchmarks.load_test --players 1000 --output results.json
+#   python -m benchmarks.load_test --url http://127.0.0.1:5000 --pid 1234   (existing server)
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import chess
+import gevent
+import gevent.event
+import requests
+from dotenv import load_dotenv
+
+from benchmarks.async_mode_bench import Connection
+from benchmarks.cluster_harness import SERVER_DIR, make_token, wait_for_port
+
+GAME_TYPES = ['Blitz', 'Rapid', 'Bullet']
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(len(values) * q))], 2)
+    return {'count': len(values), 'p50': at(.5), 'p95': at(.95), 'p99': at(.99), 'max': round(values[-1], 2)}
+
+
+class ProcessSampler:
+    # CPU, thread count and RSS of the server process from /proc, once a second
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._running = True
+        self._greenlet = gevent.spawn(self._run)
+
+    def _read(self):
+        with open(f'/proc/{self.pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        threads = rss = 0
+        with open(f'/proc/{self.pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+        return time.monotonic(), cpu, threads, rss
+
+    def _run(self):
+        while self._running:
+            try:
+                self.samples.append(self._read())
+            except OSError:
+                return
+            gevent.sleep(1)
+
+    def stop(self):
+        self._running = False
+        self._greenlet.join()
+        if len(self.samples) < 2:
+            return None
+        (t0, cpu0, _, _), (t1, cpu1, _, _) = self.samples[0], self.samples[-1]
+        cpu_pct = [100 * (b[1] - a[1]) / (b[0] - a[0]) for a, b in zip(self.samples, self.samples[1:])]
+        return {
+            'cpu_avg_pct': round(100 * (cpu1 - cpu0) / (t1 - t0), 1),
+            'cpu_max_pct': round(max(cpu_pct), 1),
+            'threads_max': max(s[2] for s in self.samples),
+            'rss_max_mb': round(max(s[3] for s in self.samples), 1),
+        }
+
+
+class Results:
+    def __init__(self):
+        self.matchmaking_ms = []
+        self.move_rtt_ms = []
+        self.login_ms = []
+        self.games_finished = 0
+        self.resigned = 0
+        self.errors = 0
+        self.unmatched = 0
+        self.failed_players = 0
+
+
+class SimulatedPlayer:
+    def __init__(self, n, args, base_url, port, secret, results):
+        self.email = f'load-{n}@example.com'
+        self.args = args
+        self.base_url = base_url
+        self.port = port
+        self.secret = secret
+        self.results = results
+        self.rng = random.Random(args.seed + n)
+
+    def login(self):
+        if self.args.no_login:
+            return make_token(self.secret, self.email)
+        started = time.perf_counter()
+        credentials = {'email': self.email, 'password': 'load-test-password'}
+        response = requests.post(f'{self.base_url}/auth/log-in', json=credentials, timeout=60)
+        if response.status_code == 400:
+            response = requests.post(f'{self.base_url}/auth/sign-up', json=dict(credentials, username=self.email),
+                                     timeout=60)
+        response.raise_for_status()
+        self.results.login_ms.append((time.perf_counter() - started) * 1000)
+        return response.json()['token']
+
+    def run(self):
+        try:
+            token = self.login()
+            for _ in range(self.args.games):
+                self.play_game(token)
+        except Exception as e:
+            self.results.failed_players += 1
+            if self.args.verbose:
+                print(f"{self.email}: {e!r}")
+
+    def play_game(self, token):
+        conn = Connection(self.port, token)
+        board = chess.Board()
+        found = gevent.event.AsyncResult()
+        over = gevent.event.Event()
+        my_turn = gevent.event.Event()
+        state = {'color': None, 'sent': None, 'sent_ply': None}
+
+        def on_found(data):
+            found.set(data)
+
+        def on_move(data):
+            if data['ply'] > board.ply():
+                board.push_uci(data['move'])
+            if state['sent_ply'] is not None and data['ply'] == state['sent_ply']:
+                self.results.move_rtt_ms.append((time.perf_counter() - state['sent']) * 1000)
+                state['sent_ply'] = None
+            if (board.turn == chess.WHITE) == (state['color'] == 'white'):
+                my_turn.set()
+
+        def on_over(data):
+            self.results.games_finished += 1
+            over.set()
+            my_turn.set()
+
+        def on_error(data):
+            self.results.errors += 1
+            if self.args.verbose:
+                print(f"{self.email}: error {data}")
+
+        conn.handlers.update({'game_found': on_found, 'move_made': on_move, 'game_over': on_over,
+                              'error': on_error})
+        try:
+            started = time.perf_counter()
+            conn.emit('join_game', {'gameType': self.rng.choice(GAME_TYPES)})
+            try:
+                data = found.get(timeout=self.args.match_timeout)
+            except gevent.Timeout:
+                # Nobody else left in this time control's queue
+                self.results.unmatched += 1
+                return
+            self.results.matchmaking_ms.append((time.perf_counter() - started) * 1000)
+            gameId = data['gameId']
+            state['color'] = 'black' if data['opponent']['color'] == 'white' else 'white'
+            if state['color'] == 'white':
+                my_turn.set()
+
+            while not over.is_set():
+                my_turn.wait(self.args.move_timeout)
+                my_turn.clear()
+                if over.is_set():
+                    break
+                if board.ply() >= self.args.max_plies or self.rng.random() < self.args.resign_rate:
+                    self.results.resigned += 1
+                    conn.emit('resign_game', {'gameId': gameId})
+                    over.wait(self.args.move_timeout)
+                    break
+                gevent.sleep(self.rng.uniform(self.args.think_min, self.args.think_max))
+                move = self.rng.choice(list(board.legal_moves))
+                state['sent'] = time.perf_counter()
+                state['sent_ply'] = board.ply() + 1
+                conn.emit('make_move', {'gameId': gameId, 'move': move.uci()})
+        finally:
+            conn.close()
+
+
+def start_server(port, args):
+    workdir = tempfile.mkdtemp(prefix='gochess-load-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+    # Low bcrypt cost so thousands of logins measure the game server, not the hasher
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR, ASYNC_MODE=args.async_mode, BCRYPT_ROUNDS=str(args.bcrypt_rounds),
+               PASSWORD_HASH_QUEUE=str(max(32, args.players)), RECONNECT_GRACE_SECONDS='0')
+    code = (f"import app; app.start_services(); app.socketio.run(app.app, host='127.0.0.1', port={port}, "
+            f"allow_unsafe_werkzeug=True, log_output=False)")
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server
+
+
+def compare(report, baseline):
+    # Side by side of the headline numbers against an earlier run's JSON
+    rows = [('move_rtt_ms', 'p50'), ('move_rtt_ms', 'p95'), ('move_rtt_ms', 'p99'),
+            ('matchmaking_ms', 'p50'), ('matchmaking_ms', 'p99'), ('login_ms', 'p99'),
+            ('server', 'cpu_avg_pct'), ('server', 'threads_max'), ('server', 'rss_max_mb')]
+    print(f"{'':26s}{baseline.get('commit') or 'baseline':>12s}{report.get('commit') or 'this run':>12s}")
+    for section, key in rows:
+        old = (baseline.get(section) or {}).get(key)
+        new = (report.get(section) or {}).get(key)
+        change = f"{100 * (new - old) / old:+.0f}%" if old and new is not None else ''
+        print(f"{section + '.' + key:26s}{str(old):>12s}{str(new):>12s}  {change}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--games', type=int, default=1, help='games per player')
+    parser.add_argument('--ramp', type=float, default=10, help='seconds over which players arrive')
+    parser.add_argument('--think-min', type=float, default=0.5)
+    parser.add_argument('--think-max', type=float, default=2.0)
+    parser.add_argument('--max-plies', type=int, default=40, help='resign after this many plies')
+    parser.add_argument('--resign-rate', type=float, default=0.01, help='chance to resign instead of moving')
+    parser.add_argument('--match-timeout', type=float, default=60)
+    parser.add_argument('--move-timeout', type=float, default=60)
+    parser.add_argument('--async-mode', default='threading')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--no-login', action='store_true', help='mint tokens locally instead of /auth/log-in')
+    parser.add_argument('--url', help='use a running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='server pid to sample with --url')
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        port = int(base_url.rsplit(':', 1)[1])
+        pid = args.pid
+    else:
+        server = start_server(args.port, args)
+        base_url, port, pid = f'http://127.0.0.1:{args.port}', args.port, server.pid
+
+    results = Results()
+    sampler = ProcessSampler(pid) if pid else None
+    started = time.monotonic()
+    try:
+        players = []
+        for n in range(args.players):
+            players.append(gevent.spawn(SimulatedPlayer(n, args, base_url, port, secret, results).run))
+            gevent.sleep(args.ramp / args.players)
+        gevent.joinall(players)
+    finally:
+        elapsed = time.monotonic() - started
+        process = sampler.stop() if sampler else None
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'commit': git_commit(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'verbose')},
+        'duration_s': round(elapsed, 1),
+        'players_failed': results.failed_players,
+        'players_unmatched': results.unmatched,
+        'games_finished': results.games_finished // 2,
+        'resigned': results.resigned,
+        'errors': results.errors,
+        'moves': len(results.move_rtt_ms),
+        'moves_per_s': round(len(results.move_rtt_ms) / elapsed, 1),
+        'login_ms': percentiles(results.login_ms),
+        'matchmaking_ms': percentiles(results.matchmaking_ms),
+        'move_rtt_ms': percentiles(results.move_rtt_ms),
+        'server': process,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
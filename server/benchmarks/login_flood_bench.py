@@ -0,0 +1,117 @@
+# Login throughput and move latency while a crowd of clients hammers /auth/log-in.
+# Compares hashing inline on the request threads with no queue limit (the old
+# behaviour) against the bounded worker-process pool.
+# Needs the benchmark requirements: pip install -r requirements-bench.txt
+# Run from the server directory: python -m benchmarks.login_flood_bench
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import gevent
+import requests
+from dotenv import load_dotenv
+
+from benchmarks.async_mode_bench import Connection, measure_moves
+from benchmarks.cluster_harness import SERVER_DIR, make_token, wait_for_port
+
+CONFIGS = {
+    'inline': {'PASSWORD_HASH_WORKERS': '0', 'PASSWORD_HASH_QUEUE': '100000'},
+    'pool': {},
+}
+
+
+def start_server(port, workdir, env):
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR, **env)
+    code = (f"import app; app.start_services(); app.socketio.run(app.app, host='127.0.0.1', port={port}, "
+            f"allow_unsafe_werkzeug=True, log_output=False)")
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return server
+
+
+def flood(url, clients, seconds, counts):
+    deadline = time.monotonic() + seconds
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            try:
+                response = session.post(url, json={'email': 'flood@example.com', 'password': 'hunter22'},
+                                        timeout=30)
+                status = response.status_code
+            except requests.RequestException:
+                response, status = None, 'error'
+            counts[status] = counts.get(status, 0) + 1
+            if status == 503:
+                # Well-behaved clients back off as told
+                gevent.sleep(float(response.headers.get('Retry-After', 1)))
+    return [gevent.spawn(client) for _ in range(clients)]
+
+
+def run_config(name, args, secret, port):
+    workdir = tempfile.mkdtemp(prefix='gochess-login-')
+    subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'buildDatabase.py')], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+    server = start_server(port, workdir, dict(CONFIGS[name], BCRYPT_ROUNDS=str(args.rounds)))
+    try:
+        base = f'http://127.0.0.1:{port}'
+        requests.post(f'{base}/auth/sign-up', json={'email': 'flood@example.com', 'password': 'hunter22',
+                                                    'username': 'flood'}, timeout=30)
+        white = Connection(port, make_token(secret, 'white@example.com'))
+        black = Connection(port, make_token(secret, 'black@example.com'))
+        found = {}
+        white.handlers['game_found'] = found.update
+        white.emit('join_game', {'gameType': 'Rapid'})
+        gevent.sleep(0.2)
+        black.emit('join_game', {'gameType': 'Rapid'})
+        while 'gameId' not in found:
+            gevent.sleep(0.01)
+        if found['opponent']['color'] == 'white':
+            white, black = black, white
+
+        quiet = measure_moves(white, black, found['gameId'], 40)
+        counts = {}
+        started = time.monotonic()
+        workers = flood(f'{base}/auth/log-in', args.clients, args.seconds, counts)
+        gevent.sleep(1)
+        busy = measure_moves(white, black, found['gameId'], args.moves)
+        gevent.joinall(workers)
+        elapsed = time.monotonic() - started
+
+        def p(latencies, q):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+        print(f"{name:6s}: logins ok {counts.get(200, 0) / elapsed:6.1f}/s  503 {counts.get(503, 0):5d}  "
+              f"errors {counts.get('error', 0):3d}  | move p50/p99 quiet {p(quiet, .5):6.1f}/{p(quiet, .99):6.1f} ms  "
+              f"flood {p(busy, .5):7.1f}/{p(busy, .99):7.1f} ms")
+        white.close()
+        black.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--moves', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS))
+    parser.add_argument('--port', type=int, default=5800)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(SERVER_DIR, '.env'))
+    secret = os.getenv('JWT_SECRET_KEY')
+    for i, name in enumerate(args.configs):
+        run_config(name, args, secret, args.port + i)
+
+
+if __name__ == '__main__':
+    main()
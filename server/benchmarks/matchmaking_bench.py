@@ -0,0 +1,126 @@
+# Matchmaking throughput and time-to-match with a large backlog of queued players.
+# Run from the server directory: python -m benchmarks.matchmaking_bench
+import argparse
+import random
+import statistics
+import time
+
+from matchmaking import MatchQueue
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Cancel cost with `players` already queued: old list.remove versus MatchQueue.cancel
+def bench_cancel(players, samples):
+    names = [f'player{i}@example.com' for i in range(players)]
+    victims = random.sample(names, samples)
+
+    waiting = list(names)
+    start = time.perf_counter()
+    for name in victims:
+        if name in waiting:
+            waiting.remove(name)
+    legacy = time.perf_counter() - start
+
+    queue = MatchQueue()
+    for i, name in enumerate(names):
+        queue._add(name, None, i)
+    start = time.perf_counter()
+    for name in victims:
+        queue.cancel(name)
+    engine = time.perf_counter() - start
+    return samples / legacy, samples / engine
+
+
+# FIFO pairing throughput: every second join is paired immediately
+def bench_fifo(players):
+    queue = MatchQueue()
+    start = time.perf_counter()
+    matched = 0
+    for i in range(players):
+        if queue.match_or_enqueue(f'player{i}@example.com') is not None:
+            matched += 1
+    elapsed = time.perf_counter() - start
+    return players / elapsed, matched
+
+
+# Rating pairing on a simulated clock: `players` arrive over `arrival_seconds`,
+# the queue is swept once per simulated second
+def bench_rating(players, arrival_seconds, bucket_size, base_window, widen_per_sec, max_window):
+    queue = MatchQueue(bucket_size=bucket_size, base_window=base_window,
+                       widen_per_sec=widen_per_sec, max_window=max_window)
+    ratings = {}
+    arrived = {}
+    waits = []
+    gaps = []
+    peak_depth = 0
+
+    def record(player, opponent, now):
+        for p in (player, opponent):
+            waits.append(now - arrived[p])
+        gaps.append(abs(ratings[player] - ratings[opponent]))
+
+    per_second = players / arrival_seconds
+    next_player = 0
+    now = 0
+    start = time.perf_counter()
+    while next_player < players or (len(queue) > 1 and now < arrival_seconds + 120):
+        target = min(players, int((now + 1) * per_second))
+        while next_player < target:
+            name = f'player{next_player}@example.com'
+            rating = max(100, random.gauss(1500, 350))
+            ratings[name] = rating
+            arrived[name] = now
+            opponent = queue.match_or_enqueue(name, rating, now=now)
+            if opponent is not None:
+                record(name, opponent, now)
+            next_player += 1
+        peak_depth = max(peak_depth, len(queue))
+        now += 1
+        for player, opponent in queue.sweep(now=now):
+            record(player, opponent, now)
+    elapsed = time.perf_counter() - start
+    return {
+        'ops_per_sec': players / elapsed,
+        'matched': len(waits),
+        'unmatched': len(queue),
+        'peak_depth': peak_depth,
+        'wait_p50': percentile(waits, 0.5),
+        'wait_p95': percentile(waits, 0.95),
+        'wait_max': max(waits) if waits else 0,
+        'rating_gap_mean': statistics.mean(gaps) if gaps else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=50000)
+    parser.add_argument('--cancel-samples', type=int, default=2000)
+    parser.add_argument('--arrival-seconds', type=int, default=600)
+    parser.add_argument('--bucket-size', type=int, default=50)
+    parser.add_argument('--base-window', type=int, default=50)
+    parser.add_argument('--widen-per-sec', type=int, default=10)
+    parser.add_argument('--max-window', type=int, default=400)
+    args = parser.parse_args()
+
+    legacy, engine = bench_cancel(args.players, args.cancel_samples)
+    print(f"cancel with {args.players} queued: list {legacy:,.0f}/s, MatchQueue {engine:,.0f}/s")
+
+    rate, matched = bench_fifo(args.players)
+    print(f"fifo join: {rate:,.0f} joins/s, {matched} games")
+
+    result = bench_rating(args.players, args.arrival_seconds, args.bucket_size, args.base_window,
+                          args.widen_per_sec, args.max_window)
+    print(f"rating join+sweep: {result['ops_per_sec']:,.0f} players/s, peak queue {result['peak_depth']}, "
+          f"{result['matched']} matched, {result['unmatched']} left")
+    print(f"time-to-match (simulated s): p50 {result['wait_p50']}, p95 {result['wait_p95']}, "
+          f"max {result['wait_max']}; mean rating gap {result['rating_gap_mean']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
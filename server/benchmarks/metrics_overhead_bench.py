@@ -0,0 +1,86 @@
+# Cost of the instrumentation: make_move through the Socket.IO test client with
+# METRICS_ENABLED=1 and 0, plus the raw cost of one histogram observation and
+# one timed lock acquire. Each mode runs in a fresh interpreter because the
+# switch is read at import time.
+# Run from the server directory: python -m benchmarks.metrics_overhead_bench
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Knight shuffle that never ends the game
+MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def play(moves):
+    os.chdir(tempfile.mkdtemp(prefix='gochess-metrics-'))
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    clients = []
+    for player in ('white@example.com', 'black@example.com'):
+        with app_module.app.app_context():
+            token = create_access_token(identity=player)
+        client = app_module.socketio.test_client(app_module.app, query_string=f'token={token}')
+        client.emit('join_game', {'gameType': 'Rapid'})
+        clients.append(client)
+    found = [e for e in clients[0].get_received() if e['name'] == 'game_found'][0]['args'][0]
+    gameId = found['gameId']
+    white, black = clients if found['opponent']['color'] == 'black' else clients[::-1]
+    for client in clients:
+        client.get_received()
+
+    start = time.perf_counter()
+    for i in range(moves):
+        (white if i % 2 == 0 else black).emit('make_move', {'gameId': gameId, 'move': MOVES[i % len(MOVES)]})
+        if i % 200 == 199:
+            for client in clients:
+                client.get_received()
+    elapsed = time.perf_counter() - start
+    return elapsed / moves * 1e6
+
+
+def primitives(n):
+    from metrics import Histogram, TimedLock
+    child = Histogram('bench_seconds', 'bench').labels()
+    start = time.perf_counter()
+    for _ in range(n):
+        child.observe(0.001)
+    observe_ns = (time.perf_counter() - start) / n * 1e9
+    lock = TimedLock('bench')
+    start = time.perf_counter()
+    for _ in range(n):
+        with lock:
+            pass
+    lock_ns = (time.perf_counter() - start) / n * 1e9
+    return observe_ns, lock_ns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--moves', type=int, default=20000)
+    parser.add_argument('--child', choices=['0', '1'])
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps({'move_us': play(args.moves)}))
+        return
+
+    results = {}
+    for enabled in ('0', '1'):
+        env = dict(os.environ, METRICS_ENABLED=enabled, LOG_LEVEL='WARNING',
+                   PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.metrics_overhead_bench', '--child', enabled,
+                              '--moves', str(args.moves)], env=env, capture_output=True, text=True, check=True)
+        results[enabled] = json.loads(out.stdout.strip().splitlines()[-1])['move_us']
+    observe_ns, lock_ns = primitives(200000)
+    print(f"make_move, metrics off: {results['0']:7.1f} us")
+    print(f"make_move, metrics on:  {results['1']:7.1f} us  ({100 * (results['1'] - results['0']) / results['0']:+.1f}%)")
+    print(f"histogram observe: {observe_ns:.0f} ns, timed lock acquire/release: {lock_ns:.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Storage size and decode throughput of packed moves versus PGN text, per game
+# and for a game_history table holding each form, plus the migration rate.
+# Run from the server directory: python -m benchmarks.move_codec_bench [--pgn games.pgn]
+import argparse
+import io
+import os
+import sqlite3
+import tempfile
+import time
+
+import chess.pgn
+
+from benchmarks.position_cache_bench import pgn_games, synthetic_games
+from move_codec import decode_moves, drop_pgn, encode_moves, from_pgn, migrate, to_pgn, to_san
+
+
+def legacy_pgn(moves):
+    # What GameWriter stored before, headers included
+    game = chess.pgn.Game()
+    for name, value in (('Event', 'Gochess Blitz game'), ('Site', 'Gochess'), ('Date', '2026.01.01'),
+                        ('White', 'white-player@example.com'), ('Black', 'black-player@example.com'),
+                        ('Result', '1-0'), ('TimeControl', 'Blitz'), ('Termination', 'checkmate')):
+        game.headers[name] = value
+    node = game
+    for move in moves:
+        node = node.add_variation(move)
+    return str(game)
+
+
+def rate(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def table_size(games, packed):
+    path = os.path.join(tempfile.mkdtemp(prefix='gochess-codec-'), 'games.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE game_history (gameid INTEGER PRIMARY KEY, pgn TEXT NOT NULL, moves BLOB, '
+                 'termination TEXT)')
+    rows = [('', encode_moves(moves), 'checkmate') if packed else (legacy_pgn(moves), None, None) for moves in games]
+    conn.executemany('INSERT INTO game_history (pgn, moves, termination) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    return path, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=5000)
+    parser.add_argument('--plies', type=int, default=80)
+    parser.add_argument('--pgn', help='replay real games from this PGN file')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    games = pgn_games(args.pgn, args.games) if args.pgn else synthetic_games(args.games, args.plies, args.seed)
+    texts = [legacy_pgn(moves) for moves in games]
+    blobs = [encode_moves(moves) for moves in games]
+    assert all(decode_moves(blob) == moves for blob, moves in zip(blobs, games))
+    plies = sum(len(moves) for moves in games)
+
+    print(f"{len(games)} games, {plies / len(games):.0f} plies on average")
+    print(f"per game:  pgn text {sum(map(len, texts)) / len(games):7.0f} B   "
+          f"packed {sum(map(len, blobs)) / len(games):5.0f} B")
+    _, text_size = table_size(games, packed=False)
+    _, packed_size = table_size(games, packed=True)
+    print(f"table:     pgn text {text_size / 1024:7.0f} KiB packed {packed_size / 1024:5.0f} KiB "
+          f"({text_size / packed_size:.1f}x smaller)")
+
+    print(f"{'decode':>28} {'games/s':>10}")
+    print(f"{'pgn text -> moves (parse)':>28} {rate(lambda text: chess.pgn.read_game(io.StringIO(text)), texts):>10.0f}")
+    print(f"{'packed -> moves':>28} {rate(decode_moves, blobs):>10.0f}")
+    print(f"{'packed -> san':>28} {rate(to_san, blobs):>10.0f}")
+    print(f"{'packed -> pgn':>28} "
+          f"{rate(lambda blob: to_pgn(blob, 'white', 'black', 'Blitz', 1, 'checkmate', '2026-01-01 00:00:00'), blobs):>10.0f}")
+    print(f"{'encode on write':>28} {rate(encode_moves, games):>10.0f}")
+
+    path, _ = table_size(games, packed=False)
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    converted, skipped = migrate(conn)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    dropped, mismatched = drop_pgn(conn)
+    drop_elapsed = time.perf_counter() - start
+    conn.close()
+    assert from_pgn(texts[0])[0] == blobs[0]
+    print(f"migration: {converted} games in {elapsed:.2f}s ({converted / elapsed:.0f}/s), {skipped} skipped")
+    print(f"drop-pgn:  {dropped} games in {drop_elapsed:.2f}s ({dropped / drop_elapsed:.0f}/s), {mismatched} mismatched")
+
+
+if __name__ == '__main__':
+    main()
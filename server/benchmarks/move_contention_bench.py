@@ -0,0 +1,96 @@
+# make_move latency as the number of concurrently played games grows, with the
+# per-game locks versus every move serialized behind one global lock (the old
+# active_lock behaviour).
+# Run from the server directory: python -m benchmarks.move_contention_bench
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+# Knight shuffle that never ends the game
+MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def start_games(app_module, count, first_index):
+    from flask_jwt_extended import create_access_token
+    games = []
+    for g in range(count):
+        clients = []
+        for side in range(2):
+            with app_module.app.app_context():
+                token = create_access_token(identity=f'bench{first_index + 2 * g + side}@example.com')
+            client = app_module.socketio.test_client(app_module.app, query_string=f'token={token}')
+            client.emit('join_game', {'gameType': 'Rapid'})
+            clients.append(client)
+        found = [m for m in clients[0].get_received() if m['name'] == 'game_found'][0]['args'][0]
+        clients[1].get_received()
+        game = app_module.active_games[found['gameId']]
+        white, black = (clients[0], clients[1]) if game.player1 == f'bench{first_index + 2 * g}@example.com' \
+            else (clients[1], clients[0])
+        games.append((found['gameId'], white, black))
+    return games
+
+
+def play(games, moves_per_game, global_lock):
+    latencies = []
+    latency_lock = threading.Lock()
+
+    def play_game(gameId, white, black):
+        local = []
+        for i in range(moves_per_game):
+            client = white if i % 2 == 0 else black
+            start = time.perf_counter()
+            if global_lock is not None:
+                with global_lock:
+                    client.emit('make_move', {'gameId': gameId, 'move': MOVES[i % len(MOVES)]})
+            else:
+                client.emit('make_move', {'gameId': gameId, 'move': MOVES[i % len(MOVES)]})
+            local.append(time.perf_counter() - start)
+            white.get_received()
+            black.get_received()
+        with latency_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=play_game, args=game) for game in games]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--moves', type=int, default=40, help='moves played per game (even)')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-contention-'))
+    import app as app_module
+    app_module.start_services()
+
+    print(f"{'games':>6} {'mode':>9} {'moves/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    next_index = 0
+    for count in args.games:
+        for mode, global_lock in (('global', threading.Lock()), ('per-game', None)):
+            games = start_games(app_module, count, next_index)
+            next_index += 2 * count
+            latencies, elapsed = play(games, args.moves, global_lock)
+            print(f"{count:>6} {mode:>9} {len(latencies) / elapsed:>10.0f} "
+                  f"{percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+            for gameId, white, black in games:
+                white.emit('resign_game', {'gameId': gameId})
+                white.disconnect()
+                black.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Per-move validation cost (legality + game-end checks) with and without the
+# shared PositionCache, replaying games move by move as Game.move_piece does.
+# Run from the server directory: python -m benchmarks.position_cache_bench [--pgn games.pgn]
+import argparse
+import random
+import time
+
+import chess
+import chess.pgn
+
+from position_cache import PositionCache
+
+# Popular opening lines, continued with random legal moves when no PGN file is given
+OPENINGS = [
+    'e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7 Re1 b5 Bb3 d6 c3 O-O',
+    'e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6 Be3 e5 Nb3 Be6',
+    'e4 c5 Nf3 Nc6 d4 cxd4 Nxd4 Nf6 Nc3 e5 Ndb5 d6 Bg5 a6',
+    'd4 Nf6 c4 e6 Nc3 Bb4 e3 O-O Bd3 d5 Nf3 c5 O-O',
+    'd4 d5 c4 e6 Nc3 Nf6 Bg5 Be7 e3 O-O Nf3 h6 Bh4 b6',
+    'd4 Nf6 c4 g6 Nc3 Bg7 e4 d6 Nf3 O-O Be2 e5 O-O Nc6',
+    'e4 e6 d4 d5 Nc3 Nf6 Bg5 Be7 e5 Nfd7 Bxe7 Qxe7',
+    'e4 c6 d4 d5 Nc3 dxe4 Nxe4 Bf5 Ng3 Bg6 h4 h6 Nf3 Nd7',
+    'c4 e5 Nc3 Nf6 Nf3 Nc6 g3 d5 cxd5 Nxd5 Bg2 Nb6',
+    'Nf3 d5 g3 Nf6 Bg2 c6 O-O Bg4 d3 Nbd7',
+]
+
+
+def synthetic_games(count, plies, seed):
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board = chess.Board()
+        for san in rng.choice(OPENINGS).split():
+            board.push_san(san)
+        while len(board.move_stack) < plies and not board.is_game_over():
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append(list(board.move_stack))
+    return games
+
+
+def pgn_games(path, limit):
+    games = []
+    with open(path) as handle:
+        while len(games) < limit:
+            game = chess.pgn.read_game(handle)
+            if game is None:
+                break
+            games.append(list(game.mainline_moves()))
+    return games
+
+
+def validate_uncached(board, move):
+    if move not in board.legal_moves:
+        return False
+    board.push(move)
+    board.is_stalemate()
+    board.is_checkmate()
+    board.is_insufficient_material()
+    return True
+
+
+def replay_uncached(games):
+    moves = 0
+    start = time.perf_counter()
+    for game in games:
+        board = chess.Board()
+        for move in game:
+            validate_uncached(board, move)
+            moves += 1
+    return moves, time.perf_counter() - start
+
+
+# Same steps as Game.move_piece: check against the current entry, push, look up the next one
+def replay_cached(games, cache):
+    moves = 0
+    start = time.perf_counter()
+    for game in games:
+        board = chess.Board()
+        position = cache.lookup(board)
+        for move in game:
+            if position.is_legal(board, move):
+                board.push(move)
+                position = cache.lookup(board)
+            moves += 1
+    return moves, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pgn', help='PGN file of real games to replay')
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--plies', type=int, default=80)
+    parser.add_argument('--cache-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    games = pgn_games(args.pgn, args.games) if args.pgn else synthetic_games(args.games, args.plies, args.seed)
+
+    moves, elapsed = replay_uncached(games)
+    print(f"uncached: {moves} moves, {elapsed / moves * 1e6:.1f} us/move")
+
+    cache = PositionCache(maxsize=args.cache_size)
+    moves, elapsed = replay_cached(games, cache)
+    print(f"cached (cold): {moves} moves, {elapsed / moves * 1e6:.1f} us/move, {cache.stats()}")
+    moves, elapsed = replay_cached(games, cache)
+    print(f"cached (warm): {moves} moves, {elapsed / moves * 1e6:.1f} us/move, {cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
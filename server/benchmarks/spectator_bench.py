@@ -0,0 +1,92 @@
+# Players' make_move latency while a game is watched by a growing number of
+# spectators, with spectators fed inline from the move path versus through the
+# coalescing SpectatorFanout thread.
+# Run from the server directory: python -m benchmarks.spectator_bench
+import argparse
+import os
+import tempfile
+import time
+
+# Knight shuffle that never ends the game
+MOVES = ['g1f3', 'g8f6', 'f3g1', 'f6g8']
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def new_game(app_module, index):
+    from flask_jwt_extended import create_access_token
+    clients = []
+    emails = [f'white{index}@example.com', f'black{index}@example.com']
+    for email in emails:
+        with app_module.app.app_context():
+            token = create_access_token(identity=email)
+        client = app_module.socketio.test_client(app_module.app, query_string=f'token={token}')
+        client.emit('join_game', {'gameType': 'Rapid'})
+        clients.append(client)
+    gameId = [m for m in clients[0].get_received() if m['name'] == 'game_found'][0]['args'][0]['gameId']
+    clients[1].get_received()
+    game = app_module.active_games[gameId]
+    white, black = clients if game.player1 == emails[0] else clients[::-1]
+    return gameId, white, black
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spectators', type=int, nargs='+', default=[0, 100, 1000, 3000])
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--think-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-spectators-'))
+    import app as app_module
+    app_module.start_services()
+    from spectators import spectator_room
+    socketio = app_module.socketio
+    fanout = app_module.spectator_fanout
+
+    print(f"{'spectators':>10} {'mode':>10} {'p50 ms':>8} {'p99 ms':>8} {'batches':>8} {'msgs/spectator':>15}")
+    index = 0
+    for count in args.spectators:
+        for mode in ('inline', 'coalesced'):
+            index += 1
+            gameId, white, black = new_game(app_module, index)
+            watchers = [socketio.test_client(app_module.app) for _ in range(count)]
+            for watcher in watchers:
+                watcher.emit('spectate_game', {'gameId': gameId})
+                watcher.get_received()
+            if mode == 'inline':
+                # Old-style fan-out: the move handler itself emits to every spectator
+                publish_move = fanout.publish_move
+                fanout.publish_move = lambda game, ply, move, clocks, turn: socketio.emit(
+                    'spectator_moves', {'gameId': game.gameId, 'from_ply': ply, 'moves': [move]},
+                    to=spectator_room(game.gameId))
+
+            batches_before = fanout.batches_sent + fanout.snapshots_sent
+            latencies = []
+            for i in range(args.moves):
+                client = white if i % 2 == 0 else black
+                start = time.perf_counter()
+                client.emit('make_move', {'gameId': gameId, 'move': MOVES[i % len(MOVES)]})
+                latencies.append(time.perf_counter() - start)
+                white.get_received()
+                black.get_received()
+                time.sleep(args.think_ms / 1000)
+            time.sleep(fanout.interval * 2)
+
+            if mode == 'inline':
+                fanout.publish_move = publish_move
+            batches = fanout.batches_sent + fanout.snapshots_sent - batches_before
+            received = len(watchers[0].get_received()) if watchers else 0
+            print(f"{count:>10} {mode:>10} {percentile(latencies, 0.5) * 1000:>8.2f} "
+                  f"{percentile(latencies, 0.99) * 1000:>8.2f} {batches:>8} {received:>15}")
+
+            white.emit('resign_game', {'gameId': gameId})
+            for client in [white, black] + watchers:
+                client.disconnect()
+
+
+if __name__ == '__main__':
+    main()
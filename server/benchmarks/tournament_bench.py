@@ -0,0 +1,125 @@
+# Tournaments at --players entrants (5k by default). First the pairing alone,
+# in process: every round of a Swiss with random results, and an arena pass,
+# reporting pairing time, the cost of recording a result into the standings,
+# and rematches. Then the game-start burst through the server: players
+# connected as Socket.IO test clients join a Swiss, and each round is paired
+# and its games started as app.pair_tournament does it, then every game is
+# resigned through the normal game_over path.
+# Run from the server directory: python -m benchmarks.tournament_bench [--players 5000 --rounds 5]
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from tournament import ARENA, SWISS, Tournament
+
+
+def field(kind, players, rng, **options):
+    tournament = Tournament('bench', 'bench', 'Blitz', kind, **options)
+    for i in range(players):
+        tournament.join(f'player{i}@example.com', rng.randint(1000, 2400))
+    tournament.start()
+    return tournament
+
+
+def pairing(players, rounds, seed):
+    rng = random.Random(seed)
+    tournament = field(SWISS, players, rng, rounds=rounds)
+    everyone = set(tournament.players)
+    print(f"Swiss pairing, {players} players")
+    print(f"{'round':>5} {'games':>6} {'pair ms':>8} {'record us':>10} {'rematches':>10} {'cross-group':>12}")
+    games = 0
+    for number in range(1, rounds + 1):
+        started = time.perf_counter()
+        pairs = tournament.pair(everyone)
+        pair_ms = (time.perf_counter() - started) * 1000
+        standings = tournament.players
+        rematches = sum(1 for white, black in pairs if black in standings[white].opponents)
+        # Pairs whose players came in with different scores (floats)
+        cross = sum(1 for white, black in pairs if standings[white].score != standings[black].score)
+        started_games = [(str(games + i), white, black) for i, (white, black) in enumerate(pairs)]
+        games += len(pairs)
+        tournament.started(started_games)
+        started = time.perf_counter()
+        for gameId, white, black in started_games:
+            draw = rng.random()
+            tournament.record(gameId, None if draw < 0.1 else white if draw < 0.55 else black)
+        record_us = (time.perf_counter() - started) / max(1, len(pairs)) * 1e6
+        print(f"{number:>5} {len(pairs):>6} {pair_ms:>8.1f} {record_us:>10.1f} {rematches:>10} {cross:>12}")
+
+    arena = field(ARENA, players, rng, duration=3600)
+    started = time.perf_counter()
+    pairs = arena.pair(set(arena.players))
+    print(f"arena pass, {players} waiting: {len(pairs)} games in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def burst(players, rounds):
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench')
+    os.environ['GAME_JOURNAL_DIR'] = ''
+    # Rounds are paired by the benchmark, not the scheduler
+    os.environ['SWISS_ROUND_BREAK_SECONDS'] = '3600'
+    os.environ['SOCKET_RATE_LIMITS'] = 'off'
+    os.chdir(tempfile.mkdtemp(prefix='gochess-tournament-'))
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+
+    started = time.perf_counter()
+    clients = {}
+    for i in range(players):
+        email = f'entrant{i}@example.com'
+        with app_module.app.app_context():
+            token = create_access_token(identity=email)
+        clients[email] = app_module.socketio.test_client(app_module.app, query_string=f'token={token}')
+    connect_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    owner = next(iter(clients.values()))
+    owner.emit('create_tournament', {'kind': SWISS, 'gameType': 'Blitz', 'rounds': rounds, 'starts_in': 3600})
+    tournamentId = owner.get_received()[-1]['args'][0]['tournamentId']
+    for email, client in clients.items():
+        client.emit('join_tournament', {'tournamentId': tournamentId})
+    tournament = app_module.get_tournament(tournamentId)
+    tournament.start()
+    join_s = time.perf_counter() - started
+    print(f"\n{players} entrants: {connect_s:.1f} s to connect, {join_s:.1f} s to join")
+    print(f"{'round':>5} {'games':>6} {'pair+start s':>13} {'games/s':>8} {'game_over s':>12} {'games/s':>8}")
+
+    for number in range(1, rounds + 1):
+        for client in clients.values():
+            client.get_received()
+        started = time.perf_counter()
+        app_module.pair_tournament(tournament)
+        start_s = time.perf_counter() - started
+        games = [app_module.active_games[gameId] for gameId in list(tournament.games)]
+
+        started = time.perf_counter()
+        for game in games:
+            # The loser resigns, as the resign_game handler does it
+            with game.lock:
+                game.game_over(game.player1 if random.random() < 0.5 else game.player2, 'Resign')
+        over_s = time.perf_counter() - started
+        print(f"{number:>5} {len(games):>6} {start_s:>13.2f} {len(games) / start_s:>8.0f} {over_s:>12.2f} "
+              f"{len(games) / over_s:>8.0f}")
+    print(tournament.summary())
+    print(tournament.standings(0, 3))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-burst', action='store_true', help='pairing only, without the server')
+    args = parser.parse_args()
+
+    pairing(args.players, args.rounds, args.seed)
+    if not args.skip_burst:
+        burst(args.players, args.rounds)
+    # The server's worker pools and background threads
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
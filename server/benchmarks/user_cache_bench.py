@@ -0,0 +1,119 @@
+# Requests/sec on /auth?username= and /get_user_info answered from SQLite on
+# every request (the old behaviour) versus the in-memory identity index and
+# the read-through user cache, with a background writer committing games.
+# Run from the server directory: python -m benchmarks.user_cache_bench
+import argparse
+import os
+import runpy
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.db_pool_bench import start_writer
+
+
+# The availability check the server ran before the index
+class DatabaseIdentity:
+    def __init__(self, app_module):
+        self.app_module = app_module
+
+    def username_taken(self, username):
+        conn, cur = self.app_module.get_connection()
+        try:
+            cur.execute('SELECT username FROM user WHERE username = ?', (username,))
+            return cur.fetchone() is not None
+        finally:
+            conn.close()
+
+
+class NoCache:
+    def get(self, key, loader):
+        return loader(key)
+
+
+def seed_database(users):
+    runpy.run_module('buildDatabase')
+    conn = sqlite3.connect('chess.db')
+    conn.executemany('INSERT INTO user (username, email, password) VALUES (?, ?, ?)',
+                     [(f'user{i}', f'user{i}@example.com', 'x') for i in range(users)])
+    conn.commit()
+    conn.close()
+
+
+def run(app_module, endpoint, tokens, users, concurrency, duration, writes_per_sec):
+    flask_app = app_module.app
+    counts = {'ok': 0, 'error': 0}
+    count_lock = threading.Lock()
+    stop = threading.Event()
+    writer = start_writer(stop, writes_per_sec) if writes_per_sec else None
+
+    def client_loop(worker):
+        client = flask_app.test_client()
+        ok = error = 0
+        i = worker
+        while not stop.is_set():
+            if endpoint == 'auth':
+                # Half taken names, half the prefixes of a new one being typed
+                username = f'user{i % users}' if i % 2 else 'newplayer'[:1 + i % 9] + str(worker)
+                response = client.get(f'/auth?username={username}')
+                good = response.status_code in (200, 409)
+            else:
+                token = tokens[i % len(tokens)]
+                response = client.get('/get_user_info', headers={'Authorization': f'Bearer {token}'})
+                good = response.status_code == 200
+            if good:
+                ok += 1
+            else:
+                error += 1
+            i += concurrency
+        with count_lock:
+            counts['ok'] += ok
+            counts['error'] += error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for worker in range(concurrency):
+            pool.submit(client_loop, worker)
+        time.sleep(duration)
+        stop.set()
+    if writer:
+        writer.join()
+    return counts['ok'] / duration, counts['error']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--active-users', type=int, default=200, help='distinct profiles requested')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--writes-per-sec', type=float, default=50)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-user-cache-'))
+    import app as app_module
+    app_module.start_services()
+    from flask_jwt_extended import create_access_token
+    seed_database(args.users)
+    app_module.identity_index.warm()
+    with app_module.app.app_context():
+        tokens = [create_access_token(identity=f'user{i}@example.com') for i in range(args.active_users)]
+
+    identity_index, user_cache = app_module.identity_index, app_module.user_cache
+    print(f"{'endpoint':>14} {'concurrency':>12} {'mode':>8} {'req/s':>10} {'errors':>8}")
+    for endpoint, path in (('auth', '/auth'), ('user_info', '/get_user_info')):
+        for concurrency in args.concurrency:
+            for mode in ('sqlite', 'cached'):
+                cached = mode == 'cached'
+                app_module.identity_index = identity_index if cached else DatabaseIdentity(app_module)
+                app_module.user_cache = user_cache if cached else NoCache()
+                rps, errors = run(app_module, endpoint, tokens, args.users, concurrency, args.duration,
+                                  args.writes_per_sec)
+                print(f"{path:>14} {concurrency:>12} {mode:>8} {rps:>10.1f} {errors:>8}")
+    print(f"identity index: {identity_index.stats()}")
+    print(f"user cache:     {user_cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Warm restart: journals --games live games (10k by default) part way through,
+# then starts the server in a fresh process and times restart-to-ready, i.e.
+# until app is imported and start_services() has every game back in
+# active_games. Runs it with the games only in the journal tail, again from
+# the snapshot the first restart wrote, and once with the journal off as the
+# baseline. Also reports what journaling costs the move path and how long a
+# snapshot of all the games takes.
+# Run from the server directory: python -m benchmarks.warm_restart_bench [--games 10000]
+import argparse
+import json
+import os
+import random
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.position_cache_bench import synthetic_games
+from game_journal import GameJournal
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the restarted process
+STARTUP = '''
+import json, time
+started = time.perf_counter()
+import app
+app.start_services()
+ready = time.perf_counter() - started
+stats = app.game_journal.stats() if app.game_journal else {}
+print(json.dumps({'ready_s': ready, 'games': len(app.active_games), 'journal_ms': stats.get('restore_ms', 0.0),
+                  'snapshot_ms': stats.get('last_snapshot_ms', 0.0)}))
+'''
+
+
+def restart(journal_dir):
+    env = dict(os.environ, GAME_JOURNAL_DIR=journal_dir, PYTHONPATH=SERVER_DIR, JWT_SECRET_KEY='bench')
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', STARTUP], env=env, capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - started
+    return result
+
+
+def journal_games(directory, games, max_plies, seed):
+    # Games cut at random points of 200 synthetic lines, journaled as the server
+    # would, with no snapshot in between. Returns seconds spent queueing records.
+    rng = random.Random(seed)
+    lines = synthetic_games(200, max_plies, seed)
+    journal = GameJournal(directory, snapshot_records=10 ** 9)
+    journal.open()
+    queued = 0.0
+    for n in range(games):
+        gameId = f'{n:08x}'
+        moves = rng.choice(lines)[:rng.randrange(max_plies + 1)]
+        clocks = [600, 600]
+        started = time.perf_counter()
+        journal.started(gameId, f'white{n}@example.com', f'black{n}@example.com', 'Rapid', clocks)
+        for ply, move in enumerate(moves):
+            clocks[ply % 2] -= 1
+            journal.moved(gameId, move, clocks)
+        queued += time.perf_counter() - started
+    journal.stop()
+    return queued, journal.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--max-plies', type=int, default=80, help='games are cut at 0..max-plies plies')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='gochess-restart-'))
+    runpy.run_module('buildDatabase')
+    queued, stats = journal_games('journal', args.games, args.max_plies, args.seed)
+    size = sum(os.path.getsize(os.path.join('journal', name)) for name in os.listdir('journal'))
+    print(f"{args.games} live games, {stats['records']} records ({size / 2 ** 20:.1f} MiB), "
+          f"{queued / stats['records'] * 1e6:.2f} us to queue a record, {stats['flushes']} writer flushes")
+
+    # The first restart replays the tail and folds it into a snapshot, which the second reads
+    print(f"{'restart':>13} {'games':>6} {'journal ms':>11} {'snapshot ms':>12} {'import s':>9} {'process s':>10}")
+    for name, directory in (('journal tail', 'journal'), ('snapshot', 'journal'), ('no journal', '')):
+        result = restart(directory)
+        print(f"{name:>13} {result['games']:>6} {result['journal_ms']:>11.0f} {result['snapshot_ms']:>12.0f} "
+              f"{result['ready_s']:>9.2f} {result['process_s']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
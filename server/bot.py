@@ -0,0 +1,399 @@
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import chess
+
+from concurrency import exit_with_parent
+from position_cache import position_key
+
+# Built-in computer opponent. Each strength level is a virtual player with
+# its own user row (bot<level>@gochess.bot), so bot games are stored and rated
+# like any other. Searches run in worker processes: negamax alpha-beta with
+# quiescence, a transposition table kept per worker across searches, and
+# iterative deepening until the time budget taken from the bot's clock is
+# spent. Weaker levels search shallower and add noise to their root scores.
+
+BOT_DOMAIN = 'gochess.bot'
+
+# level -> maximum depth, maximum seconds per move, root score noise (centipawns)
+LEVELS = {
+    1: (1, 0.2, 300),
+    2: (2, 0.3, 150),
+    3: (2, 0.5, 60),
+    4: (3, 1.0, 30),
+    5: (4, 2.0, 10),
+    6: (5, 3.0, 0),
+    7: (8, 5.0, 0),
+    8: (64, 10.0, 0),
+}
+
+# Share of the remaining clock spent on one move
+CLOCK_FRACTION = 1 / 30
+MIN_BUDGET = 0.05
+
+MATE = 100000
+TT_MAX_ENTRIES = 200000
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+
+
+def bot_email(level):
+    return f'bot{level}@{BOT_DOMAIN}'
+
+
+def bot_level(email):
+    # Strength level of a bot player, or None for a person
+    if not email or not email.endswith('@' + BOT_DOMAIN):
+        return None
+    try:
+        level = int(email.split('@')[0][3:])
+    except ValueError:
+        return None
+    return level if level in LEVELS else None
+
+
+def bot_users():
+    return [(f'Bot level {level}', bot_email(level)) for level in LEVELS]
+
+
+def move_budget(level, remaining_seconds):
+    return max(MIN_BUDGET, min(LEVELS[level][1], remaining_seconds * CLOCK_FRACTION))
+
+
+# Evaluation: material plus piece-square tables, in centipawns from White's
+# side. Tables are laid out as seen from White, rank 8 first.
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330, chess.ROOK: 500, chess.QUEEN: 900,
+                chess.KING: 0}
+
+_TABLES = {
+    chess.PAWN: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0],
+    chess.KNIGHT: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50],
+    chess.BISHOP: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20],
+    chess.ROOK: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0],
+    chess.QUEEN: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20],
+    chess.KING: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20],
+}
+
+# Per piece type and colour: square -> material + placement, signed for White
+_SQUARE_VALUES = {}
+for _piece_type, _table in _TABLES.items():
+    _SQUARE_VALUES[(_piece_type, chess.WHITE)] = [PIECE_VALUES[_piece_type] + _table[sq ^ 56] for sq in chess.SQUARES]
+    _SQUARE_VALUES[(_piece_type, chess.BLACK)] = [-(PIECE_VALUES[_piece_type] + _table[sq]) for sq in chess.SQUARES]
+
+
+def evaluate(board):
+    # Score for the side to move
+    score = 0
+    for (piece_type, color), values in _SQUARE_VALUES.items():
+        for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+            score += values[square]
+    return score if board.turn == chess.WHITE else -score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Kept across searches in a worker: positions from earlier moves of the same
+# game are usually reached again
+_tt = {}
+
+
+class Searcher:
+    def __init__(self, board, deadline, history):
+        self.board = board
+        self.deadline = deadline
+        # Positions already on the board in this game; reaching one again scores as a draw
+        self.history = history
+        self.path = set()
+        self.nodes = 0
+        self.killers = {}
+
+    def _check_time(self):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise SearchTimeout()
+
+    def _capture_order(self, move):
+        board = self.board
+        victim = board.piece_type_at(move.to_square) or chess.PAWN  # en passant
+        attacker = board.piece_type_at(move.from_square)
+        return PIECE_VALUES[victim] * 10 - PIECE_VALUES[attacker]
+
+    def ordered_moves(self, tt_move, ply):
+        # Transposition table move, captures by MVV-LVA, killers, then the rest
+        board = self.board
+        killers = self.killers.get(ply, ())
+        first, captures, killer_moves, quiet = [], [], [], []
+        for move in board.legal_moves:
+            if move == tt_move:
+                first.append(move)
+            elif board.is_capture(move) or move.promotion:
+                captures.append(move)
+            elif move in killers:
+                killer_moves.append(move)
+            else:
+                quiet.append(move)
+        captures.sort(key=self._capture_order, reverse=True)
+        return first + captures + killer_moves + quiet
+
+    def quiesce(self, alpha, beta, depth=0):
+        self._check_time()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return beta
+        if alpha < stand_pat:
+            alpha = stand_pat
+        if depth >= 6:
+            return alpha
+        captures = sorted(board.generate_legal_captures(), key=self._capture_order, reverse=True)
+        for move in captures:
+            board.push(move)
+            score = -self.quiesce(-beta, -alpha, depth + 1)
+            board.pop()
+            if score >= beta:
+                return beta
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def negamax(self, depth, alpha, beta, ply):
+        self._check_time()
+        board = self.board
+        key = position_key(board)
+        if ply and (key in self.path or key in self.history or board.halfmove_clock >= 100):
+            return 0
+
+        entry = _tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, value, flag, tt_move = entry
+            if entry_depth >= depth and ply:
+                if flag == TT_EXACT:
+                    return value
+                if flag == TT_LOWER and value >= beta:
+                    return value
+                if flag == TT_UPPER and value <= alpha:
+                    return value
+
+        if depth <= 0:
+            return self.quiesce(alpha, beta)
+
+        moves = self.ordered_moves(tt_move, ply)
+        if not moves:
+            return -MATE + ply if board.is_check() else 0
+
+        original_alpha = alpha
+        best_score, best_move = -MATE - 1, None
+        self.path.add(key)
+        try:
+            for move in moves:
+                board.push(move)
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+                board.pop()
+                if score > best_score:
+                    best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                if alpha >= beta:
+                    if not board.is_capture(move):
+                        killers = self.killers.setdefault(ply, [])
+                        if move not in killers:
+                            killers.insert(0, move)
+                            del killers[2:]
+                    break
+        finally:
+            self.path.discard(key)
+
+        flag = TT_UPPER if best_score <= original_alpha else TT_LOWER if best_score >= beta else TT_EXACT
+        if len(_tt) >= TT_MAX_ENTRIES:
+            _tt.clear()
+        _tt[key] = (depth, best_score, flag, best_move)
+        return best_score
+
+    def root_scores(self, depth):
+        # Exact score of every root move, for levels that pick with noise
+        board = self.board
+        scores = []
+        self.path.add(position_key(board))
+        try:
+            for move in self.ordered_moves(None, 0):
+                board.push(move)
+                scores.append((-self.negamax(depth - 1, -MATE - 1, MATE + 1, 1), move))
+                board.pop()
+        finally:
+            self.path.clear()
+        return scores
+
+
+def think(moves, budget, level, seed=None, submitted=None):
+    # Runs in a worker process. moves: the game so far in UCI, from the
+    # standard position. The budget counts from submitted (monotonic, shared
+    # with the server process) so time spent queued for a worker comes out of
+    # it, but at least MIN_BUDGET is left for the search itself. Returns the
+    # chosen move and search statistics.
+    started = time.monotonic()
+    budget = max(MIN_BUDGET, budget - (started - submitted)) if submitted is not None else budget
+    max_depth, _, noise = LEVELS[level]
+    board = chess.Board()
+    history = set()
+    for uci in moves:
+        history.add(position_key(board))
+        board.push_uci(uci)
+    searcher = Searcher(board, started + budget, history)
+    legal = list(board.legal_moves)
+    best_move, best_score, depth_reached = legal[0], 0, 0
+    rng = random.Random(seed)
+
+    for depth in range(1, max_depth + 1):
+        try:
+            if noise:
+                scores = searcher.root_scores(depth)
+                # Keyed on the score alone: chess.Move has no ordering to break a tie
+                best_score, best_move = max(((score + rng.uniform(-noise, noise), move) for score, move in scores),
+                                            key=lambda candidate: candidate[0])
+            else:
+                best_score = searcher.negamax(depth, -MATE - 1, MATE + 1, 0)
+                best_move = _tt[position_key(board)][3] or best_move
+        except SearchTimeout:
+            # The board is left mid-line; only completed depths are used
+            break
+        depth_reached = depth
+        if abs(best_score) >= MATE - 100:
+            break
+        # A deeper iteration would not finish in what is left of the budget
+        if time.monotonic() - started > budget / 2:
+            break
+        if len(legal) == 1:
+            break
+
+    elapsed = time.monotonic() - started
+    return {
+        'move': best_move.uci(),
+        'score': round(best_score),
+        'depth': depth_reached,
+        'nodes': searcher.nodes,
+        'seconds': elapsed,
+        'nps': searcher.nodes / elapsed if elapsed else 0.0,
+    }
+
+
+def _warm_up():
+    return os.getpid()
+
+
+# Pool of search processes; submit() returns a Future of think()'s result
+class BotPool:
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'searches': 0, 'failed': 0, 'pending': 0, 'nodes': 0, 'search_seconds': 0.0}
+
+    def start(self):
+        # Fork the workers now, while the server has few threads
+        executor = self._get_executor()
+        for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'),
+                                                     initializer=exit_with_parent, initargs=(os.getpid(),))
+            return self._executor
+
+    def submit(self, moves, budget, level):
+        executor = self._get_executor()
+        try:
+            future = executor.submit(think, list(moves), budget, level, submitted=time.monotonic())
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next search
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        with self._lock:
+            self._stats['pending'] += 1
+        future.add_done_callback(self._record)
+        return future
+
+    def _record(self, future):
+        with self._lock:
+            self._stats['pending'] -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._stats['failed'] += 1
+                return
+            result = future.result()
+            self._stats['searches'] += 1
+            self._stats['nodes'] += result['nodes']
+            self._stats['search_seconds'] += result['seconds']
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, workers=self.workers)
+        stats['nps'] = stats['nodes'] / stats['search_seconds'] if stats['search_seconds'] else 0.0
+        return stats
+
+
+def bot_pool_from_env():
+    return BotPool(workers=int(os.getenv('BOT_WORKERS', 1)))
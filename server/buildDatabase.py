@@ -18,17 +18,59 @@ CREATE TABLE IF NOT EXISTS game_history (
     userid_1 INTEGER NOT NULL,
     userid_2 INTEGER NOT NULL,
     time_control TEXT,
-    result INTEGER NOT NULL, -- 0 
-    pgn TEXT NOT NULL,
+    result INTEGER NOT NULL, -- 0 draw, 1 userid_1 (white) won, 2 userid_2 (black) won
+    pgn TEXT NOT NULL, -- '' for games stored as moves; migrated rows keep theirs until move_codec drop-pgn
+    moves BLOB, -- 16 bits per move, see move_codec.py
+    termination TEXT,
     date_of_game DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (userid_1) REFERENCES user(userid),
     FOREIGN KEY (userid_2) REFERENCES user(userid)
 );
 
+-- Per-player history lookups, newest first; gameid is the rowid so these cover the page scan
+CREATE INDEX IF NOT EXISTS idx_game_history_user1_date
+    ON game_history (userid_1, date_of_game, gameid);
+
+CREATE INDEX IF NOT EXISTS idx_game_history_user2_date
+    ON game_history (userid_2, date_of_game, gameid, userid_1);
+
+-- Running record and Elo rating per player and time control, kept in step
+-- with game_history by the game writer (see ratings.py)
+CREATE TABLE IF NOT EXISTS player_stats (
+    userid INTEGER NOT NULL,
+    time_control TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    rating REAL NOT NULL DEFAULT 1500,
+    PRIMARY KEY (userid, time_control),
+    FOREIGN KEY (userid) REFERENCES user(userid)
+) WITHOUT ROWID;
+
+-- Leaderboards read the top of this index and stop
+CREATE INDEX IF NOT EXISTS idx_player_stats_rating
+    ON player_stats (time_control, rating DESC, userid);
+
+-- Opening explorer: results by (position, move) over the first plies of
+-- every game; position_hash and move are described in explorer.py
+CREATE TABLE IF NOT EXISTS opening_stats (
+    position_hash INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    white_wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    black_wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (position_hash, move)
+) WITHOUT ROWID;
+
 CREATE VIEW IF NOT EXISTS USER_VIEW AS
     SELECT userid, username, email, joined_date FROM user;
     
-CREATE VIEW IF NOT EXISTS GAME_VIEW AS 
+-- Recreated so databases built before the moves column pick up its columns.
+-- pgn is NULL for games stored as moves; rebuild it with move_codec.row_pgn.
+DROP VIEW IF EXISTS GAME_VIEW;
+CREATE VIEW GAME_VIEW AS 
     SELECT
         gh.gameid AS gameid,
         u1.username AS username_1,
@@ -37,7 +79,9 @@ CREATE VIEW IF NOT EXISTS GAME_VIEW AS
         u2.userid as userid_2,
         gh.time_control,
         gh.result,
-        gh.pgn,
+        NULLIF(gh.pgn, '') AS pgn,
+        gh.moves,
+        gh.termination,
         gh.date_of_game
     FROM
         game_history gh
@@ -87,5 +131,11 @@ BEGIN
 END;
 """)
 
+# Columns added after game_history was first created
+columns = {row['name'] for row in cur.execute('PRAGMA table_info(game_history)')}
+for name, declaration in (('moves', 'BLOB'), ('termination', 'TEXT')):
+    if name not in columns:
+        cur.execute(f'ALTER TABLE game_history ADD COLUMN {name} {declaration}')
+
 conn.commit()
 conn.close()
\ No newline at end of file
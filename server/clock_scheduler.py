@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import threading
+import time
+
+from logs import get_logger
+
+log = get_logger('clock_scheduler')
+
+
+# Handle returned by ClockScheduler.schedule, used to cancel a pending callback
+class ScheduledCall:
+    __slots__ = ('deadline', 'seq', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, seq, callback, args):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+# One background thread that fires callbacks at time.monotonic() deadlines.
+# Every game clock and delayed cleanup goes through here instead of owning a thread.
+class ClockScheduler:
+    def __init__(self, name='clock-scheduler'):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cancelled = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def schedule_at(self, deadline, callback, *args):
+        call = ScheduledCall(deadline, next(self._seq), callback, args)
+        with self._cond:
+            if not self._running:
+                self.start()
+            heapq.heappush(self._heap, call)
+            # Only wake the worker if the new entry is now the earliest one
+            if self._heap[0] is call:
+                self._cond.notify()
+        return call
+
+    def schedule(self, delay, callback, *args):
+        return self.schedule_at(time.monotonic() + delay, callback, *args)
+
+    def cancel(self, call):
+        if call is None:
+            return
+        with self._cond:
+            if call.cancelled:
+                return
+            call.cancelled = True
+            self._cancelled += 1
+            # Cancelled entries are dropped lazily; rebuild once they dominate the heap
+            if self._cancelled > 64 and self._cancelled * 2 > len(self._heap):
+                self._heap = [c for c in self._heap if not c.cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) - self._cancelled
+
+    def _pop_due(self):
+        due = []
+        while self._running:
+            now = time.monotonic()
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            if self._heap and self._heap[0].deadline <= now:
+                while self._heap and self._heap[0].deadline <= now:
+                    call = heapq.heappop(self._heap)
+                    if call.cancelled:
+                        self._cancelled -= 1
+                    else:
+                        # Mark as consumed so a late cancel() does not skew the counter
+                        call.cancelled = True
+                        due.append(call)
+                return due
+            self._cond.wait(self._heap[0].deadline - now if self._heap else None)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due = self._pop_due()
+                if not self._running:
+                    return
+            for call in due:
+                try:
+                    call.callback(*call.args)
+                except Exception:
+                    log.exception('scheduled_callback_failed', callback=getattr(call.callback, '__qualname__', None))
@@ -0,0 +1,641 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+from socketio import RedisManager
+from socketio.pubsub_manager import PubSubManager
+
+from concurrency import is_green
+from db import ConnectionPool
+from logs import get_logger
+from metrics import timed_lock
+from matchmaking import Matchmaker, queue_options_from_env
+
+log = get_logger('cluster')
+
+
+# Shared state for running the socket server as several worker processes.
+#
+# Every worker keeps its own Game objects; the store records which worker owns
+# each game, where each player is connected and who is waiting for a match.
+# Game events that arrive on another worker are forwarded to the owner over a
+# bus (SocketBus or RedisBus). Socket.IO emits, rooms and disconnects cross workers through the
+# client manager (a Socket.IO message queue).
+#
+# Backends:
+#   LocalStore              single process, plain dicts (the default)
+#   SqliteStore + SocketBus several processes on one host, no extra services
+#   RedisStore + RedisBus   several hosts, needs the redis package and server
+
+
+# Single-process store; also the reference for what the other backends provide
+class LocalStore:
+    def __init__(self, game_types, **queue_options):
+        # Guards what sid_lock used to, so its waits are recorded
+        self._lock = timed_lock('player_store')
+        self._workers = {}
+        self._players = {}
+        self._owners = {}
+        self._player_games = {}
+        # queue_options: MatchQueue's, for rating-window pairing
+        self.matchmaker = Matchmaker(game_types, **queue_options)
+        # Whether join_queue() takes ratings and sweep_queues() needs calling
+        self.rated = self.matchmaker.rated
+
+    def register_worker(self, worker_id, address):
+        with self._lock:
+            self._workers[worker_id] = address
+
+    def unregister_worker(self, worker_id):
+        with self._lock:
+            self._workers.pop(worker_id, None)
+
+    def worker_address(self, worker_id):
+        with self._lock:
+            return self._workers.get(worker_id)
+
+    def worker_ids(self):
+        with self._lock:
+            return list(self._workers)
+
+    def set_player(self, email, sid, worker_id):
+        with self._lock:
+            self._players[email] = (sid, worker_id)
+
+    def get_player(self, email):
+        with self._lock:
+            return self._players.get(email, (None, None))
+
+    def remove_player(self, email, sid):
+        # Only forget the player if they have not reconnected with a new sid
+        with self._lock:
+            if self._players.get(email, (None,))[0] == sid:
+                del self._players[email]
+
+    def set_game(self, gameId, worker_id, players):
+        with self._lock:
+            self._owners[gameId] = worker_id
+            for player in players:
+                self._player_games[player] = gameId
+
+    def game_owner(self, gameId):
+        with self._lock:
+            return self._owners.get(gameId)
+
+    def player_game(self, email):
+        with self._lock:
+            return self._player_games.get(email)
+
+    def release_player(self, email, gameId):
+        with self._lock:
+            if self._player_games.get(email) == gameId:
+                del self._player_games[email]
+
+    def remove_game(self, gameId):
+        with self._lock:
+            self._owners.pop(gameId, None)
+
+    def join_queue(self, game_type, email, rating=None):
+        return self.matchmaker.join(email, game_type, rating)
+
+    def leave_queue(self, email, game_type=None):
+        return self.matchmaker.cancel(email, game_type)
+
+    def sweep_queues(self):
+        return self.matchmaker.sweep()
+
+    def queue_depth(self, game_type):
+        return self.matchmaker.depth(game_type)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cluster_worker (
+    worker_id TEXT PRIMARY KEY,
+    address TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_player (
+    email TEXT PRIMARY KEY,
+    sid TEXT NOT NULL,
+    worker_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_game (
+    gameid TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_player_game (
+    email TEXT PRIMARY KEY,
+    gameid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cluster_waiting (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_type TEXT NOT NULL,
+    email TEXT NOT NULL,
+    UNIQUE (game_type, email)
+);
+-- Oldest waiting player of a time control, read under join_queue's write lock
+CREATE INDEX IF NOT EXISTS idx_cluster_waiting_type_seq ON cluster_waiting (game_type, seq);
+"""
+
+
+# Store shared by worker processes on one host through a WAL-mode SQLite file
+class SqliteStore:
+    # First come, first paired; ratings are ignored
+    rated = False
+
+    def __init__(self, path, game_types):
+        self.game_types = game_types
+        self.pool = ConnectionPool(path, size=16)
+        conn = self.pool.acquire()
+        try:
+            conn.executescript(SQLITE_SCHEMA)
+        finally:
+            conn.close()
+
+    def _execute(self, sql, params=(), fetch=None):
+        with self.pool.acquire() as conn:
+            cur = conn.execute(sql, params)
+            if fetch == 'one':
+                return cur.fetchone()
+            if fetch == 'all':
+                return cur.fetchall()
+            return cur.rowcount
+
+    def register_worker(self, worker_id, address):
+        self._execute('INSERT OR REPLACE INTO cluster_worker (worker_id, address) VALUES (?, ?)',
+                      (worker_id, json.dumps(address)))
+
+    def unregister_worker(self, worker_id):
+        self._execute('DELETE FROM cluster_worker WHERE worker_id = ?', (worker_id,))
+
+    def worker_address(self, worker_id):
+        row = self._execute('SELECT address FROM cluster_worker WHERE worker_id = ?', (worker_id,), 'one')
+        return tuple(json.loads(row['address'])) if row else None
+
+    def worker_ids(self):
+        return [row['worker_id'] for row in self._execute('SELECT worker_id FROM cluster_worker', (), 'all')]
+
+    def set_player(self, email, sid, worker_id):
+        self._execute('INSERT OR REPLACE INTO cluster_player (email, sid, worker_id) VALUES (?, ?, ?)',
+                      (email, sid, worker_id))
+
+    def get_player(self, email):
+        row = self._execute('SELECT sid, worker_id FROM cluster_player WHERE email = ?', (email,), 'one')
+        return (row['sid'], row['worker_id']) if row else (None, None)
+
+    def remove_player(self, email, sid):
+        self._execute('DELETE FROM cluster_player WHERE email = ? AND sid = ?', (email, sid))
+
+    def set_game(self, gameId, worker_id, players):
+        def write(conn):
+            conn.execute('INSERT OR REPLACE INTO cluster_game (gameid, worker_id) VALUES (?, ?)', (gameId, worker_id))
+            conn.cursor().executemany('INSERT OR REPLACE INTO cluster_player_game (email, gameid) VALUES (?, ?)',
+                                      [(player, gameId) for player in players])
+        self.pool.run_transaction(write)
+
+    def game_owner(self, gameId):
+        row = self._execute('SELECT worker_id FROM cluster_game WHERE gameid = ?', (gameId,), 'one')
+        return row['worker_id'] if row else None
+
+    def player_game(self, email):
+        row = self._execute('SELECT gameid FROM cluster_player_game WHERE email = ?', (email,), 'one')
+        return row['gameid'] if row else None
+
+    def release_player(self, email, gameId):
+        self._execute('DELETE FROM cluster_player_game WHERE email = ? AND gameid = ?', (email, gameId))
+
+    def remove_game(self, gameId):
+        self._execute('DELETE FROM cluster_game WHERE gameid = ?', (gameId,))
+
+    def join_queue(self, game_type, email, rating=None):
+        if game_type not in self.game_types:
+            raise Exception("No such gameType")
+        def pair_or_enqueue(conn):
+            # Take the write lock up front so two workers cannot grab the same opponent
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT 1 FROM cluster_waiting WHERE game_type = ? AND email = ?',
+                            (game_type, email)).fetchone():
+                return None
+            row = conn.execute('SELECT seq, email FROM cluster_waiting WHERE game_type = ? '
+                               'ORDER BY seq LIMIT 1', (game_type,)).fetchone()
+            if row:
+                conn.execute('DELETE FROM cluster_waiting WHERE seq = ?', (row['seq'],))
+                return row['email']
+            conn.execute('INSERT INTO cluster_waiting (game_type, email) VALUES (?, ?)', (game_type, email))
+            return None
+        return self.pool.run_transaction(pair_or_enqueue)
+
+    def leave_queue(self, email, game_type=None):
+        game_types = [game_type] if game_type else self.game_types
+        removed = []
+        for gt in game_types:
+            if self._execute('DELETE FROM cluster_waiting WHERE game_type = ? AND email = ?', (gt, email)):
+                removed.append(gt)
+        return removed
+
+    def queue_depth(self, game_type):
+        return self._execute('SELECT COUNT(*) AS n FROM cluster_waiting WHERE game_type = ?',
+                             (game_type,), 'one')['n']
+
+    def sweep_queues(self):
+        return []
+
+
+# Atomic pair-or-enqueue on a sorted set scored by arrival order
+REDIS_JOIN_QUEUE = """
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    return false
+end
+local oldest = redis.call('ZPOPMIN', KEYS[1])
+if oldest[1] then
+    return oldest[1]
+end
+redis.call('ZADD', KEYS[1], redis.call('INCR', KEYS[2]), ARGV[1])
+return false
+"""
+
+REDIS_DELETE_IF_EQUAL = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+# Store shared by workers on several hosts through Redis
+class RedisStore:
+    # First come, first paired; ratings are ignored
+    rated = False
+
+    def __init__(self, url, game_types, prefix='gochess'):
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.game_types = game_types
+        self.prefix = prefix
+        self._join_queue = self.redis.register_script(REDIS_JOIN_QUEUE)
+        self._delete_if_equal = self.redis.register_script(REDIS_DELETE_IF_EQUAL)
+
+    def _key(self, name):
+        return f'{self.prefix}:{name}'
+
+    def register_worker(self, worker_id, address):
+        self.redis.hset(self._key('workers'), worker_id, json.dumps(address))
+
+    def unregister_worker(self, worker_id):
+        self.redis.hdel(self._key('workers'), worker_id)
+
+    def worker_address(self, worker_id):
+        address = self.redis.hget(self._key('workers'), worker_id)
+        return json.loads(address) if address else None
+
+    def worker_ids(self):
+        return list(self.redis.hkeys(self._key('workers')))
+
+    def set_player(self, email, sid, worker_id):
+        self.redis.hset(self._key('players'), email, json.dumps([sid, worker_id]))
+
+    def get_player(self, email):
+        value = self.redis.hget(self._key('players'), email)
+        return tuple(json.loads(value)) if value else (None, None)
+
+    def remove_player(self, email, sid):
+        sid_, worker_id = self.get_player(email)
+        if sid_ == sid:
+            self._delete_if_equal(keys=[self._key('players')],
+                                  args=[email, json.dumps([sid, worker_id])])
+
+    def set_game(self, gameId, worker_id, players):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key('game_owner'), gameId, worker_id)
+        for player in players:
+            pipe.hset(self._key('player_game'), player, gameId)
+        pipe.execute()
+
+    def game_owner(self, gameId):
+        return self.redis.hget(self._key('game_owner'), gameId)
+
+    def player_game(self, email):
+        return self.redis.hget(self._key('player_game'), email)
+
+    def release_player(self, email, gameId):
+        self._delete_if_equal(keys=[self._key('player_game')], args=[email, gameId])
+
+    def remove_game(self, gameId):
+        self.redis.hdel(self._key('game_owner'), gameId)
+
+    def join_queue(self, game_type, email, rating=None):
+        if game_type not in self.game_types:
+            raise Exception("No such gameType")
+        opponent = self._join_queue(keys=[self._key(f'waiting:{game_type}'), self._key('waiting_seq')],
+                                    args=[email])
+        return opponent or None
+
+    def leave_queue(self, email, game_type=None):
+        game_types = [game_type] if game_type else self.game_types
+        return [gt for gt in game_types if self.redis.zrem(self._key(f'waiting:{gt}'), email)]
+
+    def queue_depth(self, game_type):
+        return self.redis.zcard(self._key(f'waiting:{game_type}'))
+
+    def sweep_queues(self):
+        return []
+
+
+# In-process bus for the single-worker mode: there is nobody else to talk to
+class LocalBus:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.handler = None
+
+    def start(self, handler):
+        self.handler = handler
+
+    def send(self, worker_id, message):
+        self.handler(message)
+
+    def broadcast(self, message):
+        pass
+
+    def stop(self):
+        pass
+
+
+# Worker-to-worker messages over authenticated localhost connections.
+# Each worker listens on an ephemeral port recorded in the store.
+class SocketBus:
+    def __init__(self, store, worker_id, authkey, host='127.0.0.1'):
+        self.store = store
+        self.worker_id = worker_id
+        self.authkey = authkey
+        self.host = host
+        self.handler = None
+        self._listener = None
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+
+    def start(self, handler):
+        self.handler = handler
+        self._listener = Listener((self.host, 0), authkey=self.authkey)
+        self.store.register_worker(self.worker_id, self._listener.address)
+        thread = threading.Thread(target=self._accept, name='worker-bus')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.store.unregister_worker(self.worker_id)
+        if self._listener:
+            self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                return
+            thread = threading.Thread(target=self._receive, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _receive(self, conn):
+        while True:
+            try:
+                message = conn.recv_bytes()
+            except (EOFError, OSError):
+                return
+            try:
+                self.handler(json.loads(message))
+            except Exception:
+                log.exception('worker_message_failed', worker=self.worker_id)
+
+    def _connection(self, worker_id):
+        with self._connections_lock:
+            entry = self._connections.get(worker_id)
+            if entry is None:
+                address = self.store.worker_address(worker_id)
+                if address is None:
+                    return None
+                entry = (Client(tuple(address), authkey=self.authkey), threading.Lock())
+                self._connections[worker_id] = entry
+            return entry
+
+    def send(self, worker_id, message):
+        if worker_id == self.worker_id:
+            self.handler(message)
+            return
+        entry = self._connection(worker_id)
+        if entry is None:
+            raise Exception(f"Worker {worker_id} is not available")
+        conn, lock = entry
+        data = json.dumps(message).encode()
+        try:
+            with lock:
+                conn.send_bytes(data)
+        except (OSError, EOFError):
+            # Stale connection (worker restarted); reconnect once
+            with self._connections_lock:
+                self._connections.pop(worker_id, None)
+            entry = self._connection(worker_id)
+            if entry is None:
+                raise
+            with entry[1]:
+                entry[0].send_bytes(data)
+
+    def broadcast(self, message):
+        for worker_id in self.store.worker_ids():
+            if worker_id != self.worker_id:
+                try:
+                    self.send(worker_id, message)
+                except Exception as e:
+                    log.warning('worker_send_failed', worker=worker_id, error=str(e))
+
+
+# Worker-to-worker messages over Redis pub/sub, one channel per worker
+class RedisBus:
+    def __init__(self, url, worker_id, prefix='gochess'):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.worker_id = worker_id
+        self.prefix = prefix
+        self.handler = None
+        self._pubsub = None
+
+    def _channel(self, worker_id):
+        return f'{self.prefix}:worker:{worker_id}'
+
+    def start(self, handler):
+        self.handler = handler
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self._channel(self.worker_id))
+        thread = threading.Thread(target=self._receive, name='worker-bus')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self._pubsub:
+            self._pubsub.close()
+
+    def _receive(self):
+        for item in self._pubsub.listen():
+            try:
+                self.handler(json.loads(item['data']))
+            except Exception:
+                log.exception('worker_message_failed', worker=self.worker_id)
+
+    def send(self, worker_id, message):
+        if worker_id == self.worker_id:
+            self.handler(message)
+            return
+        self.redis.publish(self._channel(worker_id), json.dumps(message))
+
+    def broadcast(self, message):
+        # Socket.IO traffic goes through flask-socketio's own Redis queue in this mode
+        pass
+
+
+# python-socketio's Redis manager, speaking JSON instead of pickle: whoever
+# can publish to the channel must not be able to run code on the workers
+class JsonRedisManager(RedisManager):
+    name = 'gochess-redis'
+
+    def _publish(self, data):
+        try:
+            return self.redis.publish(self.channel, json.dumps(data))
+        except Exception:
+            # Once more on a fresh connection, as RedisManager does
+            self._redis_connect()
+            return self.redis.publish(self.channel, json.dumps(data))
+
+    def _listen(self):
+        # As text, so the listener parses it as JSON and never unpickles it
+        for message in super()._listen():
+            yield message.decode('utf-8') if isinstance(message, bytes) else message
+
+
+# Socket.IO client manager that shares emits and rooms over a SocketBus,
+# standing in for a Redis/AMQP message queue when all workers share a host
+class BusClientManager(PubSubManager):
+    name = 'gochess-bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self._inbox = queue.Queue()
+
+    def deliver(self, data):
+        self._inbox.put(data)
+
+    def _publish(self, data):
+        self.bus.broadcast({'kind': 'socketio', 'data': data})
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+# Everything the app needs for the configured backend
+class Cluster:
+    def __init__(self, store, bus, worker_id, client_manager=None, message_queue=None):
+        self.store = store
+        self.bus = bus
+        self.worker_id = worker_id
+        self.client_manager = client_manager
+        self.message_queue = message_queue
+
+    @property
+    def distributed(self):
+        return not isinstance(self.store, LocalStore)
+
+    def socketio_options(self):
+        if self.client_manager is not None:
+            return {'client_manager': self.client_manager}
+        if self.message_queue is not None:
+            return {'message_queue': self.message_queue}
+        return {}
+
+    def start(self, handler):
+        # handler receives every game message forwarded to this worker
+        def dispatch(message):
+            if message.get('kind') == 'socketio':
+                self.client_manager.deliver(message['data'])
+            else:
+                handler(message)
+        self.bus.start(dispatch)
+
+    def stop(self):
+        self.bus.stop()
+        self.store.unregister_worker(self.worker_id)
+
+
+def cluster_from_env(game_types, secret):
+    # CLUSTER_STORE unset: single process. sqlite:///path or redis://host: shared state.
+    # Rating-window pairing (MATCH_RATING_BUCKET) needs the single-process store.
+    url = os.getenv('CLUSTER_STORE')
+    worker_id = os.getenv('WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+    queue_options = queue_options_from_env()
+    if not url:
+        return Cluster(LocalStore(game_types, **queue_options), LocalBus(worker_id), worker_id)
+    if queue_options:
+        log.warning('rated_matching_unsupported', store=url.split('://')[0])
+    if url.startswith('sqlite:///'):
+        if is_green():
+            # Its store queries and bus sockets block; they would stall the event loop
+            raise ValueError("CLUSTER_STORE=sqlite needs ASYNC_MODE=threading; use a redis:// store with gevent")
+        store = SqliteStore(url[len('sqlite:///'):], game_types)
+        authkey = hashlib.sha256(('gochess-cluster:' + (os.getenv('CLUSTER_AUTHKEY') or secret or '')).encode()).digest()
+        bus = SocketBus(store, worker_id, authkey)
+        return Cluster(store, bus, worker_id, client_manager=BusClientManager(bus))
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        store = RedisStore(url, game_types)
+        message_queue = os.getenv('SOCKETIO_MESSAGE_QUEUE') or url
+        if message_queue.startswith('redis://') or message_queue.startswith('rediss://'):
+            return Cluster(store, RedisBus(url, worker_id), worker_id, client_manager=JsonRedisManager(message_queue))
+        return Cluster(store, RedisBus(url, worker_id), worker_id, message_queue=message_queue)
+    raise ValueError(f"Unsupported CLUSTER_STORE: {url}")
+
+
+# Launch N app workers on consecutive ports sharing one store.
+# Put a load balancer with sticky sessions (e.g. nginx ip_hash) in front of them.
+def run_workers(workers, port, store, host='127.0.0.1'):
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    processes = []
+    for i in range(workers):
+        env = dict(os.environ, CLUSTER_STORE=store, WORKER_ID=f'worker-{i}',
+                   HOST=host, PORT=str(port + i))
+        processes.append(subprocess.Popen([sys.executable, os.path.join(server_dir, 'app.py')], env=env))
+        print(f"Started worker-{i} on {host}:{port + i}")
+
+    def shutdown(*_):
+        for process in processes:
+            process.terminate()
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        shutdown()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several Gochess socket server workers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--store', default='sqlite:///cluster.db',
+                        help='sqlite:///path for workers on one host, redis://host:port/db otherwise')
+    args = parser.parse_args()
+    if args.store.startswith('sqlite:///'):
+        # Stale ownership from a previous run would route events to dead workers
+        path = args.store[len('sqlite:///'):]
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    run_workers(args.workers, args.port, args.store, args.host)
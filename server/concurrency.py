@@ -0,0 +1,84 @@
+import functools
+import os
+
+from dotenv import load_dotenv
+
+# How the server handles concurrency, chosen at startup with ASYNC_MODE:
+#
+#   threading (default)  Every socket connection and HTTP request gets an OS
+#                        thread (werkzeug + simple-websocket). Blocking calls
+#                        are fine, but each connection costs a thread stack.
+#   gevent               Connections, clock timers and background workers are
+#                        greenlets on one event loop (the stdlib is monkey
+#                        patched). Anything that blocks without yielding, i.e.
+#                        SQLite queries and bcrypt, runs on a small pool of
+#                        native threads through run_blocking, so a slow query
+#                        or password hash never stalls other players' moves.
+#
+# Game logic itself (move validation, clocks, emits) is short and CPU bound and
+# runs on the loop in gevent mode. Needs: pip install gevent gevent-websocket
+load_dotenv()
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'threading')
+ASYNC_MODES = ('threading', 'gevent')
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f"ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}, not {ASYNC_MODE}")
+
+# Native threads for blocking calls in gevent mode; about the database pool size
+BLOCKING_THREADS = int(os.getenv('BLOCKING_THREADS', os.getenv('DB_POOL_SIZE', 8)))
+
+
+def monkey_patch():
+    # Must run before anything imports socket, threading or time
+    if ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def is_green():
+    return ASYNC_MODE != 'threading'
+
+
+def run_blocking(fn, *args, **kwargs):
+    # Call fn where it may block: directly in threading mode, on the native
+    # thread pool in gevent mode (the calling greenlet waits, the loop does not)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        hub = gevent.get_hub()
+        if hub.threadpool.maxsize != BLOCKING_THREADS:
+            hub.threadpool.maxsize = BLOCKING_THREADS
+        return hub.threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+def exit_with_parent(parent_pid, interval=1.0):
+    # Initializer for forked worker pools: a native thread that ends the worker
+    # once parent_pid is gone, so a server killed without running atexit does
+    # not leave its pool behind. Polls getppid() rather than using
+    # PR_SET_PDEATHSIG, which fires when the forking thread exits, and pools are
+    # rebuilt from request threads.
+    import _thread
+    import time
+    start_thread, sleep = _thread.start_new_thread, time.sleep
+    if ASYNC_MODE == 'gevent':
+        # Inherited from the patched server; a greenlet would not run while the
+        # worker blocks reading its call queue
+        from gevent import monkey
+        start_thread = monkey.get_original('_thread', 'start_new_thread')
+        sleep = monkey.get_original('time', 'sleep')
+
+    def watch():
+        while os.getppid() == parent_pid:
+            sleep(interval)
+        os._exit(1)
+    start_thread(watch, ())
+
+
+def blocking(view):
+    # Decorator for Flask views that hit the database or bcrypt
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if ASYNC_MODE == 'threading':
+            return view(*args, **kwargs)
+        from flask import copy_current_request_context
+        return run_blocking(copy_current_request_context(view), *args, **kwargs)
+    return wrapper
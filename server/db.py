@@ -0,0 +1,229 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import Histogram, LOCK_WAIT
+
+# Settings applied to every pooled connection
+PRAGMAS = {
+    'journal_mode': 'WAL',      # readers no longer block on the writer
+    'synchronous': 'NORMAL',    # safe with WAL, skips an fsync per commit
+    'cache_size': -16000,       # page cache in KiB (negative) per connection
+    'temp_store': 'MEMORY',
+    'busy_timeout': 2000,       # ms sqlite itself waits on a lock before SQLITE_BUSY
+}
+
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.01  # seconds, doubled on each retry
+
+DB_QUERY_SECONDS = Histogram('gochess_db_query_seconds', 'SQLite statement time, busy retries included', ['op'])
+_EXECUTE_SECONDS = DB_QUERY_SECONDS.labels('execute')
+_EXECUTEMANY_SECONDS = DB_QUERY_SECONDS.labels('executemany')
+_COMMIT_SECONDS = DB_QUERY_SECONDS.labels('commit')
+# Waiting for a free pooled connection counts as lock wait
+_POOL_WAIT = LOCK_WAIT.labels('db_pool')
+
+
+def is_busy_error(e):
+    message = str(e).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(fn, *args, retries=BUSY_RETRIES, before_retry=None):
+    delay = BUSY_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_busy_error(e):
+                raise
+            if before_retry is not None:
+                before_retry()
+            time.sleep(delay)
+            delay *= 2
+
+
+# Cursor that retries statements when the database is busy, but only a
+# statement that starts a transaction or runs on its own. Inside an open
+# transaction a busy error (under WAL, SQLITE_BUSY_SNAPSHOT: a read snapshot
+# that can no longer be upgraded to a write) is raised; the whole transaction
+# has to be rolled back and run again, see run_transaction.
+class PooledCursor:
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def _run(self, fn, *args):
+        if self._conn.in_transaction:
+            return fn(*args)
+        # A statement that failed after opening a transaction must not leave it open
+        return retry_on_busy(fn, *args, before_retry=self._rollback)
+
+    def _rollback(self):
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+    def execute(self, sql, params=()):
+        with _EXECUTE_SECONDS.time():
+            self._run(self._cursor.execute, sql, params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        with _EXECUTEMANY_SECONDS.time():
+            self._run(self._cursor.executemany, sql, seq_of_params)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Connection checked out of a ConnectionPool; close() hands it back instead of closing
+class PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        # Checked out by this thread, this many times (nested acquires); kept on
+        # the connection so any thread can release it
+        self._owner = None
+        self._depth = 0
+
+    def cursor(self):
+        return PooledCursor(self._conn, self._conn.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def commit(self):
+        # A COMMIT refused with SQLITE_BUSY leaves the transaction intact, so it can be retried
+        with _COMMIT_SECONDS.time():
+            retry_on_busy(self._conn.commit)
+
+    def close(self):
+        self._pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self._conn.in_transaction:
+            self.commit()
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=8, timeout=10, cached_statements=256, pragmas=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        # Prepared statements are cached per connection, so keeping connections
+        # alive lets every request reuse statements compiled by earlier ones
+        self.cached_statements = cached_statements
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row  # To access columns by name
+        for name, value in self.pragmas.items():
+            retry_on_busy(conn.execute, f'PRAGMA {name} = {value}')
+        return PooledConnection(self, conn)
+
+    def acquire(self):
+        # Nested acquires on the same thread share one connection
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                # Unless another thread released it meanwhile
+                if conn._owner == threading.get_ident() and conn._depth > 0:
+                    conn._depth += 1
+                    return conn
+            local.conn = None
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    with _POOL_WAIT.time():
+                        conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+
+        with self._lock:
+            conn._owner = threading.get_ident()
+            conn._depth = 1
+        local.conn = conn
+        return conn
+
+    def release(self, conn):
+        # From any thread: a streamed response may finish on another one
+        with self._lock:
+            if conn._depth <= 0:
+                # Already back in the pool
+                return
+            conn._depth -= 1
+            if conn._depth > 0:
+                return
+            conn._owner = None
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def run_transaction(self, fn, *args, retries=BUSY_RETRIES):
+        # fn(conn, *args) in one transaction, committed here. A busy error
+        # anywhere in it rolls the whole transaction back and runs fn again.
+        delay = BUSY_BACKOFF
+        for attempt in range(retries + 1):
+            conn = self.acquire()
+            try:
+                result = fn(conn, *args)
+                conn.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if attempt == retries or not is_busy_error(e):
+                    raise
+            finally:
+                conn.close()
+            time.sleep(delay)
+            delay *= 2
+
+    def connection(self):
+        return self.acquire()
+
+    def close_all(self):
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn._conn.close()
+                self._created -= 1
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import struct
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from move_codec import decode_move, decode_moves, encode_move, from_pgn
+from ratings import RESULT_BLACK_WINS, RESULT_DRAW, RESULT_WHITE_WINS
+
+# Opening explorer: for each position reached in the first OPENING_PLIES plies
+# of archived games, the moves played from it and how those games ended.
+# opening_stats is keyed by (position hash, 16-bit move code). The game writer
+# adds each flushed batch in its transaction; `python explorer.py build`
+# recomputes the table from game_history on a pool of worker processes.
+
+OPENING_PLIES = int(os.getenv('OPENING_PLIES', 30))
+
+# game_history.result -> index into the white/draw/black counters
+RESULT_COLUMN = {RESULT_WHITE_WINS: 0, RESULT_DRAW: 1, RESULT_BLACK_WINS: 2}
+
+UPSERT_STATS = '''
+    INSERT INTO opening_stats (position_hash, move, games, white_wins, draws, black_wins)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (position_hash, move) DO UPDATE SET
+        games = games + excluded.games,
+        white_wins = white_wins + excluded.white_wins,
+        draws = draws + excluded.draws,
+        black_wins = black_wins + excluded.black_wins
+'''
+
+LOOKUP = '''
+    SELECT move, games, white_wins, draws, black_wins FROM opening_stats
+    WHERE position_hash = ? ORDER BY games DESC
+'''
+
+_POSITION = struct.Struct('<8QBQb')
+
+
+def position_hash(board):
+    # Stable across processes and Python versions, unlike hash(). En passant
+    # counts only when a capture is possible, as in FEN, so a position looked
+    # up by FEN matches the one reached in play.
+    ep_square = board.ep_square if board.has_legal_en_passant() else -1
+    packed = _POSITION.pack(board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK],
+                            board.turn, board.castling_rights, ep_square)
+    # Signed, to fit an sqlite INTEGER
+    return int.from_bytes(hashlib.blake2b(packed, digest_size=8).digest(), 'little', signed=True)
+
+
+# (position hash, move code) -> [games, white wins, draws, black wins]
+class OpeningCounts:
+    def __init__(self, plies=OPENING_PLIES):
+        self.plies = plies
+        self.counts = {}
+
+    def add_game(self, moves, result):
+        column = RESULT_COLUMN[result]
+        board = chess.Board()
+        for move in moves[:self.plies]:
+            key = (position_hash(board), encode_move(move))
+            row = self.counts.get(key)
+            if row is None:
+                row = self.counts[key] = [0, 0, 0, 0]
+            row[0] += 1
+            row[1 + column] += 1
+            board.push(move)
+
+    def rows(self):
+        return [key + tuple(row) for key, row in self.counts.items()]
+
+
+def record_games(cur, games):
+    # games: (moves, result) for games in the current write transaction
+    counts = OpeningCounts()
+    for moves, result in games:
+        counts.add_game(moves, result)
+    cur.executemany(UPSERT_STATS, counts.rows())
+
+
+def lookup(cur, board):
+    cur.execute(LOOKUP, (position_hash(board),))
+    moves = []
+    for code, games, white_wins, draws, black_wins in cur.fetchall():
+        move = decode_move(code)
+        # A hash collision would show up as a move that isn't legal here
+        if not board.is_legal(move):
+            continue
+        moves.append({'uci': move.uci(), 'san': board.san(move), 'games': games,
+                      'white_wins': white_wins, 'draws': draws, 'black_wins': black_wins})
+    return moves
+
+
+# Bulk build. Workers each read a gameid range on their own connection and
+# return that range's counts; the parent merges them into the table.
+def _count_range(path, first_gameid, last_gameid, plies):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    counts = OpeningCounts(plies)
+    games = 0
+    try:
+        for moves, pgn, result in conn.execute('SELECT moves, pgn, result FROM game_history '
+                                               'WHERE gameid BETWEEN ? AND ?', (first_gameid, last_gameid)):
+            if moves is None:
+                encoded = from_pgn(pgn) if pgn else None
+                if encoded is None:
+                    continue
+                moves = encoded[0]
+            counts.add_game(decode_moves(moves), result)
+            games += 1
+    finally:
+        conn.close()
+    return games, counts.rows()
+
+
+def build(path='chess.db', workers=None, chunk_size=2000, plies=OPENING_PLIES, progress=None):
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        # Clearing the table and fixing the range in one transaction means a
+        # game the writer flushes meanwhile is counted exactly once: by the
+        # writer if it lands above last_gameid, by the build otherwise
+        conn.execute('BEGIN IMMEDIATE')
+        first_gameid, last_gameid = conn.execute('SELECT min(gameid), max(gameid) FROM game_history').fetchone()
+        conn.execute('DELETE FROM opening_stats')
+        conn.commit()
+        if last_gameid is None:
+            return 0
+        ranges = [(start, min(start + chunk_size - 1, last_gameid))
+                  for start in range(first_gameid, last_gameid + 1, chunk_size)]
+        games = 0
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            # A couple of ranges in flight per worker, so finished results
+            # don't pile up in memory while the parent is writing
+            pending = deque()
+            ranges = iter(ranges)
+            while True:
+                while len(pending) < 2 * workers:
+                    next_range = next(ranges, None)
+                    if next_range is None:
+                        break
+                    pending.append(executor.submit(_count_range, path, *next_range, plies))
+                if not pending:
+                    break
+                counted, rows = pending.popleft().result()
+                # A short transaction per range, so live game writes interleave
+                conn.executemany(UPSERT_STATS, rows)
+                conn.commit()
+                games += counted
+                if progress:
+                    progress(games)
+        return games
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the opening explorer index from game_history')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=2000, help='games per worker task')
+    args = parser.parse_args()
+    # Creates opening_stats in chess.db if it predates the table
+    import buildDatabase
+    started = time.perf_counter()
+    games = build('chess.db', args.workers, args.chunk)
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {games} games in {elapsed:.1f}s ({games / elapsed if elapsed else 0:.0f} games/s)")
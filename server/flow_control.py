@@ -0,0 +1,233 @@
+import threading
+import time
+
+from logs import get_logger
+from metrics import Counter
+
+log = get_logger('flow_control')
+
+# Per-connection flow control for the socket server.
+#
+# EventLimiter gives every sid a token bucket per event type, so one client
+# firing make_move or request_board_state in a loop is refused at the door
+# instead of taking the game's lock for each message. Refusals draw from one
+# more bucket per sid; a client that keeps sending after it is refused empties
+# it and is cut off, since even refusing a flood costs the server a packet
+# decode per message. The player it was connected as is then turned away at
+# connect for penalty seconds, so a flooder that reconnects straight away
+# doesn't get a fresh set of strikes.
+#
+# OutgoingBacklog looks at what engine.io has queued for a connection but not
+# yet written. Messages that the next one supersedes (lag_ping) are skipped
+# for connections behind by soft_limit packets; a connection behind by
+# hard_limit packets has stopped reading and is cut off, which bounds the
+# memory one slow consumer can hold. Its player gets the usual reconnect
+# grace window and catches up with resync.
+
+EVENTS_THROTTLED = Counter('gochess_socket_events_throttled', 'Socket events refused by the rate limiter', ['event'])
+UPDATES_DROPPED = Counter('gochess_socket_updates_dropped', 'Droppable updates skipped for lagging connections',
+                          ['event'])
+CONNECTIONS_ABORTED = Counter('gochess_socket_connections_aborted', 'Connections cut off by flow control', ['reason'])
+
+# EventLimiter.check() decisions
+ALLOW, REFUSE, WARN, CUT_OFF = 'allow', 'refuse', 'warn', 'cut_off'
+
+# event -> (tokens per second, burst)
+DEFAULT_LIMITS = {
+    'make_move': (10, 20),
+    'request_board_state': (1, 5),
+    'resync': (1, 5),
+    'join_game': (1, 5),
+    'play_bot': (1, 5),
+    'stop_waiting_for_opponent': (1, 5),
+    'resign_game': (1, 3),
+    'spectate_game': (2, 10),
+    'stop_spectating': (2, 10),
+    'create_tournament': (1, 3),
+    'join_tournament': (1, 5),
+    'leave_tournament': (1, 5),
+    'tournament_standings': (2, 10),
+}
+
+
+def parse_limits(spec, defaults=DEFAULT_LIMITS):
+    # "make_move=5/10,resync=1/5" overrides entries of defaults; "off" disables limiting
+    limits = dict(defaults)
+    if not spec:
+        return limits
+    if spec.strip().lower() == 'off':
+        return {}
+    for item in spec.split(','):
+        event, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[event.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated', 'refused')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        # Whether the client was already told it is being refused
+        self.refused = False
+
+    def take(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class EventLimiter:
+    # limits: event -> (rate, burst); strikes: (rate, burst) of refusals a sid may collect;
+    # penalty: seconds a cut off player is refused at connect
+    def __init__(self, limits, strikes=(2, 10), penalty=30.0):
+        self.limits = limits
+        self.strikes = strikes
+        self.penalty = penalty
+        self._lock = threading.Lock()
+        # sid -> event -> TokenBucket; the sid's strikes under None
+        self._buckets = {}
+        # player -> time.monotonic() their penalty ends
+        self._penalized = {}
+        self._throttled = {}
+        self._counters = {event: EVENTS_THROTTLED.labels(event) for event in limits}
+
+    def check(self, sid, event):
+        # ALLOW, or REFUSE; WARN for the first refusal after an allowed event,
+        # so a flooder gets one rate_limited reply per burst; CUT_OFF once the
+        # sid is out of strikes
+        rate, burst = self.limits[event]
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._buckets.get(sid)
+            if buckets is None:
+                buckets = self._buckets[sid] = {None: TokenBucket(self.strikes[1], now)}
+            bucket = buckets.get(event)
+            if bucket is None:
+                bucket = buckets[event] = TokenBucket(burst, now)
+            if bucket.take(rate, burst, now):
+                bucket.refused = False
+                return ALLOW
+            self._throttled[event] = self._throttled.get(event, 0) + 1
+            if not buckets[None].take(*self.strikes, now):
+                decision = CUT_OFF
+            elif bucket.refused:
+                decision = REFUSE
+            else:
+                decision = WARN
+            bucket.refused = True
+        self._counters[event].inc()
+        return decision
+
+    def retry_after(self, event):
+        return 1 / self.limits[event][0]
+
+    def penalize(self, player):
+        # Called when player's connection is cut off
+        if player is None or self.penalty <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._penalized[player] = now + self.penalty
+            if len(self._penalized) > 1000:
+                self._penalized = {player: until for player, until in self._penalized.items() if until > now}
+
+    def penalized(self, player):
+        # Whether player is still serving a penalty; a connect from them is refused
+        with self._lock:
+            until = self._penalized.get(player)
+            if until is None:
+                return False
+            if until > time.monotonic():
+                return True
+            del self._penalized[player]
+            return False
+
+    def forget(self, sid):
+        with self._lock:
+            self._buckets.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {'connections': len(self._buckets), 'throttled': dict(self._throttled),
+                    'penalized': len(self._penalized)}
+
+
+class OutgoingBacklog:
+    def __init__(self, socketio, soft_limit=32, hard_limit=2000, check_interval=1.0, namespace='/'):
+        self.socketio = socketio
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.check_interval = check_interval
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._running = False
+        self._stats = {'dropped': {}, 'aborted': {}, 'deepest_backlog': 0}
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        self._running = False
+
+    def abort(self, sid, reason):
+        # Close the connection at once: no close packet queued behind the
+        # backlog, and no waiting for the queue to drain
+        server = self.socketio.server
+        eio_sid = server.manager.eio_sid_from_sid(sid, self.namespace)
+        socket = server.eio.sockets.get(eio_sid) if eio_sid else None
+        if socket is not None and not socket.closed:
+            log.warning('connection_aborted', sid=sid, reason=reason, backlog=socket.queue.qsize())
+            socket.close(wait=False, abort=True)
+            CONNECTIONS_ABORTED.labels(reason).inc()
+            with self._lock:
+                self._stats['aborted'][reason] = self._stats['aborted'].get(reason, 0) + 1
+
+    def depth(self, sid):
+        # Packets queued for this connection; 0 if it isn't connected to this worker
+        server = self.socketio.server
+        eio_sid = server.manager.eio_sid_from_sid(sid, self.namespace)
+        socket = server.eio.sockets.get(eio_sid) if eio_sid else None
+        return socket.queue.qsize() if socket is not None else 0
+
+    def lagging(self, sids, event):
+        # Those of sids too far behind to be sent a droppable event
+        lagging = [sid for sid in sids if sid and self.depth(sid) >= self.soft_limit]
+        if lagging:
+            UPDATES_DROPPED.labels(event).inc(len(lagging))
+            with self._lock:
+                self._stats['dropped'][event] = self._stats['dropped'].get(event, 0) + len(lagging)
+        return lagging
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, dropped=dict(self._stats['dropped']), aborted=dict(self._stats['aborted']))
+        return dict(stats, soft_limit=self.soft_limit, hard_limit=self.hard_limit)
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.check_interval)
+            try:
+                self._check()
+            except Exception:
+                log.exception('backlog_check_failed')
+
+    def _check(self):
+        server = self.socketio.server
+        deepest = 0
+        for eio_sid, socket in list(server.eio.sockets.items()):
+            depth = socket.queue.qsize()
+            deepest = max(deepest, depth)
+            if depth >= self.hard_limit:
+                sid = server.manager.sid_from_eio_sid(eio_sid, self.namespace)
+                if sid is not None:
+                    self.abort(sid, 'backlog')
+        with self._lock:
+            self._stats['deepest_backlog'] = deepest
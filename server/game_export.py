@@ -0,0 +1,162 @@
+import json
+import zlib
+from datetime import date, timedelta
+
+from concurrency import run_blocking
+from move_codec import decode_moves, from_pgn, row_pgn
+
+# Bulk export of game_history as PGN or NDJSON. Rows are read in keyset
+# batches, each on a pooled connection that is handed back before the batch
+# is formatted and sent, so a long download neither holds a connection nor
+# keeps a read transaction open, and memory stays at one batch whatever the
+# export size.
+
+EXPORT_BATCH_SIZE = 500
+
+EXPORT_COLUMNS = '''
+    gh.gameid AS gameid,
+    gh.date_of_game AS date_of_game,
+    u1.username AS username_1,
+    u2.username AS username_2,
+    gh.userid_1 AS userid_1,
+    gh.userid_2 AS userid_2,
+    gh.time_control AS time_control,
+    gh.result AS result,
+    gh.termination AS termination,
+    gh.moves AS moves,
+    gh.pgn AS pgn
+'''
+
+# One player's games oldest first, walking the (userid_x, date_of_game, gameid) indexes
+USER_EXPORT_QUERY = '''
+    SELECT {columns}
+    FROM (
+        SELECT gameid, date_of_game FROM (
+            SELECT gameid, date_of_game FROM game_history
+            WHERE userid_1 = :userid {filters}
+            ORDER BY date_of_game, gameid LIMIT :limit
+        )
+        UNION ALL
+        SELECT gameid, date_of_game FROM (
+            SELECT gameid, date_of_game FROM game_history
+            WHERE userid_2 = :userid AND userid_1 != :userid {filters}
+            ORDER BY date_of_game, gameid LIMIT :limit
+        )
+        ORDER BY date_of_game, gameid LIMIT :limit
+    ) page
+    JOIN game_history gh ON gh.gameid = page.gameid
+    JOIN user u1 ON gh.userid_1 = u1.userid
+    JOIN user u2 ON gh.userid_2 = u2.userid
+    ORDER BY page.date_of_game, page.gameid
+'''
+USER_KEYSET = 'AND (date_of_game, gameid) > (:after_date, :after_gameid)'
+
+# Every game in insertion order, walking the rowid
+SITE_EXPORT_QUERY = '''
+    SELECT {columns}
+    FROM game_history gh
+    JOIN user u1 ON gh.userid_1 = u1.userid
+    JOIN user u2 ON gh.userid_2 = u2.userid
+    WHERE gh.gameid > :after_gameid {filters}
+    ORDER BY gh.gameid LIMIT :limit
+'''
+
+FORMATS = {
+    'pgn': ('application/x-chess-pgn', 'pgn'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class ExportFilters:
+    # userid, time_control and an inclusive since/until day range (YYYY-MM-DD), all optional.
+    # Raises ValueError on a malformed value.
+    def __init__(self, userid=None, time_control=None, since=None, until=None):
+        self.userid = int(userid) if userid else None
+        self.time_control = time_control or None
+        self.since = date.fromisoformat(since).isoformat() if since else None
+        # date_of_game has a time part, so "until" compares against the next day
+        self.before = (date.fromisoformat(until) + timedelta(days=1)).isoformat() if until else None
+
+    def sql(self, prefix=''):
+        clauses = []
+        if self.time_control:
+            clauses.append(f'AND {prefix}time_control = :time_control')
+        if self.since:
+            clauses.append(f'AND {prefix}date_of_game >= :since')
+        if self.before:
+            clauses.append(f'AND {prefix}date_of_game < :before')
+        return ' '.join(clauses)
+
+    def params(self):
+        return {'userid': self.userid, 'time_control': self.time_control, 'since': self.since,
+                'before': self.before}
+
+    def filename(self, extension):
+        parts = ['games'] + [str(part) for part in (self.userid, self.time_control, self.since) if part]
+        return '-'.join(parts) + '.' + extension
+
+
+def _fetch(pool, filters, after, limit):
+    params = dict(filters.params(), limit=limit)
+    if filters.userid is not None:
+        keyset = ''
+        if after:
+            keyset = USER_KEYSET
+            params['after_date'], params['after_gameid'] = after
+        query = USER_EXPORT_QUERY.format(columns=EXPORT_COLUMNS, filters=f'{filters.sql()} {keyset}')
+    else:
+        params['after_gameid'] = after[1] if after else 0
+        query = SITE_EXPORT_QUERY.format(columns=EXPORT_COLUMNS, filters=filters.sql('gh.'))
+    conn = pool.acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def export_rows(pool, filters, batch_size=EXPORT_BATCH_SIZE):
+    after = None
+    while True:
+        # On the native pool in gevent mode, like the game writer's flushes
+        rows = run_blocking(_fetch, pool, filters, after, batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]['date_of_game'], rows[-1]['gameid'])
+
+
+def format_pgn(row):
+    return row_pgn(row).strip() + '\n\n'
+
+
+def format_ndjson(row):
+    game = {key: row[key] for key in ('gameid', 'date_of_game', 'username_1', 'username_2', 'userid_1',
+                                      'userid_2', 'time_control', 'result', 'termination')}
+    moves = row['moves']
+    if moves is None and row['pgn']:
+        encoded = from_pgn(row['pgn'])
+        moves = encoded[0] if encoded else None
+    if moves is not None:
+        game['moves'] = [move.uci() for move in decode_moves(moves)]
+    else:
+        game['pgn'] = row['pgn']
+    return json.dumps(game, separators=(',', ':')) + '\n'
+
+
+def export_chunks(pool, filters, fmt, batch_size=EXPORT_BATCH_SIZE):
+    # One encoded chunk per batch
+    formatter = format_pgn if fmt == 'pgn' else format_ndjson
+    for rows in export_rows(pool, filters, batch_size):
+        yield ''.join(formatter(row) for row in rows).encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,338 @@
+import base64
+import json
+import os
+import queue
+import threading
+import time
+
+from concurrency import run_blocking
+from logs import get_logger
+from move_codec import decode_move, decode_moves, encode_move, encode_moves
+from tournament import Tournament
+
+log = get_logger('game_journal')
+
+# Append-only journal of the games in progress, so a restarted server can put
+# them back instead of ending them all. Socket threads only queue records; a
+# writer thread appends them to the current segment every flush interval
+# (one write, optionally fsynced, per batch) and applies them to its own copy
+# of the live-game table. Once a segment holds snapshot_records records the
+# table is written out as a snapshot and a new segment begins, so a restart
+# reads one snapshot, sized by the live games, plus at most one segment.
+#
+# Records are JSON arrays, one per line:
+#   ["s", gameId, white, black, game type, white clock, black clock, tournamentId or null]
+#   ["m", gameId, move, white clock, black clock]    16-bit move code, clocks after it
+#   ["e", gameId]
+# and for the tournaments the worker hosts:
+#   ["t", tournamentId, Tournament.to_dict()]        created
+#   ["tj", tournamentId, player, rating]             joined
+#   ["tw", tournamentId, player]                     withdrew
+#   ["ts", tournamentId, starts_at]                  started
+#   ["tp", tournamentId, round, bye or null]         Swiss round paired; its games follow as "s"
+#   ["tr", tournamentId, gameId, winner or null]     result recorded
+#   ["tc", tournamentId, [gameId, ...]]              games that never started
+#   ["tx", tournamentId]                             removed
+# A line cut short by a crash is skipped when the journal is read back. The
+# snapshot keeps each game's moves packed as in game_history.moves (base64),
+# and each tournament as Tournament.to_dict().
+
+SNAPSHOT = 'snapshot.json'
+SEGMENT = 'segment-{:08d}.log'
+
+# Queued by stop() so the writer notices shutdown without waiting out the interval
+_WAKE_UP = object()
+
+
+# A game as restored from the journal
+class SavedGame:
+    __slots__ = ('gameId', 'white', 'black', 'game_type', 'clocks', 'moves', 'tournament')
+
+    def __init__(self, gameId, white, black, game_type, clocks, moves, tournament=None):
+        # moves: chess.Move list; tournament: tournamentId, for a tournament game
+        self.gameId = gameId
+        self.white = white
+        self.black = black
+        self.game_type = game_type
+        self.clocks = clocks
+        self.moves = moves
+        self.tournament = tournament
+
+
+def _segment_number(name):
+    return int(name[len('segment-'):-len('.log')])
+
+
+def _segments(directory):
+    return sorted(_segment_number(name) for name in os.listdir(directory)
+                  if name.startswith('segment-') and name.endswith('.log'))
+
+
+def _apply(games, tournaments, record):
+    # games: gameId -> [white, black, game type, white clock, black clock, moves, tournamentId];
+    # tournaments: tournamentId -> Tournament
+    kind = record[0]
+    if kind == 'm':
+        game = games.get(record[1])
+        if game is not None:
+            game[3], game[4] = record[3], record[4]
+            game[5].append(record[2])
+    elif kind == 's':
+        # Records from before tournaments end at the black clock
+        tournamentId = record[7] if len(record) > 7 else None
+        games[record[1]] = [record[2], record[3], record[4], record[5], record[6], [], tournamentId]
+        if tournamentId in tournaments:
+            tournaments[tournamentId].resume_game(record[1], record[2], record[3])
+    elif kind == 'e':
+        games.pop(record[1], None)
+    elif kind == 't':
+        tournaments[record[1]] = Tournament.from_dict(record[2])
+    elif record[1] in tournaments:
+        tournament = tournaments[record[1]]
+        if kind == 'tj':
+            tournament.join(record[2], record[3])
+        elif kind == 'tw':
+            tournament.withdraw(record[2])
+        elif kind == 'ts':
+            tournament.start(record[2])
+        elif kind == 'tp':
+            tournament.replay_round(record[2], record[3])
+        elif kind == 'tr':
+            tournament.record(record[2], record[3])
+        elif kind == 'tc':
+            tournament.cancelled(record[2])
+        elif kind == 'tx':
+            del tournaments[record[1]]
+
+
+def _line(record):
+    if record[0] == 'm':
+        record = record[:2] + (encode_move(record[2]),) + record[3:]
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def read_journal(directory):
+    # The live-game and tournament tables as of the last flushed record, and the next segment number
+    games = {}
+    tournaments = {}
+    next_segment = 0
+    try:
+        with open(os.path.join(directory, SNAPSHOT)) as handle:
+            snapshot = json.load(handle)
+        next_segment = snapshot['segment']
+        games = {gameId: game[:5] + [list(decode_moves(base64.b64decode(game[5]))), game[6] if len(game) > 6 else None]
+                 for gameId, game in snapshot['games'].items()}
+        tournaments = {tournamentId: Tournament.from_dict(tournament)
+                       for tournamentId, tournament in snapshot.get('tournaments', {}).items()}
+    except FileNotFoundError:
+        pass
+    for number in _segments(directory):
+        if number < next_segment:
+            continue  # Already in the snapshot; left behind by a crash before cleanup
+        with open(os.path.join(directory, SEGMENT.format(number))) as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.warning('journal_torn_record', segment=number)
+                    break
+                if record[0] == 'm':
+                    record[2] = decode_move(record[2])
+                _apply(games, tournaments, record)
+        next_segment = number + 1
+    return games, tournaments, next_segment
+
+
+class GameJournal:
+    def __init__(self, directory, flush_interval_ms=100, snapshot_records=100000, fsync=False):
+        self.directory = directory
+        self.flush_interval = flush_interval_ms / 1000
+        self.snapshot_records = snapshot_records
+        self.fsync = fsync
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._games = {}
+        self._tournaments = {}
+        self._segment = 0
+        self._segment_records = 0
+        self._file = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'records': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'snapshots': 0,
+            'last_snapshot_ms': 0.0,
+            'max_snapshot_ms': 0.0,
+            'restored_games': 0,
+            'restored_tournaments': 0,
+            'restore_ms': 0.0,
+        }
+
+    def open(self):
+        # Read back the games and tournaments left by the previous run, then
+        # fold them into a fresh snapshot so the old segments can go. Returns
+        # (SavedGames, Tournaments); the Tournaments are the caller's own copies.
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        self._games, self._tournaments, next_segment = read_journal(self.directory)
+        # _snapshot() moves on to next_segment
+        self._segment = next_segment - 1
+        self._snapshot()
+        saved = [SavedGame(gameId, game[0], game[1], game[2], (game[3], game[4]), game[5], game[6])
+                 for gameId, game in self._games.items()]
+        tournaments = [Tournament.from_dict(tournament.to_dict()) for tournament in self._tournaments.values()]
+        with self._stats_lock:
+            self._stats['restored_games'] = len(saved)
+            self._stats['restored_tournaments'] = len(tournaments)
+            self._stats['restore_ms'] = (time.perf_counter() - start) * 1000
+        self._thread = threading.Thread(target=self._run, name='game-journal')
+        self._thread.daemon = True
+        self._thread.start()
+        return saved, tournaments
+
+    def started(self, gameId, white, black, game_type, clocks, tournamentId=None):
+        self._queue.put(('s', gameId, white, black, game_type, clocks[0], clocks[1], tournamentId))
+
+    def moved(self, gameId, move, clocks):
+        self._queue.put(('m', gameId, move, clocks[0], clocks[1]))
+
+    def ended(self, gameId):
+        self._queue.put(('e', gameId))
+
+    def tournament_created(self, tournament):
+        self._queue.put(('t', tournament.tournamentId, tournament.to_dict()))
+
+    def tournament_joined(self, tournamentId, player, rating):
+        self._queue.put(('tj', tournamentId, player, rating))
+
+    def tournament_withdrew(self, tournamentId, player):
+        self._queue.put(('tw', tournamentId, player))
+
+    def tournament_started(self, tournamentId, starts_at):
+        self._queue.put(('ts', tournamentId, starts_at))
+
+    def tournament_paired(self, tournamentId, number, bye):
+        self._queue.put(('tp', tournamentId, number, bye))
+
+    def tournament_recorded(self, tournamentId, gameId, winner):
+        self._queue.put(('tr', tournamentId, gameId, winner))
+
+    def tournament_cancelled(self, tournamentId, gameIds):
+        self._queue.put(('tc', tournamentId, list(gameIds)))
+
+    def tournament_removed(self, tournamentId):
+        self._queue.put(('tx', tournamentId))
+
+    def stop(self, timeout=10):
+        # Flush whatever is still queued, then let the thread exit
+        self._stopping.set()
+        self._queue.put(_WAKE_UP)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['live_games'] = len(self._games)
+        stats['tournaments'] = len(self._tournaments)
+        stats['segment_records'] = self._segment_records
+        return stats
+
+    def _collect(self):
+        # Block for the first record, then take everything queued within the interval
+        try:
+            records = [self._queue.get(timeout=None if not self._stopping.is_set() else 0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                records.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return [record for record in records if record is not _WAKE_UP]
+
+    def _run(self):
+        while True:
+            records = self._collect()
+            if records:
+                try:
+                    # On the native pool in gevent mode; the write and fsync must not stall the loop
+                    run_blocking(self._flush, records)
+                except Exception as e:
+                    # The records stay applied to the table, so the next snapshot still has them
+                    with self._stats_lock:
+                        self._stats['flush_errors'] += 1
+                    log.error('journal_write_failed', records=len(records), error=str(e))
+            elif self._stopping.is_set():
+                if self._file is not None:
+                    self._file.close()
+                return
+
+    def _flush(self, records):
+        for record in records:
+            _apply(self._games, self._tournaments, record)
+        self._file.write(''.join(_line(record) for record in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._segment_records += len(records)
+        with self._stats_lock:
+            self._stats['records'] += len(records)
+            self._stats['flushes'] += 1
+        if self._segment_records >= self.snapshot_records:
+            self._snapshot()
+
+    def _snapshot(self):
+        # Writes the table as of the end of the current segment, then moves to
+        # the next one. The rename makes the new snapshot visible atomically; a
+        # crash before it leaves the old snapshot and all segments in place.
+        start = time.perf_counter()
+        if self._file is not None:
+            self._file.close()
+        self._segment += 1
+        games = {gameId: game[:5] + [base64.b64encode(encode_moves(game[5])).decode('ascii'), game[6]]
+                 for gameId, game in self._games.items()}
+        tournaments = {tournamentId: tournament.to_dict() for tournamentId, tournament in self._tournaments.items()}
+        path = os.path.join(self.directory, SNAPSHOT)
+        with open(path + '.tmp', 'w') as handle:
+            json.dump({'segment': self._segment, 'games': games, 'tournaments': tournaments}, handle,
+                      separators=(',', ':'))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(path + '.tmp', path)
+        for number in _segments(self.directory):
+            if number < self._segment:
+                os.remove(os.path.join(self.directory, SEGMENT.format(number)))
+        self._file = open(os.path.join(self.directory, SEGMENT.format(self._segment)), 'a')
+        self._segment_records = 0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._stats['snapshots'] += 1
+            self._stats['last_snapshot_ms'] = elapsed_ms
+            self._stats['max_snapshot_ms'] = max(self._stats['max_snapshot_ms'], elapsed_ms)
+
+
+def journal_from_env(worker_id, distributed):
+    # GAME_JOURNAL_DIR='' turns journaling off. Workers of a cluster each keep
+    # their own journal, under their WORKER_ID.
+    directory = os.getenv('GAME_JOURNAL_DIR', 'journal')
+    if not directory:
+        return None
+    if distributed:
+        directory = os.path.join(directory, worker_id)
+    return GameJournal(directory,
+                       flush_interval_ms=int(os.getenv('GAME_JOURNAL_FLUSH_MS', 100)),
+                       snapshot_records=int(os.getenv('GAME_JOURNAL_SNAPSHOT_RECORDS', 100000)),
+                       fsync=os.getenv('GAME_JOURNAL_FSYNC', 'false').lower() == 'true')
@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import explorer
+import ratings
+from concurrency import run_blocking
+from logs import get_logger
+from move_codec import encode_moves
+
+log = get_logger('game_writer')
+
+INSERT_GAME = '''
+    INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn, moves, termination, date_of_game)
+    SELECT u1.userid, u2.userid, ?, ?, '', ?, ?, ?
+    FROM user u1, user u2
+    WHERE u1.email = ? AND u2.email = ?
+'''
+
+# Queued by stop() so the writer notices shutdown without waiting out the interval
+_WAKE_UP = object()
+
+
+# Everything needed to store a game once it has left active_games
+class FinishedGame:
+    __slots__ = ('white', 'black', 'time_control', 'result', 'reason', 'moves', 'finished_at')
+
+    def __init__(self, white, black, time_control, result, reason, moves, finished_at=None):
+        self.white = white
+        self.black = black
+        self.time_control = time_control
+        self.result = result
+        self.reason = reason
+        self.moves = list(moves)
+        self.finished_at = finished_at or datetime.now(timezone.utc)
+
+    def date_of_game(self):
+        # Same format as sqlite's CURRENT_TIMESTAMP
+        return self.finished_at.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Background thread that batches finished games into game_history.
+# submit() only enqueues, so socket handlers never wait on the database.
+class GameWriter:
+    def __init__(self, pool, batch_size=50, flush_interval_ms=500, max_attempts=3, on_flush=None):
+        self.pool = pool
+        # Called on the writer thread with each batch once it is committed;
+        # errors are logged, and the batch is not written again
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'games_written': 0,
+            'games_dropped': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'on_flush_errors': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='game-writer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, finished_game):
+        if self._thread is None:
+            self.start()
+        self._queue.put(finished_game)
+
+    def stop(self, timeout=10):
+        # Flush whatever is still queued, then let the thread exit
+        self._stopping.set()
+        self._queue.put(_WAKE_UP)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+    def _collect(self):
+        # Block for the first game, then gather until the batch is full or the interval ends
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if self._stopping.is_set():
+                    game = self._queue.get_nowait()
+                elif deadline is None:
+                    game = self._queue.get(timeout=self.flush_interval)
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    game = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if game is _WAKE_UP:
+                continue
+            batch.append(game)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    def _run(self):
+        pending = []
+        attempts = 0
+        while True:
+            if not pending:
+                pending = self._collect()
+                attempts = 0
+            if pending:
+                try:
+                    # On the native pool in gevent mode; the commit must not stall the loop
+                    run_blocking(self._flush, pending)
+                except Exception as e:
+                    attempts += 1
+                    with self._stats_lock:
+                        self._stats['flush_errors'] += 1
+                    log.error('game_save_failed', games=len(pending), attempt=attempts, error=str(e))
+                    if attempts >= self.max_attempts:
+                        with self._stats_lock:
+                            self._stats['games_dropped'] += len(pending)
+                        pending = []
+                    elif not self._stopping.is_set():
+                        time.sleep(self.flush_interval)
+                    continue
+                # Committed: a failing callback must not send the batch round again
+                flushed, pending = pending, []
+                if self.on_flush is not None:
+                    try:
+                        self.on_flush(flushed)
+                    except Exception:
+                        with self._stats_lock:
+                            self._stats['on_flush_errors'] += 1
+                        log.exception('on_flush_failed', games=len(flushed))
+            elif self._stopping.is_set() and self._queue.empty():
+                return
+
+    def _flush(self, batch):
+        rows = [(game.time_control, game.result, encode_moves(game.moves), game.reason, game.date_of_game(), game.white, game.black)
+                for game in batch]
+        start = time.perf_counter()
+
+        def write(conn):
+            # One transaction for the whole batch, player_stats and opening_stats included
+            cur = conn.cursor()
+            cur.executemany(INSERT_GAME, rows)
+            ratings.record_games(cur, [(game.white, game.black, game.time_control, game.result) for game in batch])
+            explorer.record_games(cur, [(game.moves, game.result) for game in batch])
+        # A busy database reruns the whole transaction, not the statement that hit it
+        self.pool.run_transaction(write)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._stats['games_written'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
@@ -0,0 +1,131 @@
+import threading
+import time
+
+from logs import get_logger
+from metrics import Histogram
+
+log = get_logger('lag_compensation')
+
+# Network lag is not the player's thinking time.
+#
+# LagTracker pings every connection it tracks once per interval with a
+# Socket.IO event the client acknowledges straight away; the time to the ack
+# is a sample of that connection's round trip. Samples are capped and smoothed,
+# so one stalled ack doesn't swing the estimate. Connections with a backed-up
+# send queue are skipped: the ping would measure the queue.
+#
+# A move reaches the server a round trip after the opponent's move left it:
+# half of it on the way to the player, half on the way back. LagQuota credits
+# the round trip back to the mover's clock, but only out of an allowance that
+# refills by gain_ms per move up to max_ms. A client that delays its acks to
+# fake a slow line gains no more than max_ms, plus gain_ms a move.
+
+LAG_SAMPLES = Histogram('gochess_lag_rtt_seconds', 'Round trips measured by lag pings')
+LAG_CREDITED = Histogram('gochess_lag_credit_seconds', 'Lag credited back to a clock per move',
+                         buckets=(0, .01, .025, .05, .1, .25, .5, 1))
+
+
+def wall_ms():
+    # Timestamp clients compare their own clock against; clocks themselves run on time.monotonic
+    return int(time.time() * 1000)
+
+
+class LagTracker:
+    def __init__(self, socketio, interval=5.0, max_sample_ms=2000, smoothing=0.25, backlog=None, namespace='/'):
+        self.socketio = socketio
+        self.interval = interval
+        self.max_sample_ms = max_sample_ms
+        self.smoothing = smoothing
+        # OutgoingBacklog whose lagging connections are skipped, if any
+        self.backlog = backlog
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        # sid -> smoothed round trip in ms, None until the first ack
+        self._rtt = {}
+        self._running = False
+        self._stats = {'pings': 0, 'acks': 0, 'skipped': 0}
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        self._running = False
+
+    def track(self, sid):
+        with self._lock:
+            self._rtt.setdefault(sid, None)
+
+    def forget(self, sid):
+        with self._lock:
+            self._rtt.pop(sid, None)
+
+    def rtt_ms(self, sid):
+        # Smoothed round trip of the connection, 0 if it hasn't answered a ping yet
+        with self._lock:
+            return round(self._rtt.get(sid) or 0)
+
+    def stats(self):
+        with self._lock:
+            measured = sorted(rtt for rtt in self._rtt.values() if rtt is not None)
+            stats = dict(self._stats, connections=len(self._rtt), measured=len(measured))
+        stats['median_rtt_ms'] = round(measured[len(measured) // 2]) if measured else None
+        return stats
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.interval)
+            try:
+                self._ping_all()
+            except Exception:
+                log.exception('lag_ping_failed')
+
+    def _ping_all(self):
+        with self._lock:
+            sids = list(self._rtt)
+        skipped = set(self.backlog.lagging(sids, 'lag_ping')) if self.backlog is not None else ()
+        pings = 0
+        for sid in sids:
+            if sid in skipped:
+                continue
+            sent = time.monotonic()
+            self.socketio.emit('lag_ping', {'server_time': wall_ms()}, to=sid, namespace=self.namespace,
+                               callback=lambda *args, sid=sid, sent=sent: self._acked(sid, sent))
+            pings += 1
+        with self._lock:
+            self._stats['pings'] += pings
+            self._stats['skipped'] += len(skipped)
+
+    def _acked(self, sid, sent):
+        sample = min((time.monotonic() - sent) * 1000, self.max_sample_ms)
+        LAG_SAMPLES.observe(sample / 1000)
+        with self._lock:
+            self._stats['acks'] += 1
+            if sid not in self._rtt:
+                return  # Disconnected meanwhile
+            previous = self._rtt[sid]
+            self._rtt[sid] = sample if previous is None else previous + self.smoothing * (sample - previous)
+
+
+class LagQuota:
+    # One player's lag allowance within a game
+    __slots__ = ('available', 'gain', 'cap', 'credited')
+
+    def __init__(self, gain_ms, max_ms):
+        self.available = max_ms
+        self.gain = gain_ms
+        self.cap = max_ms
+        self.credited = 0
+
+    def credit(self, lag_ms, elapsed_ms):
+        # Milliseconds of elapsed_ms not charged to the player, taken from the allowance
+        credit = max(0, min(lag_ms, self.available, elapsed_ms))
+        self.available = min(self.cap, self.available - credit + self.gain)
+        self.credited += credit
+        LAG_CREDITED.observe(credit / 1000)
+        return credit
+
+    def grace(self, lag_ms):
+        # How far past the deadline a move may still arrive and be credited back under it
+        return max(0, min(lag_ms, self.available))
@@ -0,0 +1,188 @@
+import os
+import time
+from collections import OrderedDict
+
+from metrics import timed_lock
+
+
+# Waiting players for one time control.
+# Without bucket_size the queue is plain first-come pairing. With it, players are
+# grouped into rating buckets and only paired when their ratings fall inside the
+# allowed window, which widens the longer a player has been waiting; sweep()
+# must then be called every so often to pair players whose windows have grown.
+class MatchQueue:
+    def __init__(self, bucket_size=None, base_window=100, widen_per_sec=10, max_window=400):
+        self.bucket_size = bucket_size
+        self.base_window = base_window
+        self.widen_per_sec = widen_per_sec
+        self.max_window = max_window
+        self.lock = timed_lock('match_queue')
+        # player -> (rating, enqueued_at, bucket)
+        self._entries = {}
+        # bucket -> OrderedDict of players in arrival order; FIFO mode uses bucket None only
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, player):
+        return player in self._entries
+
+    def players(self):
+        with self.lock:
+            return list(self._entries)
+
+    def window(self, enqueued_at, now):
+        return min(self.max_window, self.base_window + self.widen_per_sec * (now - enqueued_at))
+
+    def _bucket_of(self, rating):
+        if self.bucket_size is None or rating is None:
+            return None
+        return int(rating // self.bucket_size)
+
+    def _add(self, player, rating, now):
+        bucket = self._bucket_of(rating)
+        self._entries[player] = (rating, now, bucket)
+        self._buckets.setdefault(bucket, OrderedDict())[player] = None
+
+    def _remove(self, player):
+        rating, enqueued_at, bucket = self._entries.pop(player)
+        waiting = self._buckets[bucket]
+        del waiting[player]
+        if not waiting:
+            del self._buckets[bucket]
+
+    def _compatible(self, rating, window, candidate, now):
+        other_rating, other_since, _ = self._entries[candidate]
+        if rating is None or other_rating is None:
+            return True
+        # The more patient of the two decides how far apart they may be
+        allowed = max(window, self.window(other_since, now))
+        return abs(rating - other_rating) <= allowed
+
+    def _find_opponent(self, player, rating, window, now):
+        bucket = self._bucket_of(rating)
+        if bucket is None:
+            # Longest waiting player overall (first-come pairing)
+            best = None
+            for waiting in self._buckets.values():
+                candidate = next(iter(waiting))
+                if best is None or self._entries[candidate][1] < self._entries[best][1]:
+                    best = candidate
+            return best
+
+        # Only the head (longest waiting) of each nearby bucket is considered,
+        # so a lookup costs O(max_window / bucket_size) whatever the queue length
+        best = None
+        best_since = None
+        reach = int(self.max_window // self.bucket_size) + 1
+        for other_bucket in range(bucket - reach, bucket + reach + 1):
+            waiting = self._buckets.get(other_bucket)
+            if not waiting:
+                continue
+            for candidate in waiting:
+                if candidate == player:
+                    continue
+                since = self._entries[candidate][1]
+                if (best_since is None or since < best_since) and self._compatible(rating, window, candidate, now):
+                    best, best_since = candidate, since
+                break
+        return best
+
+    def match_or_enqueue(self, player, rating=None, now=None):
+        # Pair the player with someone waiting, or queue them. Returns the opponent or None.
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if player in self._entries:
+                return None
+            opponent = self._find_opponent(player, rating, self.base_window, now)
+            if opponent is None:
+                self._add(player, rating, now)
+                return None
+            self._remove(opponent)
+            return opponent
+
+    def pop_oldest(self):
+        with self.lock:
+            oldest = self._find_opponent(None, None, None, None)
+            if oldest is not None:
+                self._remove(oldest)
+            return oldest
+
+    def cancel(self, player):
+        with self.lock:
+            if player not in self._entries:
+                return False
+            self._remove(player)
+            return True
+
+    def sweep(self, now=None):
+        # Pair players whose windows have widened enough since they queued.
+        # Returns the list of (player, opponent) pairs taken out of the queue.
+        if self.bucket_size is None:
+            return []
+        now = time.monotonic() if now is None else now
+        pairs = []
+        with self.lock:
+            # Longest waiting bucket heads get first pick
+            heads = sorted((self._entries[next(iter(waiting))][1], bucket)
+                           for bucket, waiting in self._buckets.items())
+            for _, bucket in heads:
+                waiting = self._buckets.get(bucket)
+                if not waiting:
+                    continue
+                player = next(iter(waiting))
+                rating, since, _ = self._entries[player]
+                opponent = self._find_opponent(player, rating, self.window(since, now), now)
+                if opponent is not None:
+                    self._remove(player)
+                    self._remove(opponent)
+                    pairs.append((player, opponent))
+        return pairs
+
+
+# One MatchQueue (and therefore one lock) per time control
+class Matchmaker:
+    def __init__(self, game_types, **queue_options):
+        self.queues = {game_type: MatchQueue(**queue_options) for game_type in game_types}
+
+    def get_queue(self, game_type):
+        queue = self.queues.get(game_type)
+        if queue is None:
+            raise Exception("No such gameType")
+        return queue
+
+    @property
+    def rated(self):
+        # Whether join() wants the player's rating and sweep() has anything to do
+        return any(queue.bucket_size is not None for queue in self.queues.values())
+
+    def join(self, player, game_type, rating=None):
+        return self.get_queue(game_type).match_or_enqueue(player, rating)
+
+    def cancel(self, player, game_type=None):
+        # Remove the player from one queue, or from every queue when no type is given
+        game_types = [game_type] if game_type else list(self.queues)
+        return [gt for gt in game_types if self.get_queue(gt).cancel(player)]
+
+    def depth(self, game_type):
+        return len(self.get_queue(game_type))
+
+    def sweep(self, now=None):
+        # [(game_type, player, opponent)] paired since their windows widened
+        return [(game_type, player, opponent) for game_type, queue in self.queues.items()
+                for player, opponent in queue.sweep(now)]
+
+
+def queue_options_from_env():
+    # MatchQueue options. MATCH_RATING_BUCKET (rating points per bucket) turns
+    # on rating-window pairing; unset, the queues are first come, first paired.
+    bucket_size = os.getenv('MATCH_RATING_BUCKET')
+    if not bucket_size:
+        return {}
+    return {
+        'bucket_size': float(bucket_size),
+        'base_window': float(os.getenv('MATCH_BASE_WINDOW', 100)),
+        'widen_per_sec': float(os.getenv('MATCH_WIDEN_PER_SEC', 10)),
+        'max_window': float(os.getenv('MATCH_MAX_WINDOW', 400)),
+    }
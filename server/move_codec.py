@@ -0,0 +1,167 @@
+import argparse
+import io
+import sqlite3
+import sys
+import time
+from array import array
+
+import chess
+import chess.pgn
+
+# Moves stored as 16 bits each in game_history.moves:
+#   bits 0-5 from square, 6-11 to square, 12-14 promotion piece type (0 = none)
+# Games always start from the standard position, so the move list is the
+# whole game; PGN and SAN are rebuilt from it only when someone asks.
+
+PGN_RESULTS = {0: '1/2-1/2', 1: '1-0', 2: '0-1'}
+
+# Stored little-endian
+_BYTESWAP = sys.byteorder == 'big'
+
+
+def encode_move(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code):
+    promotion = (code >> 12) & 7
+    return chess.Move(code & 63, (code >> 6) & 63, promotion or None)
+
+
+def encode_moves(moves):
+    codes = array('H', (encode_move(move) for move in moves))
+    if _BYTESWAP:
+        codes.byteswap()
+    return codes.tobytes()
+
+
+def decode_moves(blob):
+    codes = array('H')
+    codes.frombytes(blob)
+    if _BYTESWAP:
+        codes.byteswap()
+    return [decode_move(code) for code in codes]
+
+
+def to_san(blob):
+    board = chess.Board()
+    return [board.san_and_push(move) for move in decode_moves(blob)]
+
+
+def _pgn_header(name, value):
+    return '[{} "{}"]'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def to_pgn(blob, white, black, time_control, result, termination=None, date_of_game=None):
+    # Same text as python-chess's exporter (plus quote escaping in headers),
+    # written straight from the SAN list rather than through a GameNode tree,
+    # which is over twice as fast
+    # date_of_game is sqlite's 'YYYY-MM-DD HH:MM:SS'
+    headers = [
+        ('Event', f'Gochess {time_control} game'),
+        ('Site', 'Gochess'),
+        ('Date', date_of_game[:10].replace('-', '.') if date_of_game else '????.??.??'),
+        ('Round', '?'),
+        ('White', white),
+        ('Black', black),
+        ('Result', PGN_RESULTS[result]),
+        ('TimeControl', time_control),
+    ]
+    if termination:
+        headers.append(('Termination', termination))
+    tokens = []
+    for ply, san in enumerate(to_san(blob)):
+        if ply % 2 == 0:
+            tokens.append(f'{ply // 2 + 1}.')
+        tokens.append(san)
+    tokens.append(PGN_RESULTS[result])
+    return '\n'.join([_pgn_header(name, value) for name, value in headers] + ['', ' '.join(tokens)])
+
+
+def row_pgn(row):
+    # PGN of a game_history/GAME_VIEW row: the stored text if it still has
+    # it (games from before the moves column), else rebuilt from moves
+    if row['pgn']:
+        return row['pgn']
+    return to_pgn(row['moves'], row['username_1'], row['username_2'], row['time_control'], row['result'],
+                  row['termination'], row['date_of_game'])
+
+
+def from_pgn(text):
+    # (moves blob, termination) for a stored PGN, or None if it doesn't parse
+    game = chess.pgn.read_game(io.StringIO(text))
+    if game is None or game.errors or game.headers.get('FEN'):
+        return None
+    return encode_moves(game.mainline_moves()), game.headers.get('Termination')
+
+
+def migrate(conn, batch_size=500):
+    # Fills in moves for rows that only have PGN text, one batch per
+    # transaction so the game writer isn't locked out for long. The PGN text
+    # stays: drop_pgn() clears it separately, once the conversion is checked.
+    converted = skipped = 0
+    last_gameid = 0
+    while True:
+        rows = conn.execute('SELECT gameid, pgn FROM game_history WHERE gameid > ? AND moves IS NULL '
+                            'ORDER BY gameid LIMIT ?', (last_gameid, batch_size)).fetchall()
+        if not rows:
+            return converted, skipped
+        updates = []
+        for gameid, pgn in rows:
+            encoded = from_pgn(pgn) if pgn else None
+            if encoded is None:
+                skipped += 1
+            else:
+                updates.append(encoded + (gameid,))
+        conn.executemany('UPDATE game_history SET moves = ?, termination = ? WHERE gameid = ?', updates)
+        conn.commit()
+        converted += len(updates)
+        last_gameid = rows[-1][0]
+
+
+def drop_pgn(conn, batch_size=500):
+    # Clears the PGN text of migrated rows whose moves still match it. Loses
+    # whatever the text had beyond the moves and termination (other headers,
+    # comments, variations), so it is a separate step. Returns (dropped, mismatched).
+    dropped = mismatched = 0
+    last_gameid = 0
+    while True:
+        rows = conn.execute("SELECT gameid, pgn, moves FROM game_history WHERE gameid > ? AND moves IS NOT NULL "
+                            "AND pgn != '' ORDER BY gameid LIMIT ?", (last_gameid, batch_size)).fetchall()
+        if not rows:
+            return dropped, mismatched
+        matching = []
+        for gameid, pgn, moves in rows:
+            encoded = from_pgn(pgn)
+            if encoded is not None and encoded[0] == moves:
+                matching.append((gameid,))
+            else:
+                mismatched += 1
+        conn.executemany("UPDATE game_history SET pgn = '' WHERE gameid = ?", matching)
+        conn.commit()
+        dropped += len(matching)
+        last_gameid = rows[-1][0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert stored PGN text to packed moves')
+    parser.add_argument('command', choices=['migrate', 'drop-pgn'],
+                        help='migrate: fill in moves, keeping the PGN text; drop-pgn: then clear the PGN text '
+                             'of rows whose moves match it (headers and comments are lost)')
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--vacuum', action='store_true', help='reclaim the freed pages afterwards (drop-pgn)')
+    args = parser.parse_args()
+    # Adds the moves/termination columns to chess.db if it predates them
+    import buildDatabase
+    started = time.perf_counter()
+    conn = sqlite3.connect('chess.db')
+    if args.command == 'migrate':
+        converted, skipped = migrate(conn, args.batch)
+        summary = f"Converted {converted} games, left {skipped} as PGN only"
+    else:
+        dropped, mismatched = drop_pgn(conn, args.batch)
+        summary = f"Dropped the PGN text of {dropped} games, kept {mismatched} that don't match their moves"
+    if args.vacuum:
+        conn.execute('VACUUM')
+    conn.close()
+    print(f"{summary}, in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,170 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from concurrency import exit_with_parent
+
+# Flask-Bcrypt's default work factor; hashes it stored verify unchanged
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 15
+
+
+class HasherBusy(Exception):
+    # Raised instead of queueing when too many hashes are already waiting
+    pass
+
+
+# Run in the pool's worker processes
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def hash_rounds(hashed):
+    # Work factor recorded in a bcrypt hash: $2b$12$...
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def calibrate_rounds(target_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    # Highest work factor whose hash takes at most target_ms on this machine.
+    # Each extra round doubles the cost, so one timing at min_rounds is enough.
+    start = time.perf_counter()
+    _hash('calibration', min_rounds)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+# bcrypt on a bounded pool of worker processes, so a login storm burns CPU
+# outside the server process instead of holding up socket traffic. At most
+# max_pending hashes are queued or running; beyond that callers get HasherBusy.
+# A dead worker (BrokenProcessPool) or a hash past timeout (TimeoutError) is
+# raised to the caller after the pool is replaced for the next one.
+# workers=0 hashes on the calling thread (still bounded by max_pending).
+class PasswordHasher:
+    def __init__(self, workers=1, max_pending=32, rounds=DEFAULT_ROUNDS, timeout=30):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {'hashed': 0, 'checked': 0, 'rehashed': 0, 'rejected_busy': 0, 'failed': 0,
+                       'pending': 0}
+
+    def start(self):
+        # Fork the workers now, while the server has few threads
+        if self.workers:
+            executor = self._get_executor()
+            for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+                future.result()
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'),
+                                                     initializer=exit_with_parent, initargs=(os.getpid(),))
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected_busy'] += 1
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            with self._lock:
+                self._stats['pending'] += 1
+            if not self.workers:
+                return fn(*args)
+            executor = self._get_executor()
+            try:
+                return executor.submit(fn, *args).result(self.timeout)
+            except (BrokenProcessPool, TimeoutError):
+                # A worker died or is stuck; start a fresh pool for the next caller
+                with self._lock:
+                    self._stats['failed'] += 1
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        finally:
+            with self._lock:
+                self._stats['pending'] -= 1
+            self._slots.release()
+
+    def hash(self, password):
+        hashed = self._run(_hash, password, self.rounds)
+        with self._lock:
+            self._stats['hashed'] += 1
+        return hashed
+
+    def check(self, hashed, password):
+        ok = self._run(_check, hashed, password)
+        with self._lock:
+            self._stats['checked'] += 1
+        return ok
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def verify(self, hashed, password):
+        # Returns (ok, new_hash); new_hash is set when the stored hash used
+        # another work factor and should replace it
+        if not self.check(hashed, password):
+            return False, None
+        if not self.needs_rehash(hashed):
+            return True, None
+        try:
+            new_hash = self.hash(password)
+        except (HasherBusy, BrokenProcessPool, TimeoutError):
+            # Upgrade on a later login instead of failing this one
+            return True, None
+        with self._lock:
+            self._stats['rehashed'] += 1
+        return True, new_hash
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, workers=self.workers, rounds=self.rounds, max_pending=self.max_pending)
+
+
+def hasher_from_env():
+    # BCRYPT_ROUNDS fixes the work factor; otherwise BCRYPT_TARGET_MS picks the
+    # highest one that hashes within that time here, else Flask-Bcrypt's 12
+    rounds = os.getenv('BCRYPT_ROUNDS')
+    if rounds:
+        rounds = int(rounds)
+    elif os.getenv('BCRYPT_TARGET_MS'):
+        rounds = calibrate_rounds(float(os.getenv('BCRYPT_TARGET_MS')))
+    else:
+        rounds = DEFAULT_ROUNDS
+    workers = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+    return PasswordHasher(workers=workers,
+                          max_pending=int(os.getenv('PASSWORD_HASH_QUEUE', 32)),
+                          rounds=rounds)
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+import chess
+
+STATUS_CHECKMATE = 'Checkmate'
+STATUS_STALEMATE = 'Stalemate'
+STATUS_INSUFFICIENT_MATERIAL = 'Insufficient Material'
+
+
+def position_key(board):
+    # Exact key for everything that affects move legality: piece placement,
+    # side to move, castling rights and en passant square. Built from the
+    # board's bitboards, it costs about a microsecond, where a polyglot Zobrist
+    # hash is computed square by square in Python.
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK],
+            board.turn, board.castling_rights, board.ep_square)
+
+
+def terminal_status(board):
+    # One legal-move probe answers both stalemate and checkmate
+    if not any(board.generate_legal_moves()):
+        return STATUS_CHECKMATE if board.is_check() else STATUS_STALEMATE
+    if board.is_insufficient_material():
+        return STATUS_INSUFFICIENT_MATERIAL
+    return None
+
+
+# What is known about one position: its game-end status and the moves
+# already confirmed legal from it (filled in as players make them)
+class PositionEntry:
+    __slots__ = ('status', 'legal_moves')
+
+    def __init__(self, status):
+        self.status = status
+        # Allocated on first confirmed move; most positions are only reached once
+        self.legal_moves = None
+
+    def is_legal(self, board, move):
+        # board must be the position this entry was looked up for
+        if self.legal_moves is not None and move in self.legal_moves:
+            return True
+        if board.is_legal(move):
+            if self.legal_moves is None:
+                self.legal_moves = set()
+            self.legal_moves.add(move)
+            return True
+        return False
+
+
+# Process-wide bounded LRU of positions shared by every game
+class PositionCache:
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, board):
+        key = position_key(board)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Computed outside the lock; a concurrent miss on the same key just does the work twice
+        entry = PositionEntry(terminal_status(board))
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
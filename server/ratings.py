@@ -0,0 +1,149 @@
+import argparse
+import sqlite3
+import time
+
+# Per-player, per-time-control records and Elo ratings in player_stats.
+# GameWriter applies each flushed batch in the transaction that inserts it,
+# so player_stats always matches game_history; rebuild() recomputes the table
+# from scratch in gameid order, which is the order the writer applied them.
+
+INITIAL_RATING = 1500.0
+# Larger steps while a player's rating is still provisional
+PROVISIONAL_GAMES = 30
+K_PROVISIONAL = 40
+K_ESTABLISHED = 20
+
+# game_history.result values
+RESULT_DRAW = 0
+RESULT_WHITE_WINS = 1  # userid_1 plays white
+RESULT_BLACK_WINS = 2
+
+STATS_COLUMNS = ('games', 'wins', 'draws', 'losses', 'rating')
+
+SELECT_STATS = 'SELECT userid, time_control, games, wins, draws, losses, rating FROM player_stats WHERE userid IN ({})'
+
+UPSERT_STATS = '''
+    INSERT INTO player_stats (userid, time_control, games, wins, draws, losses, rating)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (userid, time_control) DO UPDATE SET
+        games = excluded.games, wins = excluded.wins, draws = excluded.draws,
+        losses = excluded.losses, rating = excluded.rating
+'''
+
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def k_factor(games):
+    return K_PROVISIONAL if games < PROVISIONAL_GAMES else K_ESTABLISHED
+
+
+# In-memory (userid, time_control) -> [games, wins, draws, losses, rating]
+# that games are applied to in order
+class StatsBook:
+    def __init__(self):
+        self.rows = {}
+        self.changed = set()
+
+    def load(self, cur, userids):
+        userids = list(set(userids))
+        if userids:
+            cur.execute(SELECT_STATS.format(','.join('?' * len(userids))), userids)
+            for row in cur.fetchall():
+                self.rows[(row[0], row[1])] = list(row[2:])
+
+    def get(self, userid, time_control):
+        key = (userid, time_control)
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = [0, 0, 0, 0, INITIAL_RATING]
+        return row
+
+    def apply(self, white, black, time_control, result):
+        if white == black:
+            return
+        w = self.get(white, time_control)
+        b = self.get(black, time_control)
+        score = {RESULT_WHITE_WINS: 1.0, RESULT_DRAW: 0.5, RESULT_BLACK_WINS: 0.0}[result]
+        expected = expected_score(w[4], b[4])
+        # Each side moves by its own K, so a new player doesn't swing an established one
+        w_delta = k_factor(w[0]) * (score - expected)
+        b_delta = k_factor(b[0]) * (expected - score)
+        for row, delta, outcome in ((w, w_delta, score), (b, b_delta, 1.0 - score)):
+            row[0] += 1
+            row[1 if outcome == 1.0 else 2 if outcome == 0.5 else 3] += 1
+            row[4] += delta
+        self.changed.add((white, time_control))
+        self.changed.add((black, time_control))
+
+    def changed_rows(self):
+        return [key + tuple(self.rows[key]) for key in self.changed]
+
+
+def record_games(cur, games):
+    # games: (white email, black email, time_control, result) in insertion order.
+    # Must run after the game_history INSERT in the same transaction: that
+    # statement takes the write lock, so the ratings read here can't go stale.
+    emails = list({email for game in games for email in game[:2]})
+    if not emails:
+        return
+    cur.execute(f"SELECT email, userid FROM user WHERE email IN ({','.join('?' * len(emails))})", emails)
+    userids = {row[0]: row[1] for row in cur.fetchall()}
+    book = StatsBook()
+    book.load(cur, userids.values())
+    for white, black, time_control, result in games:
+        # The INSERT skipped games whose players no longer exist, so skip them here too
+        if white in userids and black in userids:
+            book.apply(userids[white], userids[black], time_control, result)
+    cur.executemany(UPSERT_STATS, book.changed_rows())
+
+
+def stats_for_user(cur, userid):
+    cur.execute('SELECT time_control, games, wins, draws, losses, rating FROM player_stats WHERE userid = ?',
+                (userid,))
+    return {row[0]: stats_dict(row[1:]) for row in cur.fetchall()}
+
+
+def stats_dict(values):
+    stats = dict(zip(STATS_COLUMNS, values))
+    stats['rating'] = round(stats['rating'])
+    return stats
+
+
+def default_stats():
+    return stats_dict((0, 0, 0, 0, INITIAL_RATING))
+
+
+def rebuild(conn):
+    # One pass over game_history in insertion order; the table is replaced in a
+    # single transaction, so readers see either the old or the new ratings
+    book = StatsBook()
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        games = 0
+        for white, black, time_control, result in conn.execute(
+                'SELECT userid_1, userid_2, time_control, result FROM game_history ORDER BY gameid'):
+            book.apply(white, black, time_control, result)
+            games += 1
+        cur.execute('DELETE FROM player_stats')
+        cur.executemany(UPSERT_STATS, book.changed_rows())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return games, len(book.changed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute player_stats from game_history')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.parse_args()
+    # Creates player_stats in chess.db if it predates the table
+    import buildDatabase
+    started = time.perf_counter()
+    conn = sqlite3.connect('chess.db')
+    games, rows = rebuild(conn)
+    conn.close()
+    print(f"Rebuilt {rows} player_stats rows from {games} games in {time.perf_counter() - started:.2f}s")
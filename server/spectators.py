@@ -0,0 +1,223 @@
+import threading
+import time
+
+import chess
+
+from logs import get_logger
+
+log = get_logger('spectators')
+
+
+def spectator_room(gameId):
+    return f'spectate:{gameId}'
+
+
+# Moves and clocks waiting for the next spectator flush of one game
+class PendingUpdate:
+    __slots__ = ('game', 'from_ply', 'moves', 'clocks', 'turn', 'result')
+
+    def __init__(self, game, from_ply):
+        self.game = game
+        self.from_ply = from_ply
+        self.moves = []
+        self.clocks = None
+        self.turn = None
+        self.result = None
+
+
+# Sends game updates to spectators on its own thread.
+# Players publish into a per-game pending batch (a dict update under a short lock),
+# and every interval each game's batch goes out as a single emit to its spectator
+# room, so the players' move path does not grow with the number of spectators.
+# Spectators whose connection has a backlog (OutgoingBacklog.lagging) are left
+# out of the batches; once their queue drains they get the full position
+# instead of the moves they missed. A batch longer than max_batch is replaced by
+# the full position for the whole room.
+class SpectatorFanout:
+    def __init__(self, socketio, interval_ms=250, max_batch=20, namespace='/', backlog=None):
+        self.socketio = socketio
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self.namespace = namespace
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._pending = {}
+        # gameId -> set of spectator sids, sid -> set of gameIds
+        self._spectators = {}
+        self._watching = {}
+        # gameId -> (game, sids left out of a batch), waiting for a snapshot
+        self._behind = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+        self.batches_sent = 0
+        self.snapshots_sent = 0
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='spectator-fanout')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+    def subscribe(self, sid, gameId):
+        self.socketio.server.enter_room(sid, spectator_room(gameId), namespace=self.namespace)
+        with self._lock:
+            self._spectators.setdefault(gameId, set()).add(sid)
+            self._watching.setdefault(sid, set()).add(gameId)
+        if not self._running:
+            self.start()
+
+    def unsubscribe(self, sid, gameId):
+        self.socketio.server.leave_room(sid, spectator_room(gameId), namespace=self.namespace)
+        with self._lock:
+            self._forget(sid, gameId)
+
+    def unsubscribe_all(self, sid):
+        # Called on disconnect; socketio drops the rooms itself
+        with self._lock:
+            for gameId in list(self._watching.get(sid, ())):
+                self._forget(sid, gameId)
+
+    def _forget(self, sid, gameId):
+        behind = self._behind.get(gameId)
+        if behind:
+            behind[1].discard(sid)
+            if not behind[1]:
+                del self._behind[gameId]
+        spectators = self._spectators.get(gameId)
+        if spectators:
+            spectators.discard(sid)
+            if not spectators:
+                del self._spectators[gameId]
+        games = self._watching.get(sid)
+        if games:
+            games.discard(gameId)
+            if not games:
+                del self._watching[sid]
+
+    def count(self, gameId):
+        with self._lock:
+            return len(self._spectators.get(gameId, ()))
+
+    def counts(self):
+        with self._lock:
+            return {gameId: len(sids) for gameId, sids in self._spectators.items()}
+
+    def publish_move(self, game, ply, move, clocks, turn):
+        with self._lock:
+            if game.gameId not in self._spectators:
+                return
+            pending = self._pending.get(game.gameId)
+            if pending is None:
+                pending = self._pending[game.gameId] = PendingUpdate(game, ply)
+            pending.moves.append(move)
+            pending.clocks = clocks
+            pending.turn = turn
+
+    def publish_game_over(self, game, result):
+        with self._lock:
+            if game.gameId not in self._spectators:
+                return
+            pending = self._pending.get(game.gameId)
+            if pending is None:
+                pending = self._pending[game.gameId] = PendingUpdate(game, None)
+            pending.result = result
+        self._wake.set()
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for gameId, update in pending.items():
+                try:
+                    self._flush(gameId, update)
+                except Exception:
+                    log.exception('spectator_update_failed', gameId=gameId)
+            try:
+                self._catch_up()
+            except Exception:
+                log.exception('spectator_catch_up_failed')
+
+    def _flush(self, gameId, update):
+        room = spectator_room(gameId)
+        if update.moves:
+            if len(update.moves) > self.max_batch:
+                # Too many moves to replay; skip straight to the current position
+                self.socketio.emit('spectator_state', snapshot(update.game), to=room, namespace=self.namespace)
+                self.snapshots_sent += 1
+                with self._lock:
+                    self._behind.pop(gameId, None)
+            else:
+                lagging = self._lagging(update.game, gameId)
+                self.socketio.emit('spectator_moves', {
+                    'gameId': gameId,
+                    'from_ply': update.from_ply,
+                    'moves': update.moves,
+                    **update.clocks,
+                    'turn': update.turn,
+                    'sent_at': time.time(),
+                }, to=room, skip_sid=lagging or None, namespace=self.namespace)
+                self.batches_sent += 1
+        if update.result is not None:
+            self.socketio.emit('game_over', dict(update.result, gameId=gameId), to=room, namespace=self.namespace)
+
+    def _lagging(self, game, gameId):
+        # Spectators of gameId to leave out of this batch; they are owed a snapshot
+        if self.backlog is None:
+            return []
+        with self._lock:
+            behind = set(self._behind[gameId][1]) if gameId in self._behind else ()
+            sids = list(self._spectators.get(gameId, ()))
+        # Those that missed a batch already stay out: the moves alone would leave a gap
+        lagging = set(self.backlog.lagging([sid for sid in sids if sid not in behind], 'spectator_moves'))
+        lagging.update(behind)
+        if lagging:
+            with self._lock:
+                self._behind.setdefault(gameId, (game, set()))[1].update(
+                    sid for sid in lagging if sid in self._spectators.get(gameId, ()))
+        return list(lagging)
+
+    def _catch_up(self):
+        # Send the current position to spectators whose backlog has drained
+        with self._lock:
+            behind = [(gameId, game, list(sids)) for gameId, (game, sids) in self._behind.items()]
+        for gameId, game, sids in behind:
+            caught_up = [sid for sid in sids if self.backlog.depth(sid) < self.backlog.soft_limit]
+            if not caught_up:
+                continue
+            state = snapshot(game)
+            with self._lock:
+                entry = self._behind.get(gameId)
+                if entry is not None:
+                    entry[1].difference_update(caught_up)
+                    if not entry[1]:
+                        del self._behind[gameId]
+            for sid in caught_up:
+                self.socketio.emit('spectator_state', state, to=sid, namespace=self.namespace)
+            self.snapshots_sent += len(caught_up)
+
+
+# Full position of a game for a spectator joining or catching up
+def snapshot(game):
+    with game.lock:
+        return {
+            'gameId': game.gameId,
+            'white': game.player1,
+            'black': game.player2,
+            'game_type': game.gameType,
+            'fen': game.board.fen(),
+            'ply': game.ply(),
+            **game.clock_state(),
+            'turn': 'white' if game.board.turn == chess.WHITE else 'black',
+        }
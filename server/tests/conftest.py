@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The server modules are flat files run from the server directory; make them
+# importable however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,109 @@
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+import flow_control
+from flow_control import ALLOW, CUT_OFF, DEFAULT_LIMITS, REFUSE, WARN, EventLimiter, OutgoingBacklog, parse_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(flow_control.time, 'monotonic', clock)
+    return clock
+
+
+def test_parse_limits():
+    assert parse_limits(None) == DEFAULT_LIMITS
+    assert parse_limits('off') == {}
+    limits = parse_limits('make_move=5/10, resync=2')
+    assert limits['make_move'] == (5.0, 10.0)
+    assert limits['resync'] == (2.0, 2.0)
+    assert limits['join_game'] == DEFAULT_LIMITS['join_game']
+
+
+def test_burst_then_refill(clock):
+    limiter = EventLimiter({'make_move': (2, 3)})
+    assert [limiter.check('s', 'make_move') for _ in range(3)] == [ALLOW] * 3
+    assert limiter.check('s', 'make_move') == WARN
+    assert limiter.check('s', 'make_move') == REFUSE
+    clock.now += 0.5
+    assert limiter.check('s', 'make_move') == ALLOW
+    # Warned again after an allowed event
+    assert limiter.check('s', 'make_move') == WARN
+    assert limiter.retry_after('make_move') == 0.5
+
+
+def test_buckets_are_per_sid_and_event(clock):
+    limiter = EventLimiter({'make_move': (1, 1), 'resync': (1, 1)})
+    assert limiter.check('a', 'make_move') == ALLOW
+    assert limiter.check('a', 'resync') == ALLOW
+    assert limiter.check('b', 'make_move') == ALLOW
+    assert limiter.check('a', 'make_move') == WARN
+    limiter.forget('a')
+    assert limiter.check('a', 'make_move') == ALLOW
+    assert limiter.stats() == {'connections': 2, 'throttled': {'make_move': 1}, 'penalized': 0}
+
+
+def test_flooding_past_the_strikes_cuts_off(clock):
+    limiter = EventLimiter({'make_move': (1, 1)}, strikes=(1, 3))
+    assert limiter.check('s', 'make_move') == ALLOW
+    assert [limiter.check('s', 'make_move') for _ in range(4)] == [WARN, REFUSE, REFUSE, CUT_OFF]
+
+
+def test_penalty_expires(clock):
+    limiter = EventLimiter({}, penalty=30)
+    limiter.penalize(None)
+    limiter.penalize('alice')
+    assert limiter.penalized('alice')
+    assert not limiter.penalized('bob')
+    clock.now += 31
+    assert not limiter.penalized('alice')
+    assert limiter.stats()['penalized'] == 0
+
+
+class FakeSocket:
+    def __init__(self, depth):
+        self.queue = queue.Queue()
+        for _ in range(depth):
+            self.queue.put(None)
+        self.closed = False
+        self.closed_with = None
+
+    def close(self, wait, abort):
+        self.closed_with = (wait, abort)
+
+
+def fake_socketio(depths):
+    # Just the parts of the Flask-SocketIO/engine.io server OutgoingBacklog reads
+    sockets = {'eio-' + sid: FakeSocket(depth) for sid, depth in depths.items()}
+    manager = SimpleNamespace(eio_sid_from_sid=lambda sid, namespace: 'eio-' + sid if 'eio-' + sid in sockets else None,
+                              sid_from_eio_sid=lambda eio_sid, namespace: eio_sid[len('eio-'):])
+    return SimpleNamespace(server=SimpleNamespace(manager=manager, eio=SimpleNamespace(sockets=sockets)))
+
+
+def test_lagging_connections_skip_droppable_updates():
+    backlog = OutgoingBacklog(fake_socketio({'fast': 0, 'slow': 40}), soft_limit=32)
+    assert backlog.lagging(['fast', 'slow', 'gone', None], 'lag_ping') == ['slow']
+    assert backlog.stats()['dropped'] == {'lag_ping': 1}
+
+
+def test_connections_past_the_hard_limit_are_aborted():
+    socketio = fake_socketio({'fast': 3, 'stuck': 50})
+    backlog = OutgoingBacklog(socketio, soft_limit=10, hard_limit=50)
+    backlog._check()
+    sockets = socketio.server.eio.sockets
+    assert sockets['eio-stuck'].closed_with == (False, True)
+    assert sockets['eio-fast'].closed_with is None
+    stats = backlog.stats()
+    assert stats['aborted'] == {'backlog': 1}
+    assert stats['deepest_backlog'] == 50
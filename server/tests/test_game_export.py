@@ -0,0 +1,194 @@
+# /games/export over a seeded database: memory stays flat while a large
+# export streams, keyset batches cover every game once, filters match the
+# equivalent query, and the PGN, NDJSON and gzip bodies decode back to the
+# stored games. GOCHESS_EXPORT_TEST_GAMES sizes the seeded database.
+import gzip
+import io
+import json
+import os
+import sqlite3
+
+import chess.pgn
+import pytest
+
+from benchmarks.export_bench import rss_mb, seed_database
+from move_codec import decode_moves, encode_moves, to_pgn
+
+GAMES = int(os.getenv('GOCHESS_EXPORT_TEST_GAMES', 200000))
+USERS = 200
+MAX_GROWTH_MB = 50
+
+# Games for one extra player, several on the same second, so the user
+# keyset has ties on date_of_game to page through
+TIED_DATES = ['2025-03-01 09:00:00'] * 5 + ['2025-03-02 10:00:00'] * 3 + ['2025-03-03 11:00:00']
+LEGACY_MOVES = [chess.Move.from_uci(uci) for uci in ('e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5')]
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    # app opens chess.db in the working directory, so the whole module runs from the seeded one
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('export'))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('GAME_JOURNAL_DIR', '')
+        patch.setenv('JWT_SECRET_KEY', 'test-secret')
+        seed_database(GAMES, USERS, seed=1)
+        conn = sqlite3.connect('chess.db')
+        tied = conn.execute("INSERT INTO user (username, email, password) VALUES ('tied', 'tied@example.com', 'x')"
+                            ).lastrowid
+        blob = encode_moves(LEGACY_MOVES)
+        for n, played in enumerate(TIED_DATES):
+            white, black = (tied, 1 + n) if n % 2 == 0 else (1 + n, tied)
+            conn.execute("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn, moves, "
+                         "termination, date_of_game) VALUES (?, ?, 'Rapid', 1, '', ?, 'Checkmate', ?)",
+                         (white, black, blob, played))
+        # A game from before the moves column: PGN text only
+        conn.execute("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn, moves, "
+                     "termination, date_of_game) VALUES (?, 1, 'Rapid', 0, ?, NULL, 'Agreement', "
+                     "'2025-03-04 12:00:00')",
+                     (tied, to_pgn(blob, 'tied', 'user0', 'Rapid', 0, 'Agreement', '2025-03-04 12:00:00')))
+        conn.commit()
+        conn.close()
+
+        import app as app_module
+        from flask_jwt_extended import create_access_token
+        with app_module.app.app_context():
+            token = create_access_token(identity='user0@example.com')
+        app_module.test_token = token
+        app_module.tied_userid = tied
+        yield app_module
+    os.chdir(cwd)
+
+
+def query(sql, params=()):
+    conn = sqlite3.connect('chess.db')
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def export(server, params, buffered=True):
+    return server.app.test_client().get('/games/export', query_string=params, buffered=buffered,
+                                        headers={'Authorization': f'Bearer {server.test_token}'})
+
+
+def ndjson_games(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_large_export_streams_in_bounded_memory(server):
+    response = export(server, {'format': 'ndjson'}, buffered=False)
+    assert response.status_code == 200
+    baseline = peak = rss_mb()
+    chunks = games = 0
+    for chunk in response.response:
+        chunks += 1
+        games += chunk.count(b'\n')
+        if chunks % 50 == 0:
+            peak = max(peak, rss_mb())
+    response.close()
+    peak = max(peak, rss_mb())
+    assert games == query('SELECT COUNT(*) FROM game_history')[0][0]
+    # One chunk per batch, not one body
+    assert chunks > 1
+    assert peak - baseline < MAX_GROWTH_MB, f'RSS grew {peak - baseline:.1f} MiB'
+
+
+def test_site_batches_cover_every_game_once(server):
+    from game_export import ExportFilters, export_rows
+    filters = ExportFilters(until='2025-01-05')
+    batches = list(export_rows(server.db_pool, filters, batch_size=37))
+    gameids = [row['gameid'] for rows in batches for row in rows]
+    expected = [gameid for gameid, in query("SELECT gameid FROM game_history WHERE date_of_game < '2025-01-06' "
+                                            "ORDER BY gameid")]
+    assert gameids == expected
+    assert all(len(rows) == 37 for rows in batches[:-1])
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 4, 500])
+def test_user_batches_page_through_tied_dates(server, batch_size):
+    from game_export import ExportFilters, export_rows
+    tied = server.tied_userid
+    rows = [row for rows in export_rows(server.db_pool, ExportFilters(tied), batch_size=batch_size) for row in rows]
+    expected = query('SELECT date_of_game, gameid FROM game_history WHERE userid_1 = ? OR userid_2 = ? '
+                     'ORDER BY date_of_game, gameid', (tied, tied))
+    assert [(row['date_of_game'], row['gameid']) for row in rows] == expected
+    assert len(expected) == len(TIED_DATES) + 1
+
+
+def test_filters_match_the_equivalent_query(server):
+    response = export(server, {'format': 'ndjson', 'userid': 3, 'time_control': 'Blitz',
+                               'since': '2025-02-01', 'until': '2025-05-31'})
+    assert response.status_code == 200
+    games = ndjson_games(response)
+    expected = query("SELECT gameid FROM game_history WHERE (userid_1 = 3 OR userid_2 = 3) "
+                     "AND time_control = 'Blitz' AND date_of_game >= '2025-02-01' AND date_of_game < '2025-06-01' "
+                     "ORDER BY date_of_game, gameid")
+    assert games and [game['gameid'] for game in games] == [gameid for gameid, in expected]
+    assert {game['time_control'] for game in games} == {'Blitz'}
+    assert all(3 in (game['userid_1'], game['userid_2']) for game in games)
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'format': 'csv'}, 'Invalid format'),
+    ({'userid': 'me'}, 'Invalid userid, since or until'),
+    ({'since': '2025-13-01'}, 'Invalid userid, since or until'),
+    ({'until': 'yesterday'}, 'Invalid userid, since or until'),
+    ({'time_control': 'Classical'}, 'Invalid time_control'),
+])
+def test_invalid_parameters_are_rejected(server, params, message):
+    response = export(server, params)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+
+
+def test_export_requires_a_token(server):
+    assert server.app.test_client().get('/games/export').status_code == 401
+
+
+def test_pgn_export(server):
+    tied = server.tied_userid
+    response = export(server, {'format': 'pgn', 'userid': tied})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-chess-pgn'
+    assert response.headers['Content-Disposition'] == f'attachment; filename=games-{tied}.pgn'
+    handle = io.StringIO(response.get_data(as_text=True))
+    games = []
+    while (game := chess.pgn.read_game(handle)) is not None:
+        games.append(game)
+    assert len(games) == len(TIED_DATES) + 1
+    for game in games:
+        assert not game.errors
+        assert 'tied' in (game.headers['White'], game.headers['Black'])
+        assert list(game.mainline_moves()) == LEGACY_MOVES
+    assert games[-1].headers['Termination'] == 'Agreement'
+
+
+def test_ndjson_export(server):
+    tied = server.tied_userid
+    response = export(server, {'format': 'ndjson', 'userid': tied, 'since': '2025-03-02'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == f'attachment; filename=games-{tied}-2025-03-02.ndjson'
+    games = ndjson_games(response)
+    assert [game['date_of_game'] for game in games] == TIED_DATES[5:] + ['2025-03-04 12:00:00']
+    for game in games:
+        assert set(game) == {'gameid', 'date_of_game', 'username_1', 'username_2', 'userid_1', 'userid_2',
+                             'time_control', 'result', 'termination', 'moves'}
+        # The PGN-only game is converted too
+        assert game['moves'] == [move.uci() for move in LEGACY_MOVES]
+    stored = query('SELECT moves FROM game_history WHERE gameid = ?', (games[0]['gameid'],))[0][0]
+    assert games[0]['moves'] == [move.uci() for move in decode_moves(stored)]
+
+
+def test_gzip_export_decompresses_to_the_plain_body(server):
+    params = {'format': 'pgn', 'userid': 5, 'until': '2025-02-15'}
+    plain = export(server, params).get_data()
+    response = export(server, dict(params, gzip='true'))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=games-5.pgn.gz'
+    body = response.get_data()
+    assert body[:2] == b'\x1f\x8b'
+    assert plain and gzip.decompress(body) == plain
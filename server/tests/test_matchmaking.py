@@ -0,0 +1,101 @@
+import pytest
+
+from matchmaking import MatchQueue, Matchmaker, queue_options_from_env
+
+
+def test_first_come_pairing():
+    queue = MatchQueue()
+    assert queue.match_or_enqueue('a', now=0) is None
+    assert queue.match_or_enqueue('b', now=1) == 'a'
+    assert len(queue) == 0
+    assert queue.match_or_enqueue('c', now=2) is None
+    assert queue.players() == ['c']
+
+
+def test_joining_twice_does_not_pair_with_yourself():
+    queue = MatchQueue()
+    assert queue.match_or_enqueue('a', now=0) is None
+    assert queue.match_or_enqueue('a', now=1) is None
+    assert len(queue) == 1
+
+
+def test_cancel_and_pop_oldest():
+    queue = MatchQueue(bucket_size=50)
+    queue.match_or_enqueue('a', 1500, now=0)
+    queue.match_or_enqueue('b', 2000, now=1)
+    queue.match_or_enqueue('c', 1000, now=2)
+    assert queue.cancel('a')
+    assert not queue.cancel('a')
+    assert queue.pop_oldest() == 'b'
+    assert queue.pop_oldest() == 'c'
+    assert queue.pop_oldest() is None
+
+
+def test_rated_pairing_stays_inside_the_window():
+    queue = MatchQueue(bucket_size=50, base_window=100, widen_per_sec=10, max_window=400)
+    assert queue.match_or_enqueue('a', 1500, now=0) is None
+    assert queue.match_or_enqueue('far', 1650, now=0) is None
+    assert queue.match_or_enqueue('near', 1590, now=0) == 'a'
+    assert 'far' in queue
+
+
+def test_longest_waiting_compatible_player_is_chosen():
+    queue = MatchQueue(bucket_size=50)
+    # Too far apart to pair with each other
+    assert queue.match_or_enqueue('older', 1440, now=4) is None
+    assert queue.match_or_enqueue('newer', 1560, now=5) is None
+    assert queue.match_or_enqueue('x', 1500, now=6) == 'older'
+
+
+def test_sweep_pairs_once_windows_widen():
+    queue = MatchQueue(bucket_size=50, base_window=100, widen_per_sec=10, max_window=400)
+    queue.match_or_enqueue('a', 1500, now=0)
+    queue.match_or_enqueue('b', 1750, now=0)
+    queue.match_or_enqueue('c', 2500, now=0)
+    assert queue.sweep(now=10) == []
+    assert queue.sweep(now=15) == [('a', 'b')]
+    # Beyond max_window however long they wait
+    queue.match_or_enqueue('d', 1000, now=15)
+    assert queue.sweep(now=1000) == []
+    assert sorted(queue.players()) == ['c', 'd']
+
+
+def test_unrated_player_matches_anyone_in_a_rated_queue():
+    queue = MatchQueue(bucket_size=50)
+    queue.match_or_enqueue('a', 2400, now=0)
+    assert queue.match_or_enqueue('guest', None, now=1) == 'a'
+
+
+def test_first_come_queue_never_sweeps():
+    queue = MatchQueue()
+    queue.match_or_enqueue('a', now=0)
+    assert queue.sweep(now=1000) == []
+
+
+def test_matchmaker_keeps_one_queue_per_time_control():
+    matchmaker = Matchmaker(['Blitz', 'Rapid'])
+    assert not matchmaker.rated
+    assert matchmaker.join('a', 'Blitz') is None
+    assert matchmaker.join('a', 'Rapid') is None
+    assert matchmaker.join('b', 'Rapid') == 'a'
+    assert matchmaker.depth('Blitz') == 1
+    assert matchmaker.cancel('a') == ['Blitz']
+    with pytest.raises(Exception, match='No such gameType'):
+        matchmaker.join('a', 'Classical')
+
+
+def test_rated_matchmaker_sweeps_every_queue():
+    matchmaker = Matchmaker(['Blitz', 'Rapid'], bucket_size=50)
+    assert matchmaker.rated
+    matchmaker.get_queue('Blitz').match_or_enqueue('a', 1500, now=0)
+    matchmaker.get_queue('Blitz').match_or_enqueue('b', 1700, now=0)
+    assert matchmaker.sweep(now=20) == [('Blitz', 'a', 'b')]
+
+
+def test_queue_options_from_env(monkeypatch):
+    monkeypatch.delenv('MATCH_RATING_BUCKET', raising=False)
+    assert queue_options_from_env() == {}
+    monkeypatch.setenv('MATCH_RATING_BUCKET', '25')
+    monkeypatch.setenv('MATCH_MAX_WINDOW', '300')
+    assert queue_options_from_env() == {'bucket_size': 25.0, 'base_window': 100.0, 'widen_per_sec': 10.0,
+                                        'max_window': 300.0}
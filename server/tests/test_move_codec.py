@@ -0,0 +1,86 @@
+import io
+import sqlite3
+
+import chess
+import chess.pgn
+import pytest
+
+from move_codec import decode_moves, drop_pgn, encode_move, encode_moves, from_pgn, migrate, row_pgn, to_pgn, to_san
+
+# En passant, an underpromotion with capture and castling
+SPECIAL_MOVES = 'e4 d5 exd5 e5 dxe6 Ke7 exf7 Kd6 fxg8=N Kc6 Nf3 Bd6 Bc4 h5 O-O a5 d4 b5 d5+ Kb6'
+
+
+def board_moves(sans):
+    board = chess.Board()
+    return [board.push_san(san) for san in sans.split()]
+
+
+def test_moves_round_trip():
+    moves = board_moves(SPECIAL_MOVES)
+    blob = encode_moves(moves)
+    assert len(blob) == 2 * len(moves)
+    assert decode_moves(blob) == moves
+    assert to_san(blob) == SPECIAL_MOVES.split()
+
+
+@pytest.mark.parametrize('promotion', [chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN])
+def test_promotions_fit_in_sixteen_bits(promotion):
+    move = chess.Move(chess.H7, chess.G8, promotion)
+    assert encode_move(move) < 1 << 16
+    assert decode_moves(encode_moves([move])) == [move]
+
+
+def test_empty_game():
+    assert encode_moves([]) == b''
+    assert decode_moves(b'') == []
+
+
+def test_pgn_matches_python_chess():
+    moves = board_moves(SPECIAL_MOVES)
+    text = to_pgn(encode_moves(moves), 'alice', 'bob "the rook"', 'Blitz', 1, 'Checkmate', '2025-04-05 06:07:08')
+    game = chess.pgn.read_game(io.StringIO(text))
+    assert not game.errors
+    assert list(game.mainline_moves()) == moves
+    # Quotes are escaped as the PGN standard asks (python-chess reads them back verbatim)
+    assert '[Black "bob \\"the rook\\""]' in text.splitlines()
+    assert game.headers['Date'] == '2025.04.05'
+    assert game.headers['Result'] == '1-0'
+    assert game.headers['Termination'] == 'Checkmate'
+    # The exporter writes the same movetext
+    exported = game.accept(chess.pgn.StringExporter(columns=None, headers=False, variations=False, comments=False))
+    assert text.split('\n\n', 1)[1] == exported
+
+
+def test_row_pgn_prefers_stored_text():
+    blob = encode_moves(board_moves('e4 e5'))
+    row = {'pgn': '[Event "old"]\n\n1. d4 *', 'moves': blob, 'username_1': 'a', 'username_2': 'b',
+           'time_control': 'Rapid', 'result': 0, 'termination': None, 'date_of_game': None}
+    assert row_pgn(row) == row['pgn']
+    assert row_pgn(dict(row, pgn='')) == to_pgn(blob, 'a', 'b', 'Rapid', 0)
+
+
+def test_from_pgn_rejects_what_moves_cannot_hold():
+    assert from_pgn('') is None
+    assert from_pgn('[FEN "8/8/8/8/8/8/8/K6k w - - 0 1"]\n\n1. Ka2 *') is None
+    blob, termination = from_pgn(to_pgn(encode_moves(board_moves('e4 e5')), 'a', 'b', 'Rapid', 0, 'Agreement'))
+    assert decode_moves(blob) == board_moves('e4 e5')
+    assert termination == 'Agreement'
+
+
+def test_migrate_then_drop_pgn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE game_history (gameid INTEGER PRIMARY KEY, pgn TEXT NOT NULL, moves BLOB, '
+                 'termination TEXT)')
+    good = to_pgn(encode_moves(board_moves('e4 e5 Nf3')), 'a', 'b', 'Rapid', 2, 'Resignation')
+    conn.executemany('INSERT INTO game_history (pgn) VALUES (?)', [(good,)] * 3 + [('1. e4 e4 *',)])
+    assert migrate(conn, batch_size=2) == (3, 1)
+    rows = conn.execute('SELECT moves, termination FROM game_history ORDER BY gameid').fetchall()
+    assert rows[:3] == [(encode_moves(board_moves('e4 e5 Nf3')), 'Resignation')] * 3
+    assert rows[3] == (None, None)
+
+    # A row whose moves no longer match its text keeps the text
+    conn.execute("UPDATE game_history SET moves = x'' WHERE gameid = 3")
+    assert drop_pgn(conn, batch_size=2) == (2, 1)
+    assert [pgn for pgn, in conn.execute('SELECT pgn FROM game_history ORDER BY gameid')] == \
+        ['', '', good, '1. e4 e4 *']
@@ -0,0 +1,65 @@
+import chess
+
+from position_cache import (STATUS_CHECKMATE, STATUS_INSUFFICIENT_MATERIAL, STATUS_STALEMATE, PositionCache,
+                            position_key, terminal_status)
+
+
+def board_after(sans, fen=chess.STARTING_FEN):
+    board = chess.Board(fen)
+    for san in sans.split():
+        board.push_san(san)
+    return board
+
+
+def test_transpositions_share_a_key():
+    assert position_key(board_after('Nf3 Nf6 Nc3')) == position_key(board_after('Nc3 Nf6 Nf3'))
+
+
+def test_key_tells_apart_what_affects_legality():
+    # Same pieces, different castling rights
+    assert position_key(board_after('Nf3 Nf6 Ng1 Ng8')) == position_key(chess.Board())
+    assert position_key(board_after('Nf3 Nf6 Rg1 Ng8 Rh1 Nf6 Ng1 Ng8')) != position_key(chess.Board())
+    # Same pieces, different side to move
+    board = board_after('e4 e5')
+    other_side = board.copy()
+    other_side.turn = chess.BLACK
+    assert position_key(board) != position_key(other_side)
+    # En passant available or not
+    board = board_after('e4 Nf6 e5 d5')
+    assert board.ep_square == chess.D6
+    no_en_passant = board.copy()
+    no_en_passant.ep_square = None
+    assert position_key(board) != position_key(no_en_passant)
+
+
+def test_terminal_status():
+    assert terminal_status(board_after('f3 e5 g4 Qh4')) == STATUS_CHECKMATE
+    assert terminal_status(chess.Board('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1')) == STATUS_STALEMATE
+    assert terminal_status(chess.Board('8/8/4k3/8/8/3NK3/8/8 w - - 0 1')) == STATUS_INSUFFICIENT_MATERIAL
+    assert terminal_status(chess.Board()) is None
+
+
+def test_lookup_caches_status_and_confirmed_moves():
+    cache = PositionCache()
+    board = board_after('e4 e5')
+    entry = cache.lookup(board)
+    assert entry.status is None and entry.legal_moves is None
+    assert entry.is_legal(board, chess.Move.from_uci('g1f3'))
+    assert not entry.is_legal(board, chess.Move.from_uci('e4e5'))
+    assert entry.legal_moves == {chess.Move.from_uci('g1f3')}
+    assert cache.lookup(board_after('e4 e5')) is entry
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_least_recently_used_position_is_evicted():
+    cache = PositionCache(maxsize=2)
+    first, second, third = board_after('e4'), board_after('d4'), board_after('c4')
+    first_entry = cache.lookup(first)
+    cache.lookup(second)
+    assert cache.lookup(first) is first_entry
+    cache.lookup(third)
+    assert cache.stats()['size'] == 2
+    assert cache.lookup(first) is first_entry
+    misses = cache.stats()['misses']
+    cache.lookup(second)
+    assert cache.stats()['misses'] == misses + 1
@@ -0,0 +1,86 @@
+import random
+import runpy
+import sqlite3
+
+import pytest
+
+from ratings import (INITIAL_RATING, K_ESTABLISHED, K_PROVISIONAL, PROVISIONAL_GAMES, RESULT_BLACK_WINS, RESULT_DRAW,
+                     RESULT_WHITE_WINS, StatsBook, expected_score, k_factor, rebuild, record_games, stats_for_user)
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runpy.run_module('buildDatabase')
+    conn = sqlite3.connect('chess.db')
+    conn.executemany('INSERT INTO user (username, email, password) VALUES (?, ?, ?)',
+                     [(f'user{i}', f'user{i}@example.com', 'x') for i in range(1, 7)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_expected_score():
+    assert expected_score(1500, 1500) == 0.5
+    assert expected_score(1900, 1500) == pytest.approx(10 / 11)
+    assert expected_score(1500, 1900) + expected_score(1900, 1500) == pytest.approx(1)
+
+
+def test_k_factor_drops_once_established():
+    assert k_factor(0) == k_factor(PROVISIONAL_GAMES - 1) == K_PROVISIONAL
+    assert k_factor(PROVISIONAL_GAMES) == K_ESTABLISHED
+
+
+def test_apply_records_results():
+    book = StatsBook()
+    book.apply(1, 2, 'Blitz', RESULT_WHITE_WINS)
+    assert book.get(1, 'Blitz') == [1, 1, 0, 0, INITIAL_RATING + K_PROVISIONAL / 2]
+    assert book.get(2, 'Blitz') == [1, 0, 0, 1, INITIAL_RATING - K_PROVISIONAL / 2]
+    book.apply(1, 2, 'Blitz', RESULT_DRAW)
+    book.apply(2, 1, 'Rapid', RESULT_BLACK_WINS)
+    assert book.get(1, 'Blitz')[:4] == [2, 1, 1, 0]
+    assert book.get(1, 'Rapid')[:4] == [1, 1, 0, 0]
+    # A game against yourself changes nothing
+    book.apply(3, 3, 'Blitz', RESULT_WHITE_WINS)
+    assert (3, 'Blitz') not in book.rows
+    assert sorted(book.changed) == [(1, 'Blitz'), (1, 'Rapid'), (2, 'Blitz'), (2, 'Rapid')]
+
+
+def test_new_player_does_not_swing_an_established_one():
+    book = StatsBook()
+    book.rows[(1, 'Blitz')] = [PROVISIONAL_GAMES, 15, 0, 15, INITIAL_RATING]
+    book.apply(2, 1, 'Blitz', RESULT_WHITE_WINS)
+    assert book.get(2, 'Blitz')[4] - INITIAL_RATING == K_PROVISIONAL / 2
+    assert INITIAL_RATING - book.get(1, 'Blitz')[4] == K_ESTABLISHED / 2
+
+
+def insert_games(conn, games):
+    conn.executemany("INSERT INTO game_history (userid_1, userid_2, time_control, result, pgn) VALUES (?, ?, ?, ?, '')",
+                     games)
+
+
+def test_record_games_in_batches_matches_rebuild(conn):
+    rng = random.Random(3)
+    games = [tuple(rng.sample(range(1, 7), 2)) + (rng.choice(['Blitz', 'Rapid']), rng.randrange(3))
+             for _ in range(200)]
+    # The game writer's batches: insert, then record, in one transaction
+    for start in range(0, len(games), 17):
+        batch = games[start:start + 17]
+        insert_games(conn, batch)
+        record_games(conn.cursor(), [(f'user{w}@example.com', f'user{b}@example.com', tc, result)
+                                     for w, b, tc, result in batch])
+        conn.commit()
+    incremental = conn.execute('SELECT * FROM player_stats ORDER BY userid, time_control').fetchall()
+    assert rebuild(conn) == (200, len(incremental))
+    rebuilt = conn.execute('SELECT * FROM player_stats ORDER BY userid, time_control').fetchall()
+    assert [row[:6] for row in rebuilt] == [row[:6] for row in incremental]
+    assert [row[6] for row in rebuilt] == pytest.approx([row[6] for row in incremental])
+    assert sum(row[2] for row in rebuilt) == 2 * len(games)
+
+
+def test_record_games_skips_deleted_players(conn):
+    record_games(conn.cursor(), [('user1@example.com', 'gone@example.com', 'Blitz', RESULT_WHITE_WINS),
+                                 ('user1@example.com', 'user2@example.com', 'Blitz', RESULT_BLACK_WINS)])
+    stats = stats_for_user(conn.cursor(), 1)
+    assert stats == {'Blitz': {'games': 1, 'wins': 0, 'draws': 0, 'losses': 1,
+                               'rating': round(INITIAL_RATING - K_PROVISIONAL / 2)}}
@@ -0,0 +1,154 @@
+import json
+
+import pytest
+
+from tournament import ARENA, CREATED, FINISHED, RUNNING, SWISS, Tournament
+
+
+def tournament(kind, players, **options):
+    tournament = Tournament('t1', 'Test', 'Blitz', kind, created_by='p0', **options)
+    for i, rating in enumerate(players):
+        tournament.join(f'p{i}', rating)
+    return tournament
+
+
+def play_pass(tournament, now, winner=lambda white, black: white):
+    # Pairs whoever is waiting, starts their games and plays them all out
+    pairs = tournament.pair(set(tournament.waiting()), now=now)
+    games = [(f'g{now}-{i}', white, black) for i, (white, black) in enumerate(pairs)]
+    tournament.started(games)
+    for gameId, white, black in games:
+        tournament.record(gameId, winner(white, black))
+    return pairs
+
+
+def test_swiss_rounds_avoid_rematches_and_repeat_byes():
+    swiss = tournament(SWISS, [1500 + 10 * i for i in range(7)], rounds=3)
+    assert swiss.pair({'p0', 'p1'}, now=0) == []  # Not started
+    assert swiss.start(now=0)
+    met = set()
+    byes = []
+    for number in range(1, 4):
+        pairs = play_pass(swiss, number)
+        assert len(pairs) == 3
+        for white, black in pairs:
+            assert frozenset((white, black)) not in met
+            met.add(frozenset((white, black)))
+        byes.append(swiss.last_bye)
+        assert swiss.round == number
+    assert len(set(byes)) == 3
+    assert swiss.pair(set(swiss.waiting()), now=4) == []
+    assert swiss.finish_if_done(now=4)
+    assert swiss.state == FINISHED
+    standings = swiss.standings()
+    assert sum(row['score'] for row in standings) == 3 * 3 + 3  # a point per game and per bye
+    assert [row['score'] for row in standings] == sorted((row['score'] for row in standings), reverse=True)
+    with pytest.raises(Exception, match='Tournament is over'):
+        swiss.join('late', 1500)
+
+
+def test_swiss_waits_for_the_round_to_finish():
+    swiss = tournament(SWISS, [1500, 1600, 1700, 1800], rounds=2)
+    swiss.start(now=0)
+    pairs = swiss.pair(set(swiss.waiting()), now=0)
+    # Best ranked meets the top of the bottom half
+    assert {frozenset(pair) for pair in pairs} == {frozenset(('p3', 'p1')), frozenset(('p2', 'p0'))}
+    swiss.started([('a', *pairs[0]), ('b', *pairs[1])])
+    assert swiss.waiting() == []
+    assert not swiss.record('a', None)
+    assert swiss.pair({'p0', 'p1', 'p2', 'p3'}, now=1) == []
+    assert swiss.record('b', pairs[1][1])
+    assert not swiss.finish_if_done(now=1)
+    assert len(swiss.pair(set(swiss.waiting()), now=1)) == 2
+
+
+def test_colors_alternate():
+    swiss = tournament(SWISS, [1500, 1600], rounds=2)
+    swiss.start(now=0)
+    (first_white, _), = play_pass(swiss, 1, winner=lambda white, black: None)
+    (second_white, _), = play_pass(swiss, 2, winner=lambda white, black: None)
+    assert first_white != second_white
+
+
+def test_arena_streaks_score_double():
+    arena = tournament(ARENA, [1800, 1700, 1600, 1500], duration=60)
+    arena.start(now=0)
+    for now in range(1, 4):
+        play_pass(arena, now, winner=lambda white, black: 'p0' if 'p0' in (white, black) else white)
+    row = arena.standings()[0]
+    assert (row['player'], row['wins']) == ('p0', 3)
+    # 1 + 1 + 2 points: the third win in a row counts double
+    assert row['score'] == 4
+
+
+def test_arena_does_not_repeat_the_last_game():
+    arena = tournament(ARENA, [1800, 1700], duration=60)
+    arena.start(now=0)
+    assert len(play_pass(arena, 1)) == 1
+    assert arena.pair({'p0', 'p1'}, now=2) == []
+
+
+def test_arena_steps_around_the_last_opponent():
+    arena = tournament(ARENA, [1800, 1700, 1600], duration=60)
+    arena.start(now=0)
+    arena.players['p0'].last_opponent = 'p1'
+    assert arena.pair({'p0', 'p1', 'p2'}, now=1) == [('p0', 'p2')]
+
+
+def test_arena_ends_on_time():
+    arena = tournament(ARENA, [1800, 1700], duration=60)
+    arena.start(now=0)
+    assert not arena.finish_if_done(now=30)
+    assert arena.pair({'p0', 'p1'}, now=60) == []
+    assert arena.finish_if_done(now=60)
+
+
+def test_withdrawn_players_are_not_paired():
+    arena = tournament(ARENA, [1800, 1700, 1600], duration=60)
+    arena.start(now=0)
+    assert arena.withdraw('p0')
+    assert not arena.withdraw('nobody')
+    assert arena.pair({'p0', 'p1', 'p2'}, now=1) == [('p1', 'p2')]
+
+
+def test_cancelled_games_free_their_players():
+    arena = tournament(ARENA, [1800, 1700], duration=60)
+    arena.start(now=0)
+    pairs = arena.pair({'p0', 'p1'}, now=1)
+    arena.started([('g', *pairs[0])])
+    arena.cancelled(['g'])
+    assert sorted(arena.waiting()) == ['p0', 'p1']
+    assert not arena.record('g', 'p0')
+
+
+def test_rank_of_follows_results():
+    arena = tournament(ARENA, [1800, 1700, 1600, 1500], duration=60)
+    assert arena.rank_of('p3') == 4
+    assert arena.rank_of('nobody') is None
+    arena.start(now=0)
+    play_pass(arena, 1, winner=lambda white, black: 'p3' if 'p3' in (white, black) else None)
+    assert arena.rank_of('p3') == 1
+    assert [row['rank'] for row in arena.standings(offset=1, limit=2)] == [2, 3]
+
+
+def test_snapshot_round_trip():
+    swiss = tournament(SWISS, [1500, 1600, 1700], rounds=2)
+    swiss.start(now=0)
+    play_pass(swiss, 1)
+    pairs = swiss.pair(set(swiss.waiting()), now=2)
+    swiss.started([('live', *pairs[0])])
+    restored = Tournament.from_dict(json.loads(json.dumps(swiss.to_dict())))
+    assert restored.to_dict() == swiss.to_dict()
+    assert restored.standings() == swiss.standings()
+    assert restored.state == RUNNING
+    assert restored.games == {'live': pairs[0]}
+    assert restored.record('live', pairs[0][0])
+    assert restored.finish_if_done(now=3)
+
+
+def test_start_only_once():
+    swiss = tournament(SWISS, [1500], rounds=1)
+    assert swiss.state == CREATED
+    assert swiss.start(now=5)
+    assert not swiss.start(now=6)
+    assert swiss.starts_at == 5
@@ -0,0 +1,364 @@
+import bisect
+import itertools
+import time
+
+from metrics import timed_lock
+
+# Arena and Swiss tournaments played over the ordinary game path.
+#
+# A Swiss tournament plays a fixed number of rounds, each paired in one pass
+# over the field: players ranked by score and rating are taken a score group
+# at a time, the top half of a group meeting the bottom half, skipping pairs
+# that already met. Whoever can't be paired inside their group floats down to
+# the next one. With an odd field the lowest ranked player without a bye sits
+# out for a win. The next round is paired once the last game of this one ends.
+#
+# An arena runs for a fixed time. Every pairing pass matches the players who
+# are not in a game with their neighbours in the standings, except the one
+# they just played. A win after two wins in a row scores double.
+#
+# Scores are in half points: win 2, draw 1, loss 0. The standings are a sorted
+# list of rank keys; a result moves its two players with a bisect each, so a
+# game_over costs O(log n) comparisons rather than a sort of the field.
+
+ARENA, SWISS = 'arena', 'swiss'
+KINDS = (ARENA, SWISS)
+
+# Tournament.state
+CREATED, RUNNING, FINISHED = 'created', 'running', 'finished'
+
+WIN, DRAW, LOSS = 2, 1, 0
+
+
+class Standing:
+    __slots__ = ('player', 'rating', 'seq', 'score', 'wins', 'draws', 'losses', 'byes', 'opponents',
+                 'last_opponent', 'colors', 'last_white', 'streak', 'playing', 'withdrawn')
+
+    def __init__(self, player, rating, seq):
+        self.player = player
+        self.rating = rating
+        # Join order, the last tie-break
+        self.seq = seq
+        self.score = 0
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.byes = 0
+        self.opponents = set()
+        self.last_opponent = None
+        # Games as White minus games as Black
+        self.colors = 0
+        self.last_white = None
+        # Wins in a row (arena)
+        self.streak = 0
+        self.playing = False
+        self.withdrawn = False
+
+    def key(self):
+        return (-self.score, -self.wins, -self.rating, self.seq)
+
+    def row(self):
+        return {'player': self.player, 'rating': self.rating, 'score': self.score / 2,
+                'games': self.wins + self.draws + self.losses, 'wins': self.wins, 'draws': self.draws,
+                'losses': self.losses, 'byes': self.byes, 'playing': self.playing, 'withdrawn': self.withdrawn}
+
+
+def assign_colors(a, b):
+    # (white, black): White to whoever has had it less; on a tie, the opposite
+    # of what the better ranked player (a) had last
+    if a.colors != b.colors:
+        return (a, b) if a.colors < b.colors else (b, a)
+    return (b, a) if a.last_white else (a, b)
+
+
+def _pair_group(pool):
+    # Top half against bottom half, each top player taking the best ranked
+    # bottom player they haven't met. Returns the pairs and who is left over.
+    half = len(pool) // 2
+    top, bottom = pool[:half], pool[half:]
+    pairs, left = [], []
+    for a in top:
+        for i, b in enumerate(bottom):
+            if b.player not in a.opponents:
+                pairs.append((a, bottom.pop(i)))
+                break
+        else:
+            left.append(a)
+    return pairs, left + bottom
+
+
+def pair_swiss(field):
+    # field: Standings to pair, best ranked first. Returns ([(white, black)], bye Standing or None).
+    field = list(field)
+    bye = None
+    if len(field) % 2:
+        for i in range(len(field) - 1, -1, -1):
+            if not field[i].byes:
+                bye = field.pop(i)
+                break
+        else:
+            bye = field.pop()
+    pairs = []
+    floaters = []
+    for _, group in itertools.groupby(field, key=lambda standing: standing.score):
+        paired, floaters = _pair_group(floaters + list(group))
+        pairs.extend(paired)
+    # Met everyone they could still be paired with: a rematch beats sitting out
+    pairs.extend(zip(floaters[0::2], floaters[1::2]))
+    return [assign_colors(a, b) for a, b in pairs], bye
+
+
+def pair_arena(waiting):
+    # waiting: Standings not in a game, best ranked first. Neighbours meet
+    # unless they just played each other, in which case the next one steps in.
+    waiting = list(waiting)
+    pairs = []
+    i = 0
+    while i + 1 < len(waiting):
+        a = waiting[i]
+        if waiting[i + 1].player == a.last_opponent and i + 2 < len(waiting):
+            waiting[i + 1], waiting[i + 2] = waiting[i + 2], waiting[i + 1]
+        b = waiting[i + 1]
+        if b.player == a.last_opponent:
+            break
+        pairs.append(assign_colors(a, b))
+        i += 2
+    return pairs
+
+
+class Tournament:
+    def __init__(self, tournamentId, name, game_type, kind, rounds=None, duration=None, created_by=None):
+        # rounds: Swiss only; duration: arena only, in seconds
+        self.tournamentId = tournamentId
+        self.name = name
+        self.game_type = game_type
+        self.kind = kind
+        self.rounds = rounds
+        self.duration = duration
+        self.created_by = created_by
+        self.lock = timed_lock('tournament')
+        self.state = CREATED
+        self.round = 0
+        # Wall-clock start the creator asked for, and the actual start
+        self.scheduled_start = None
+        self.starts_at = None
+        self.ends_at = None
+        # Who sat out the last Swiss round, for the journal
+        self.last_bye = None
+        # player -> Standing, and the standings as sorted rank keys; key[-1] indexes _by_seq
+        self.players = {}
+        self._ranking = []
+        self._by_seq = []
+        # gameId -> (white, black) of the games in progress
+        self.games = {}
+        self.games_played = 0
+
+    def join(self, player, rating):
+        with self.lock:
+            if self.state == FINISHED:
+                raise Exception("Tournament is over")
+            standing = self.players.get(player)
+            if standing is None:
+                standing = self.players[player] = Standing(player, rating, len(self._by_seq))
+                self._by_seq.append(standing)
+                bisect.insort(self._ranking, standing.key())
+            standing.withdrawn = False
+            return standing.row()
+
+    def withdraw(self, player):
+        # Stays in the standings; a game in progress still counts
+        with self.lock:
+            standing = self.players.get(player)
+            if standing is None:
+                return False
+            standing.withdrawn = True
+            return True
+
+    def start(self, now=None):
+        with self.lock:
+            if self.state != CREATED:
+                return False
+            self.state = RUNNING
+            self.starts_at = time.time() if now is None else now
+            if self.kind == ARENA:
+                self.ends_at = self.starts_at + self.duration
+            return True
+
+    def waiting(self):
+        # Players that a pairing would consider, before checking they are around
+        with self.lock:
+            return [player for player, standing in self.players.items()
+                    if not standing.withdrawn and not standing.playing]
+
+    def pair(self, available, now=None):
+        # One Swiss round or arena pass over the players in available (a set;
+        # see waiting()). Returns the [(white, black)] to start, marked as playing; a
+        # Swiss bye is scored at once.
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.state != RUNNING:
+                return []
+            field = [standing for standing in self.ranked()
+                     if not standing.withdrawn and not standing.playing and standing.player in available]
+            if self.kind == SWISS:
+                if self.games or self.round >= self.rounds:
+                    return []
+                self.round += 1
+                pairs, bye = pair_swiss(field)
+                self.last_bye = bye.player if bye is not None else None
+                if bye is not None:
+                    self._update(bye, self._score_bye)
+            else:
+                if now >= self.ends_at:
+                    return []
+                pairs = pair_arena(field)
+            for white, black in pairs:
+                white.playing = black.playing = True
+            return [(white.player, black.player) for white, black in pairs]
+
+    def started(self, games):
+        # games: (gameId, white, black) for pairs returned by pair()
+        with self.lock:
+            for gameId, white, black in games:
+                self.games[gameId] = (white, black)
+
+    def replay_round(self, number, bye):
+        # A Swiss round paired before a restart, as the journal has it
+        with self.lock:
+            self.round = number
+            self.last_bye = bye
+            if bye is not None:
+                self._update(self.players[bye], self._score_bye)
+
+    def resume_game(self, gameId, white, black):
+        # A game in progress before a restart
+        with self.lock:
+            self.games[gameId] = (white, black)
+            self.players[white].playing = self.players[black].playing = True
+
+    def cancelled(self, gameIds):
+        # Games passed to started() that could not be started after all
+        with self.lock:
+            for gameId in gameIds:
+                for player in self.games.pop(gameId, ()):
+                    self.players[player].playing = False
+
+    def record(self, gameId, winner):
+        # Applies a finished game. Returns True if no game is left in progress.
+        with self.lock:
+            players = self.games.pop(gameId, None)
+            if players is None:
+                return False
+            white, black = (self.players[player] for player in players)
+            for standing, opponent, is_white in ((white, black, True), (black, white, False)):
+                outcome = DRAW if winner is None else WIN if winner == standing.player else LOSS
+                self._update(standing, lambda standing: self._score_game(standing, opponent, is_white, outcome))
+            self.games_played += 1
+            return not self.games
+
+    def finish_if_done(self, now=None):
+        # Over once no game is left to wait for: a Swiss after its last round, an arena past its end
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.state == RUNNING and not self.games:
+                if self.round >= self.rounds if self.kind == SWISS else now >= self.ends_at:
+                    self.state = FINISHED
+            return self.state == FINISHED
+
+    def ranked(self):
+        # Must hold self.lock: Standings best first
+        return [self._by_seq[key[-1]] for key in self._ranking]
+
+    def standings(self, offset=0, limit=50):
+        with self.lock:
+            return [dict(self._by_seq[key[-1]].row(), rank=offset + i + 1)
+                    for i, key in enumerate(self._ranking[offset:offset + limit])]
+
+    def rank_of(self, player):
+        with self.lock:
+            standing = self.players.get(player)
+            return bisect.bisect_left(self._ranking, standing.key()) + 1 if standing else None
+
+    def summary(self):
+        with self.lock:
+            return {
+                'tournamentId': self.tournamentId,
+                'name': self.name,
+                'game_type': self.game_type,
+                'kind': self.kind,
+                'state': self.state,
+                'round': self.round,
+                'rounds': self.rounds,
+                'scheduled_start': self.scheduled_start,
+                'starts_at': self.starts_at,
+                'ends_at': self.ends_at,
+                'players': len(self.players),
+                'games_in_progress': len(self.games),
+                'games_played': self.games_played,
+                'created_by': self.created_by,
+            }
+
+    def to_dict(self):
+        # Everything from_dict needs, as JSON types; for the game journal's snapshot
+        with self.lock:
+            return {
+                'tournamentId': self.tournamentId, 'name': self.name, 'game_type': self.game_type,
+                'kind': self.kind, 'rounds': self.rounds, 'duration': self.duration,
+                'created_by': self.created_by, 'state': self.state, 'round': self.round,
+                'scheduled_start': self.scheduled_start, 'starts_at': self.starts_at, 'ends_at': self.ends_at,
+                'last_bye': self.last_bye, 'games_played': self.games_played,
+                'games': {gameId: list(players) for gameId, players in self.games.items()},
+                # In join order
+                'players': [[s.player, s.rating, s.score, s.wins, s.draws, s.losses, s.byes, sorted(s.opponents),
+                             s.last_opponent, s.colors, s.last_white, s.streak, s.withdrawn]
+                            for s in self._by_seq],
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        tournament = cls(data['tournamentId'], data['name'], data['game_type'], data['kind'],
+                         rounds=data['rounds'], duration=data['duration'], created_by=data['created_by'])
+        for name in ('state', 'round', 'scheduled_start', 'starts_at', 'ends_at', 'last_bye', 'games_played'):
+            setattr(tournament, name, data[name])
+        for seq, (player, rating, score, wins, draws, losses, byes, opponents, last_opponent, colors, last_white,
+                  streak, withdrawn) in enumerate(data['players']):
+            standing = Standing(player, rating, seq)
+            standing.score, standing.wins, standing.draws, standing.losses, standing.byes = (
+                score, wins, draws, losses, byes)
+            standing.opponents = set(opponents)
+            standing.last_opponent, standing.colors, standing.last_white, standing.streak, standing.withdrawn = (
+                last_opponent, colors, last_white, streak, withdrawn)
+            tournament.players[player] = standing
+            tournament._by_seq.append(standing)
+        tournament._ranking = sorted(standing.key() for standing in tournament._by_seq)
+        for gameId, (white, black) in data['games'].items():
+            tournament.resume_game(gameId, white, black)
+        return tournament
+
+    def _update(self, standing, change):
+        # Must hold self.lock: apply change and move the player to their new place
+        del self._ranking[bisect.bisect_left(self._ranking, standing.key())]
+        change(standing)
+        bisect.insort(self._ranking, standing.key())
+
+    def _score_bye(self, standing):
+        standing.byes += 1
+        standing.score += WIN
+
+    def _score_game(self, standing, opponent, is_white, outcome):
+        points = outcome
+        if self.kind == ARENA and standing.streak >= 2:
+            points *= 2
+        standing.score += points
+        standing.streak = standing.streak + 1 if outcome == WIN else 0
+        if outcome == WIN:
+            standing.wins += 1
+        elif outcome == DRAW:
+            standing.draws += 1
+        else:
+            standing.losses += 1
+        standing.opponents.add(opponent.player)
+        standing.last_opponent = opponent.player
+        standing.colors += 1 if is_white else -1
+        standing.last_white = is_white
+        standing.playing = False
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Every taken username and email, so availability checks don't query the
+# database. Warmed from the user table at startup and added to on sign-up.
+# Users created by other workers (or by hand) are picked up by reading rows
+# past the highest userid seen, at most once per refresh_interval, when a
+# name isn't found. Users are never deleted, so "taken" is always right;
+# "available" can be up to refresh_interval stale, and the UNIQUE
+# constraints still have the final say at sign-up.
+class IdentityIndex:
+    def __init__(self, pool, refresh_interval=1.0):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self._usernames = set()
+        self._emails = set()
+        self._max_userid = 0
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+
+    def warm(self):
+        self._load()
+
+    def _load(self):
+        conn = self.pool.acquire()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT userid, username, email FROM user WHERE userid > ? ORDER BY userid',
+                        (self._max_userid,))
+            rows = cur.fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for userid, username, email in rows:
+                self._usernames.add(username)
+                self._emails.add(email)
+                self._max_userid = max(self._max_userid, userid)
+            self._last_refresh = time.monotonic()
+            self.refreshes += 1
+
+    def _taken(self, names, value):
+        with self._lock:
+            if value in names:
+                self.hits += 1
+                return True
+            stale = time.monotonic() - self._last_refresh >= self.refresh_interval
+            if not stale:
+                self.hits += 1
+                return False
+        self._load()
+        with self._lock:
+            return value in names
+
+    def username_taken(self, username):
+        return self._taken(self._usernames, username)
+
+    def email_taken(self, email):
+        return self._taken(self._emails, email)
+
+    def add(self, username, email):
+        with self._lock:
+            self._usernames.add(username)
+            self._emails.add(email)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.refreshes
+            return {
+                'usernames': len(self._usernames),
+                'emails': len(self._emails),
+                'hits': self.hits,
+                'refreshes': self.refreshes,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Read-through LRU with a time to live. Writers call invalidate() for the keys
+# they change; the TTL bounds staleness from writes this process doesn't see.
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate(), so a load that raced a write isn't cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        value = loader(key)
+        # Misses (None) aren't cached: the row may be created a moment later
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (now + self.ttl, value)
+                    self._entries.move_to_end(key)
+                    if len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }